@@ -1,16 +1,77 @@
-import duckdb
 import os
+import glob
+import time
+import importlib
 import logging
+import numpy as np
 import pandas as pd
 import config
-from geospatial import get_congestion_zones
+import daily_cube
+import db
+import profiling
+import query_cache
+import raw_manifest
+import results_bundle
+import trip_store
 
 # Setup Logger
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+def get_congestion_zones():
+    # geospatial (and geopandas behind it) only loads for stages that need zones
+    import geospatial
+    return geospatial.get_congestion_zones()
+
 def create_connection():
-    return duckdb.connect()
+    # Memory limit, threads and spill directory come from config (see db.py)
+    return db.create_connection()
+
+def cached_df(con, query, inputs):
+    """con.execute(query).df(), reused while the query and its input files are unchanged."""
+    return query_cache.cached_query(con, query, inputs)
+
+def _cube_files():
+    return sorted(glob.glob(os.path.join(daily_cube.DAILY_DIR, '*.parquet')))
+
+# Ghost Trip Rules
+# Shared by the SQL below and by vectorized callers (Dask backend, replay).
+GHOST_MAX_SPEED_MPH = 65
+GHOST_TELEPORT_SECONDS = 60
+GHOST_TELEPORT_MIN_FARE = 20
+
+# Rule expressions over all_trips columns (ghost audit and daily cube)
+GHOST_FILTER_SQL = f"""(trip_distance > 0 AND (trip_distance / (NULLIF(date_diff('second', pickup_datetime, dropoff_datetime),0) / 3600.0)) > {GHOST_MAX_SPEED_MPH})
+       OR (date_diff('second', pickup_datetime, dropoff_datetime) < {GHOST_TELEPORT_SECONDS} AND fare_amount > {GHOST_TELEPORT_MIN_FARE})
+       OR (trip_distance = 0 AND fare_amount > 0)"""
+
+GHOST_STATUS_SQL = f"""CASE
+            WHEN (trip_distance > 0 AND (trip_distance / (NULLIF(date_diff('second', pickup_datetime, dropoff_datetime),0) / 3600.0)) > {GHOST_MAX_SPEED_MPH}) THEN 'Impossible Speed'
+            WHEN (date_diff('second', pickup_datetime, dropoff_datetime) < {GHOST_TELEPORT_SECONDS} AND fare_amount > {GHOST_TELEPORT_MIN_FARE}) THEN 'Teleporter'
+            WHEN (trip_distance = 0 AND fare_amount > 0) THEN 'Stationary'
+            ELSE 'Valid'
+        END"""
+
+def classify_ghost_trips(trip_distance, duration_seconds, fare_amount):
+    """
+    Vectorized ghost rules for array-like inputs; returns each trip's audit_status
+    ('Impossible Speed', 'Teleporter', 'Stationary' or 'Valid'). Like SQL NULLs,
+    missing values never match a rule.
+    """
+    distance = np.asarray(trip_distance, dtype='float64')
+    duration = np.asarray(duration_seconds, dtype='float64')
+    fare = np.asarray(fare_amount, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.where(duration != 0, distance / (duration / 3600.0), np.nan)
+    return np.select(
+        [
+            (distance > 0) & (speed > GHOST_MAX_SPEED_MPH),
+            (duration < GHOST_TELEPORT_SECONDS) & (fare > GHOST_TELEPORT_MIN_FARE),
+            (distance == 0) & (fare > 0),
+        ],
+        ['Impossible Speed', 'Teleporter', 'Stationary'],
+        'Valid'
+    )
 
 def run_ghost_trip_audit(con):
     """
@@ -19,69 +80,16 @@ def run_ghost_trip_audit(con):
     1. Impossible Speed: > 65 MPH
     2. Teleporter: Time < 1 min (< 60s) AND Fare > $20
     3. Stationary: Distance = 0 AND Fare > 0
+    Reads trips, so months imputed only into the daily cube are excluded.
     """
+    import imputation
     logger.info("Running Ghost Trip Audit...")
+    imputation.warn_cube_only('Ghost Trip Audit', config.YEAR_2025)
     
-    # We query all 2025 data
-    # Note: We can use a glob pattern for all 2025 files
-    # The files are in data/raw/
-    # pattern: data/raw/*_tripdata_2025-*.parquet
-    
-    file_pattern = os.path.join(config.RAW_DIR, "*_tripdata_2025-*.parquet")
+    # all_trips_2025 (trip store or raw files); a no-op re-definition inside run_stages
+    setup_global_views(con)
     
-    # Need to normalize column names if they differ between Yellow and Green, 
-    # but DuckDB's read_parquet with union_by_name=True usually handles it.
-    # Yellow: tpep_pickup_datetime, Green: lpep_pickup_datetime
-    # We might need to handle this.
-    # A cleaner way is to create a View that unifies them first.
-    
-    # Let's try to define a view with coalesced columns.
-    # However, globbing *2025*.parquet mixes yellow and green.
-    # Yellow schema != Green schema completely.
-    # It's better to process Yellow and Green separately or UNION them with specific columns.
-    
-    # Let's create a unified view `all_trips_2025`
-    # We only need specific columns: pickup, dropoff, distance, fare, surcharge, pulocation, dolocation
-    
-    # Yellow
-    q_yellow = f"""
-SELECT 
-    VendorID,
-    tpep_pickup_datetime as pickup_datetime,
-    tpep_dropoff_datetime as dropoff_datetime,
-    trip_distance,
-    fare_amount,
-    total_amount,
-    tip_amount,
-    congestion_surcharge,
-    PULocationID,
-    DOLocationID,
-    'Yellow' as taxi_type
-FROM '{os.path.join(config.RAW_DIR, 'yellow_tripdata_2025-*.parquet')}'
-"""
-
-    q_green = f"""
-SELECT 
-    VendorID,
-    lpep_pickup_datetime as pickup_datetime,
-    lpep_dropoff_datetime as dropoff_datetime,
-    trip_distance,
-    fare_amount,
-    total_amount,
-    tip_amount,
-    congestion_surcharge,
-    PULocationID,
-    DOLocationID,
-    'Green' as taxi_type
-FROM '{os.path.join(config.RAW_DIR, 'green_tripdata_2025-*.parquet')}'
-"""
-
-    con.execute(f"CREATE OR REPLACE VIEW all_trips_2025 AS {q_yellow} UNION ALL {q_green}")
-    
-    # Calculate duration in hours and seconds
-    # DuckDB: date_diff('second', pickup, dropoff)
-    
-    ghost_query = """
+    ghost_query = f"""
     SELECT *,
         date_diff('second', pickup_datetime, dropoff_datetime) as duration_seconds,
         CASE 
@@ -89,40 +97,36 @@ FROM '{os.path.join(config.RAW_DIR, 'green_tripdata_2025-*.parquet')}'
             THEN trip_distance / (date_diff('second', pickup_datetime, dropoff_datetime) / 3600.0)
             ELSE 0 
         END as speed_mph,
-        CASE
-            WHEN (trip_distance > 0 AND (trip_distance / (NULLIF(date_diff('second', pickup_datetime, dropoff_datetime),0) / 3600.0)) > 65) THEN 'Impossible Speed'
-            WHEN (date_diff('second', pickup_datetime, dropoff_datetime) < 60 AND fare_amount > 20) THEN 'Teleporter'
-            WHEN (trip_distance = 0 AND fare_amount > 0) THEN 'Stationary'
-            ELSE 'Valid'
-        END as audit_status
+        {GHOST_STATUS_SQL} as audit_status
     FROM all_trips_2025
     WHERE 
-       (trip_distance > 0 AND (trip_distance / (NULLIF(date_diff('second', pickup_datetime, dropoff_datetime),0) / 3600.0)) > 65)
-       OR (date_diff('second', pickup_datetime, dropoff_datetime) < 60 AND fare_amount > 20)
-       OR (trip_distance = 0 AND fare_amount > 0)
+       {GHOST_FILTER_SQL}
     """
     
+    # Sorted by pickup time in small row groups so the dashboard's ghost trip
+    # explorer can skip row groups on date filters (see ghost_explorer.py)
     output_path = os.path.join(config.OUTPUTS_DIR, 'audit_ghost_trips.parquet')
-    con.execute(f"COPY ({ghost_query}) TO '{output_path}' (FORMAT PARQUET)")
+    con.execute(f"""
+    COPY ({ghost_query} ORDER BY pickup_datetime)
+    TO '{output_path}' ({db.parquet_copy_options(config.TRIP_STORE_ROW_GROUP_SIZE)})
+    """)
     logger.info(f"Ghost Trip Audit saved to {output_path}")
 
     # Suspicious Vendors Analysis
     # We aggregate by VendorID (usually 1=Creative Mobile, 2=Verifone)
-    vendor_audit_query = """
+    vendor_audit_query = f"""
     SELECT 
         VendorID,
         count(*) as ghost_trip_count
     FROM all_trips_2025
     WHERE 
-       (trip_distance > 0 AND (trip_distance / (NULLIF(date_diff('second', pickup_datetime, dropoff_datetime),0) / 3600.0)) > 65)
-       OR (date_diff('second', pickup_datetime, dropoff_datetime) < 60 AND fare_amount > 20)
-       OR (trip_distance = 0 AND fare_amount > 0)
+       {GHOST_FILTER_SQL}
     GROUP BY VendorID
-    ORDER BY ghost_trip_count DESC
+    ORDER BY ghost_trip_count DESC, VendorID
     LIMIT 5
     """
-    df_vendors = con.execute(vendor_audit_query).df()
-    df_vendors.to_csv(os.path.join(config.OUTPUTS_DIR, 'suspicious_vendors.csv'), index=False)
+    df_vendors = cached_df(con, vendor_audit_query, stage_input_files('ghost'))
+    results_bundle.write_table('suspicious_vendors', df_vendors)
     logger.info("Suspicious Vendor Audit Complete.")
 
 def run_leakage_audit(con):
@@ -159,24 +163,32 @@ def run_leakage_audit(con):
         AND (congestion_surcharge IS NULL OR congestion_surcharge = 0)
     """
     
+    # Eligible trips and missing surcharges come from the daily cube (date, pickup
+    # zone, drop-off-in-zone), so the date cutoff needs no trip scan.
+    daily_cube.build_cube(zone_ids)
+    daily_cube.register_views(con)
+    eligible_filter = f"""
+        source_year = {config.YEAR_2025}
+        AND date >= DATE '2025-01-05'
+        AND PULocationID NOT IN ({zone_list_str})
+        AND do_in_zone
+    """
+    
     # We want a more detailed report: Top 3 pickup locations with missing surcharges
     top_leakage_query = f"""
     SELECT 
         PULocationID,
-        count(*) as missing_surcharge_trips
-    FROM all_trips_2025
-    WHERE 
-        pickup_datetime >= '2025-01-05'
-        AND PULocationID NOT IN ({zone_list_str})
-        AND DOLocationID IN ({zone_list_str})
-        AND (congestion_surcharge IS NULL OR congestion_surcharge = 0)
+        CAST(SUM(missing_surcharge_trips) AS BIGINT) as missing_surcharge_trips
+    FROM daily_cube
+    WHERE {eligible_filter}
     GROUP BY PULocationID
-    ORDER BY missing_surcharge_trips DESC
+    HAVING SUM(missing_surcharge_trips) > 0
+    ORDER BY missing_surcharge_trips DESC, PULocationID
     LIMIT 3
     """
     
-    df_top = con.execute(top_leakage_query).df()
-    df_top.to_csv(os.path.join(config.OUTPUTS_DIR, 'leakage_top_locations.csv'), index=False)
+    df_top = cached_df(con, top_leakage_query, _cube_files())
+    results_bundle.write_table('leakage_top_locations', df_top)
     
     # Also calculate overall compliance rate
     # Compliance = 1 - (Leakage / Total Eligible Trips)
@@ -184,35 +196,63 @@ def run_leakage_audit(con):
     
     compliance_query = f"""
     SELECT
-        COUNT(*) FILTER (WHERE congestion_surcharge > 0) as paid_trips,
-        COUNT(*) as total_eligible_trips,
-        (COUNT(*) FILTER (WHERE congestion_surcharge > 0) * 100.0 / NULLIF(COUNT(*), 0)) as compliance_rate
-    FROM all_trips_2025
-    WHERE
-        pickup_datetime >= '2025-01-05'
-        AND PULocationID NOT IN ({zone_list_str})
-        AND DOLocationID IN ({zone_list_str})
+        CAST(COALESCE(SUM(surcharge_trips), 0) AS BIGINT) as paid_trips,
+        CAST(COALESCE(SUM(trip_count), 0) AS BIGINT) as total_eligible_trips,
+        (SUM(surcharge_trips) * 100.0 / NULLIF(SUM(trip_count), 0)) as compliance_rate
+    FROM daily_cube
+    WHERE {eligible_filter}
     """
     
-    df_comp = con.execute(compliance_query).df()
-    df_comp.to_csv(os.path.join(config.OUTPUTS_DIR, 'compliance_stats.csv'), index=False)
+    df_comp = cached_df(con, compliance_query, _cube_files())
+    results_bundle.write_table('compliance_stats', df_comp)
     logger.info("Leakage Audit Complete.")
 
-def run_volume_analysis(con):
+def _trip_store_source(year):
+    """read_parquet() over the sorted trip store if it covers `year`, else None (scan raw files)."""
+    files = trip_store.store_files(year)
+    if files is None:
+        return None
+    return "read_parquet([" + ", ".join(f"'{f}'" for f in files) + "])"
+
+def _zone_pruned_source(con, name, year, do_zones=None, pu_zones=None):
     """
-    Compare Q1 2024 vs Q1 2025 trip volumes entering the zone.
+    Registers the trip store row groups of `year` whose zone bitmaps can match as
+    `name`. False (register nothing) unless the store and its index cover the year.
     """
-    logger.info("Running Volume Analysis...")
-    
-    zone_ids = get_congestion_zones()
-    zone_list_str = ",".join(map(str, zone_ids))
-    
+    files = trip_store.store_files(year)
+    dataset = trip_store.pruned_dataset(files, do_zones=do_zones, pu_zones=pu_zones) if files else None
+    if dataset is None:
+        return False
+    con.register(name, dataset)
+    return True
+
+def setup_q1_views(con):
+    """Creates the Q1 2024 / Q1 2025 comparison views used by volume and border analysis."""
     # Create Q1 2024 View (similar to 2025)
     # We need to load 2024 data (Jan, Feb, Mar)
     # Pattern: *_tripdata_2024-01.parquet, ...
     
     # Ensure 2024 data exists (it should be downloaded by ingestion)
     
+    store_24 = _trip_store_source(2024)
+    if store_24:
+        con.execute(f"""
+        CREATE OR REPLACE VIEW trips_q1_2024 AS
+        SELECT pickup_datetime, DOLocationID, taxi_type FROM {store_24}
+        WHERE month(pickup_datetime) <= 3
+        """)
+    else:
+        _setup_raw_q1_2024_view(con)
+    
+    # Q1 2025 View
+    con.execute(f"""
+    CREATE OR REPLACE VIEW trips_q1_2025 AS 
+    SELECT pickup_datetime, DOLocationID, taxi_type 
+    FROM all_trips_2025 
+    WHERE month(pickup_datetime) <= 3
+    """)
+
+def _setup_raw_q1_2024_view(con):
     q_yellow_24 = f"""
     SELECT tpep_pickup_datetime as pickup_datetime, DOLocationID, 'Yellow' as taxi_type
     FROM '{os.path.join(config.RAW_DIR, 'yellow_tripdata_2024-*.parquet')}'
@@ -225,14 +265,25 @@ def run_volume_analysis(con):
     """
     
     con.execute(f"CREATE OR REPLACE VIEW trips_q1_2024 AS {q_yellow_24} UNION ALL {q_green_24}")
+
+def run_volume_analysis(con):
+    """
+    Compare Q1 2024 vs Q1 2025 trip volumes entering the zone.
+    """
+    logger.info("Running Volume Analysis...")
     
-    # Q1 2025 View
-    con.execute(f"""
-    CREATE OR REPLACE VIEW trips_q1_2025 AS 
-    SELECT pickup_datetime, DOLocationID, taxi_type 
-    FROM all_trips_2025 
-    WHERE month(pickup_datetime) <= 3
-    """)
+    zone_ids = get_congestion_zones()
+    zone_list_str = ",".join(map(str, zone_ids))
+    
+    setup_q1_views(con)
+    
+    # Only the trip store row groups with zone drop-offs, where the store covers the year
+    sources = {}
+    for year in (2024, 2025):
+        if _zone_pruned_source(con, f"zone_dropoffs_{year}", year, do_zones=zone_ids):
+            sources[year] = f"(SELECT * FROM zone_dropoffs_{year} WHERE month(pickup_datetime) <= 3)"
+        else:
+            sources[year] = f"trips_q1_{year}"
     
     # Count trips entering zone
     query = f"""
@@ -240,7 +291,7 @@ def run_volume_analysis(con):
         '2024 Q1' as period,
         taxi_type,
         count(*) as trip_count
-    FROM trips_q1_2024
+    FROM {sources[2024]}
     WHERE DOLocationID IN ({zone_list_str})
     GROUP BY taxi_type
     
@@ -250,13 +301,13 @@ def run_volume_analysis(con):
         '2025 Q1' as period,
         taxi_type,
         count(*) as trip_count
-    FROM trips_q1_2025
+    FROM {sources[2025]}
     WHERE DOLocationID IN ({zone_list_str})
     GROUP BY taxi_type
     """
     
-    df_vol = con.execute(query).df()
-    df_vol.to_csv(os.path.join(config.OUTPUTS_DIR, 'volume_comparison.csv'), index=False)
+    df_vol = cached_df(con, query, stage_input_files('volume'))
+    results_bundle.write_table('volume_comparison', df_vol)
     logger.info("Volume Analysis Complete.")
 
 def run_velocity_metrics(con):
@@ -300,8 +351,14 @@ def run_velocity_metrics(con):
     GROUP BY 2, 3
     """
     
+    # Inside-zone trips only touch trip store row groups whose PU and DO bitmaps hit the zone
+    tables = {
+        year: f"zone_trips_{year}" if _zone_pruned_source(con, f"zone_trips_{year}", year, zone_ids, zone_ids) else f"all_trips_{year}"
+        for year in (2024, 2025)
+    }
+    
     # 2025
-    q25 = metrics_query_template.format(year="2025", table="all_trips_2025", zones=zone_list_str)
+    q25 = metrics_query_template.format(year="2025", table=tables[2025], zones=zone_list_str)
     
     # 2024 - Create a temporary table or CTE
     # Since we can't easily query schema-mismatched files in one go without a view
@@ -309,45 +366,62 @@ def run_velocity_metrics(con):
     q_y_24 = f"SELECT tpep_pickup_datetime as pickup_datetime, tpep_dropoff_datetime as dropoff_datetime, trip_distance, PULocationID, DOLocationID FROM '{os.path.join(config.RAW_DIR, 'yellow_tripdata_2024-*.parquet')}'"
     q_g_24 = f"SELECT lpep_pickup_datetime as pickup_datetime, lpep_dropoff_datetime as dropoff_datetime, trip_distance, PULocationID, DOLocationID FROM '{os.path.join(config.RAW_DIR, 'green_tripdata_2024-*.parquet')}'"
     
-    con.execute(f"CREATE OR REPLACE VIEW all_trips_2024 AS {q_y_24} UNION ALL {q_g_24}")
+    store_24 = _trip_store_source(2024)
+    if store_24:
+        con.execute(f"CREATE OR REPLACE VIEW all_trips_2024 AS SELECT pickup_datetime, dropoff_datetime, trip_distance, PULocationID, DOLocationID FROM {store_24}")
+    else:
+        con.execute(f"CREATE OR REPLACE VIEW all_trips_2024 AS {q_y_24} UNION ALL {q_g_24}")
     
-    q24 = metrics_query_template.format(year="2024", table="all_trips_2024", zones=zone_list_str)
+    q24 = metrics_query_template.format(year="2024", table=tables[2024], zones=zone_list_str)
     
     final_query = f"{q24} UNION ALL {q25}"
     
-    df_vel = con.execute(final_query).df()
-    df_vel.to_csv(os.path.join(config.OUTPUTS_DIR, 'velocity_metrics.csv'), index=False)
+    df_vel = cached_df(con, final_query, stage_input_files('velocity'))
+    results_bundle.write_table('velocity_metrics', df_vel)
     logger.info("Velocity Metrics Complete.")
 
 def run_economics_metrics(con):
     """
     Monthly stats: Avg Surcharge vs Avg Tip %.
+    Also writes the total 2025 surcharge revenue used by the report.
     """
     logger.info("Running Economics Metrics...")
     
-    query = """
+    # Monthly roll-up of the daily cube; averages are rebuilt from sums and counts
+    daily_cube.build_cube()
+    daily_cube.register_views(con)
+    query = f"""
     SELECT 
-        year(pickup_datetime) as year,
-        month(pickup_datetime) as month,
-        AVG(congestion_surcharge) as avg_surcharge,
-        AVG(fare_amount) as avg_fare,
-        AVG(tip_amount) as avg_tip,
-        AVG(tip_amount / NULLIF(total_amount - tip_amount, 0)) * 100 as avg_tip_pct
-    FROM all_trips_2025
+        year(date) as year,
+        month(date) as month,
+        SUM(total_surcharge) as total_surcharge,
+        SUM(total_surcharge) / NULLIF(SUM(surcharge_count), 0) as avg_surcharge,
+        SUM(tip_ratio_sum) / NULLIF(SUM(tip_ratio_count), 0) * 100 as avg_tip_pct
+    FROM daily_cube
+    WHERE source_year = {config.YEAR_2025}
     GROUP BY 1, 2
     ORDER BY 1, 2
     """
+    econ_df = cached_df(con, query, _cube_files())
+    results_bundle.write_table('economics_metrics', econ_df)
     
-    # Note: 'tip_amount' needs to be in the view.
-    # I didn't include it in 'all_trips_2025' view earlier.
-    # I need to recreate the view or include it.
-    # I'll modify the `create_view` logic conceptually or just do it right here.
-    # But `all_trips_2025` is already created in `run_ghost_trip_audit`.
-    
-    # I should consolidate view creation to a helper or just recreate it with more columns.
-    pass
+    # Save Total 2025 Revenue for the report
+    total_revenue = econ_df['total_surcharge'].sum()
+    results_bundle.write_scalar('total_revenue', total_revenue)
+
+    # Days with trips, for the dashboard's data-status panel
+    days_query = f"SELECT count(DISTINCT date) AS days FROM daily_cube WHERE source_year = {config.YEAR_2025}"
+    days = int(cached_df(con, days_query, _cube_files())['days'].iloc[0])
+    results_bundle.write_scalar('days_covered', days)
+    logger.info("Economics Metrics Complete.")
 
 def setup_global_views(con):
+    # The sorted trip store has exactly these columns; prefer it when it is current
+    store_25 = _trip_store_source(2025)
+    if store_25:
+        con.execute(f"CREATE OR REPLACE VIEW all_trips_2025 AS SELECT * FROM {store_25}")
+        return
+
     # Yellow
     q_yellow = f"""
     SELECT 
@@ -388,6 +462,8 @@ def run_border_analysis(con):
     """
     logger.info("Running Border Analysis...")
     
+    setup_q1_views(con)
+    
     # 2024 Counts
     q24 = """
     SELECT DOLocationID, COUNT(*) as count_2024
@@ -402,9 +478,15 @@ def run_border_analysis(con):
     GROUP BY 1
     """
     
-    df24 = con.execute(q24).df()
-    df25 = con.execute(q25).df()
+    df24 = cached_df(con, q24, stage_input_files('border'))
+    df25 = cached_df(con, q25, stage_input_files('border'))
     
+    merged = border_change(df24, df25)
+    write_border_results(merged)
+    logger.info("Border Analysis Complete.")
+
+def border_change(df24, df25):
+    """Joins per-zone Q1 drop-off counts and adds the year-over-year pct_change."""
     merged = pd.merge(df24, df25, on='DOLocationID', how='outer').fillna(0)
     merged['pct_change'] = merged.apply(lambda row: ((row['count_2025'] - row['count_2024']) / row['count_2024'] * 100) if row['count_2024'] != 0 else 0, axis=1)
     
@@ -412,43 +494,290 @@ def run_border_analysis(con):
     merged['pct_change'] = merged['pct_change'].fillna(0) # or keep as is? 
     # If count_2024 is 0 and count_2025 > 0, result is inf. 
     # We can cap it or set to 100?
-    
-    merged.to_csv(os.path.join(config.OUTPUTS_DIR, 'border_analysis.csv'), index=False)
-    logger.info("Border Analysis Complete.")
+    return merged
+
+def border_by_ring(merged, rings):
+    """
+    Rolls per-zone drop-off counts up to rings around the CBD (0 = inside);
+    rings past config.BORDER_MAX_RING, or unreachable by land, form one bucket.
+    """
+    max_ring = config.BORDER_MAX_RING
+    df = rings.merge(merged, left_on='LocationID', right_on='DOLocationID', how='left')
+    df[['count_2024', 'count_2025']] = df[['count_2024', 'count_2025']].fillna(0)
+    df['ring'] = np.where((df['ring'] < 0) | (df['ring'] > max_ring), max_ring + 1, df['ring'])
+    by_ring = df.groupby('ring').agg(
+        zones=('LocationID', 'size'),
+        count_2024=('count_2024', 'sum'),
+        count_2025=('count_2025', 'sum'),
+        avg_cbd_distance_mi=('cbd_distance_mi', 'mean'),
+    ).reset_index()
+    by_ring['ring_label'] = by_ring['ring'].map(lambda r: 'CBD' if r == 0 else (f'{max_ring + 1}+' if r > max_ring else str(r)))
+    by_ring['pct_change'] = np.where(
+        by_ring['count_2024'] > 0,
+        (by_ring['count_2025'] - by_ring['count_2024']) / by_ring['count_2024'].where(by_ring['count_2024'] > 0) * 100,
+        0.0
+    )
+    return by_ring
+
+def write_border_results(merged):
+    """
+    Writes per-zone border changes, their ring roll-up and Moran's I of pct_change.
+    The ring roll-up and Moran's I need the zone shapefile and are skipped without it.
+    """
+    results_bundle.write_table('border_analysis', merged)
+    shapefile_path = os.path.join(config.DATA_DIR, 'taxi_zones', 'taxi_zones.shp')
+    if not os.path.exists(shapefile_path):
+        logger.warning("No taxi zone shapefile found. Skipping border rings and Moran's I.")
+        return
+    import geospatial
+    rings, adjacency = geospatial.build_zone_graph(get_congestion_zones())
+    results_bundle.write_table('border_rings', border_by_ring(merged, rings))
+
+    # Spatial autocorrelation: do neighbouring zones change together (spillover)?
+    pct = rings[['LocationID']].merge(merged, left_on='LocationID', right_on='DOLocationID', how='left')['pct_change']
+    moran, p_value = geospatial.morans_i(pct.to_numpy(), adjacency)
+    results_bundle.write_scalar('border_morans_i', moran)
+    results_bundle.write_scalar('border_morans_p', p_value)
+    logger.info(f"Border change Moran's I = {moran:.3f} (p = {p_value:.3f})")
+
+
+# Stage Registry
+# Each stage lists the raw inputs it scans and the results-bundle tables (and
+# any standalone files) it writes, so callers (dashboard refresh, pipeline)
+# can recompute only what is out of date. 'func' names a function in this
+# module or 'module.function'; it is imported only when the stage runs.
+# 'cube' lists the daily cube tables a stage reads instead of trips, and
+# 'scan' = 'raw' marks stages that stream raw files themselves (see scan_estimate).
+RAW_2025_GLOBS = ['yellow_tripdata_2025-*.parquet', 'green_tripdata_2025-*.parquet']
+RAW_2024_GLOBS = ['yellow_tripdata_2024-*.parquet', 'green_tripdata_2024-*.parquet']
+
+STAGES = {
+    'ghost': {
+        'func': 'run_ghost_trip_audit',
+        'inputs': RAW_2025_GLOBS,
+        'tables': ['suspicious_vendors'],
+        'files': ['audit_ghost_trips.parquet'],
+    },
+    'fraud': {
+        'func': 'fraud_scoring.run_fraud_scoring',
+        'cube': ['daily'],
+        'inputs': RAW_2025_GLOBS + RAW_2024_GLOBS,
+        'tables': ['vendor_fraud_daily', 'vendor_fraud_alerts'],
+    },
+    'leakage': {
+        'func': 'run_leakage_audit',
+        'cube': ['daily'],
+        'inputs': RAW_2025_GLOBS,
+        'tables': ['leakage_top_locations', 'compliance_stats'],
+    },
+    'tariff': {
+        'func': 'tariff.run_tariff_audit',
+        'scan': 'raw',
+        'inputs': RAW_2025_GLOBS,
+        'tables': ['fee_leakage', 'scalars'],
+    },
+    'volume': {
+        'func': 'run_volume_analysis',
+        'inputs': RAW_2025_GLOBS + RAW_2024_GLOBS,
+        'tables': ['volume_comparison'],
+    },
+    'velocity': {
+        'func': 'run_velocity_metrics',
+        'inputs': RAW_2025_GLOBS + RAW_2024_GLOBS,
+        'tables': ['velocity_metrics'],
+    },
+    'border': {
+        # border_rings and the Moran's I scalars are only written when the zone
+        # shapefile is present
+        'func': 'run_border_analysis',
+        'inputs': RAW_2025_GLOBS + RAW_2024_GLOBS,
+        'tables': ['border_analysis'],
+    },
+    'economics': {
+        'func': 'run_economics_metrics',
+        'cube': ['daily'],
+        'inputs': RAW_2025_GLOBS,
+        'tables': ['economics_metrics', 'scalars'],
+    },
+    'weather': {
+        'func': 'weather.run_weather_analysis',
+        'cube': ['daily', 'hourly'],
+        'inputs': RAW_2025_GLOBS,
+        'tables': ['trips_vs_weather', 'elasticity_by_zone', 'elasticity_by_hour', 'scalars'],
+    },
+    'weather_regression': {
+        'func': 'weather_regression.run_weather_regression',
+        'inputs': RAW_2025_GLOBS,
+        'tables': ['weather_regression'],
+    },
+}
+
+def stage_func(name):
+    """Resolves a stage's function, importing its module on first use."""
+    ref = STAGES[name]['func']
+    if '.' not in ref:
+        return globals()[ref]
+    module, attr = ref.rsplit('.', 1)
+    return getattr(importlib.import_module(module), attr)
+
+def stage_input_files(name):
+    patterns = STAGES[name]['inputs']
+    return sorted(p for pattern in patterns for p in glob.glob(os.path.join(config.RAW_DIR, pattern)))
+
+def _parquet_rows(paths):
+    """Row count from parquet footers only (no data pages are read)."""
+    import pyarrow.parquet as pq
+    return sum(pq.read_metadata(p).num_rows for p in paths)
+
+def scan_files(name):
+    """The files a stage reads: trip store copies where current, raw files otherwise."""
+    state = trip_store._load_state()
+    return [trip_store.store_path(p) if trip_store.is_current(p, state) else p for p in stage_input_files(name)]
+
+def scan_estimate(name):
+    """
+    (files, compressed bytes) a stage scans, without reading any data pages. Cube-backed
+    stages read their cube files whole, plus the trips of every input month whose
+    cube file is out of date (build_cube rebuilds those first); 'raw' stages read
+    only their own columns of the raw files.
+    """
+    stage = STAGES[name]
+    if 'cube' in stage:
+        cube_state = daily_cube._load_state().get('files', {})
+        dirs = {'daily': daily_cube.DAILY_DIR, 'hourly': daily_cube.HOURLY_DIR}
+        cube, rebuild = [], []
+        for raw_path in stage_input_files(name):
+            paths = daily_cube._cube_paths(raw_path)
+            current = (all(os.path.exists(c) for c in paths)
+                       and cube_state.get(os.path.basename(raw_path)) == results_bundle.fingerprint_files([raw_path]))
+            if current:
+                cube += [os.path.join(dirs[t], os.path.basename(raw_path)) for t in stage['cube']]
+            else:
+                rebuild.append(raw_path)
+        state = trip_store._load_state()
+        rebuild = [trip_store.store_path(p) if trip_store.is_current(p, state) else p for p in rebuild]
+        return cube + rebuild, sum(os.path.getsize(p) for p in cube) + scan_bytes(rebuild)
+    if stage.get('scan') == 'raw':
+        module = importlib.import_module(stage['func'].rsplit('.', 1)[0])
+        files = stage_input_files(name)
+        return files, scan_bytes(files, module.scan_columns())
+    files = scan_files(name)
+    return files, scan_bytes(files)
+
+def scan_bytes(paths, columns=None):
+    """
+    Compressed bytes of the column chunks a scan reads, from parquet footers only.
+    `columns` defaults to the unified all_trips columns (tpep_/lpep_ prefixes ignored).
+    """
+    import pyarrow.parquet as pq
+    wanted = {c.lower() for c in (columns or trip_store.UNIFIED_COLUMNS)}
+    total = 0
+    for path in paths:
+        meta = pq.read_metadata(path)
+        for i in range(meta.num_row_groups):
+            row_group = meta.row_group(i)
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                name = chunk.path_in_schema.lower()
+                if name.split('_', 1)[0] in ('tpep', 'lpep'):
+                    name = name.split('_', 1)[1]
+                if name in wanted:
+                    total += chunk.total_compressed_size
+    return total
+
+def _stage_rows_output(name):
+    stage = STAGES[name]
+    rows = sum(results_bundle.count_rows(t) for t in stage['tables'])
+    files = [os.path.join(config.OUTPUTS_DIR, f) for f in stage.get('files', [])]
+    return rows + _parquet_rows([f for f in files if os.path.exists(f)])
+
+def is_stage_stale(name, records=None):
+    """
+    A stage is stale if it has never completed, its input fingerprint changed,
+    or one of its outputs has gone missing.
+    """
+    records = results_bundle.read_stage_records() if records is None else records
+    record = records.get(name)
+    if record is None:
+        return True
+    if record['input_fingerprint'] != results_bundle.fingerprint_files(stage_input_files(name)):
+        return True
+    stage = STAGES[name]
+    if any(not results_bundle.has_table(t) for t in stage['tables']):
+        return True
+    return any(not os.path.exists(os.path.join(config.OUTPUTS_DIR, f)) for f in stage.get('files', []))
+
+def get_stale_stages():
+    records = results_bundle.read_stage_records()
+    return [name for name in STAGES if is_stage_stale(name, records)]
+
+def run_stages(names=None, progress=None, backend=None):
+    """
+    Runs the given stages (all by default) on a single connection and records
+    each stage's run id, input fingerprint and duration in the results bundle.
+    `progress` is an optional callback(fraction, message) used by background jobs.
+    `backend` ('duckdb' or 'dask', default config.ANALYTICS_BACKEND) picks the
+    engine; stages the Dask backend does not implement still run on DuckDB.
+    """
+    backend = backend or config.ANALYTICS_BACKEND
+    names = list(STAGES) if names is None else [n for n in STAGES if n in names]
+    if not names:
+        if progress:
+            progress(1.0, "All analytics outputs are up to date.")
+        return []
+
+    # Fail fast on partial/corrupt inputs instead of deep inside a query
+    raw_manifest.ensure_valid_raw_files(
+        sorted({p for name in names for p in stage_input_files(name)}), refetch=False
+    )
+
+    run_id = results_bundle.new_run_id()
+    # Open (or join) the trace first: query plans are filed under the trace's
+    # run id, which the dashboard's profile tab looks up
+    with profiling.run(run_id) as trace:
+        con = create_connection()
+        if profiling.PROFILE_QUERIES:
+            con = profiling.ProfiledConnection(con, trace.run_id)
+        session = None
+        if backend == 'dask':
+            import dask_backend
+            session = dask_backend.DaskSession()
+        try:
+            setup_global_views(con)
+            for i, name in enumerate(names):
+                if progress:
+                    progress(i / len(names), f"Running {name}...")
+                input_files = stage_input_files(name)
+                fingerprint = results_bundle.fingerprint_files(input_files)
+                if profiling.PROFILE_QUERIES:
+                    con.stage = name
+                start = time.perf_counter()
+                with profiling.stage(name, rows_scanned=_parquet_rows(input_files)) as metrics:
+                    if session is not None and name in dask_backend.STAGES:
+                        dask_backend.STAGES[name](session)
+                    else:
+                        stage_func(name)(con)
+                    metrics['rows_output'] = _stage_rows_output(name)
+                results_bundle.record_stage(name, run_id, fingerprint, STAGES[name]['tables'], time.perf_counter() - start)
+        finally:
+            if session is not None:
+                session.close()
+            con.close()
+    # Memory-mapped copy of the bundle for the dashboard and report
+    results_bundle.export_snapshot()
+
+    if progress:
+        progress(1.0, f"Recomputed: {', '.join(names)}")
+    return names
+
+def refresh_stale_outputs(progress=None):
+    """Recomputes only the stages whose outputs are missing or out of date."""
+    stale = get_stale_stages()
+    logger.info(f"Stale analytics stages: {stale or 'none'}")
+    return run_stages(stale, progress=progress)
 
 def main():
-    con = create_connection()
-    try:
-        setup_global_views(con)
-        run_ghost_trip_audit(con)
-        run_leakage_audit(con)
-        run_volume_analysis(con)
-        run_velocity_metrics(con)
-        run_border_analysis(con)
-        
-        # Economics
-        econ_query = """
-        SELECT 
-            year(pickup_datetime) as year,
-            month(pickup_datetime) as month,
-            SUM(congestion_surcharge) as total_surcharge,
-            AVG(congestion_surcharge) as avg_surcharge,
-            AVG(tip_amount / NULLIF(total_amount - tip_amount, 0)) * 100 as avg_tip_pct
-        FROM all_trips_2025
-        GROUP BY 1, 2
-        ORDER BY 1, 2
-        """
-        econ_df = con.execute(econ_query).df()
-        econ_df.to_csv(os.path.join(config.OUTPUTS_DIR, 'economics_metrics.csv'), index=False)
-        
-        # Save Total 2025 Revenue to a file
-        total_revenue = econ_df['total_surcharge'].sum()
-        with open(os.path.join(config.OUTPUTS_DIR, 'total_revenue.txt'), 'w') as f:
-            f.write(str(total_revenue))
-            
-    finally:
-        con.close()
+    run_stages()
 
 if __name__ == "__main__":
     main()
-
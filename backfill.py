@@ -0,0 +1,309 @@
+import os
+import json
+import argparse
+import logging
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import config
+import db
+import geofence
+import profiling
+import raw_manifest
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Multi-year backfill. Every (trip type, month) partition is downloaded, reduced
+# to a small per-month aggregate (one row per drop-off zone) and checkpointed,
+# so interrupted runs resume where they stopped and year-over-year comparisons
+# for any window read the aggregates instead of rescanning raw trips.
+
+CHECKPOINT_PATH = os.path.join(config.BACKFILL_DIR, '_checkpoint.json')
+
+TAXI_LABELS = {'yellow': 'Yellow', 'green': 'Green', 'fhv': 'FHV', 'fhvhv': 'HVFHV'}
+
+# Canonical column -> source names across trip types and schema years (first match wins;
+# DuckDB resolves names case-insensitively, so PUlocationID matches PULocationID)
+SOURCE_COLUMNS = {
+    'pickup_datetime': ['tpep_pickup_datetime', 'lpep_pickup_datetime', 'pickup_datetime', 'Trip_Pickup_DateTime'],
+    'dropoff_datetime': ['tpep_dropoff_datetime', 'lpep_dropoff_datetime', 'dropoff_datetime', 'Trip_Dropoff_DateTime'],
+    'DOLocationID': ['DOLocationID'],
+    'trip_distance': ['trip_distance', 'trip_miles'],
+    'fare_amount': ['fare_amount', 'base_passenger_fare', 'Fare_Amt'],
+    'tip_amount': ['tip_amount', 'tips', 'Tip_Amt'],
+    'congestion_surcharge': ['congestion_surcharge'],
+}
+
+# 2009-era yellow files store these as VARCHAR; unparseable values become NULL
+DATETIME_COLUMNS = ('pickup_datetime', 'dropoff_datetime')
+
+# Largest partitions first so the long HVFHV months do not end up as stragglers
+_SIZE_RANK = {'fhvhv': 0, 'yellow': 1, 'fhv': 2, 'green': 3}
+
+def partition_key(taxi, year, month):
+    return f"{taxi}/{year}-{month:02d}"
+
+def raw_path(taxi, year, month):
+    return os.path.join(config.RAW_DIR, f"{taxi}_tripdata_{year}-{month:02d}.parquet")
+
+def aggregate_path(taxi, year, month):
+    return os.path.join(config.BACKFILL_DIR, f"{taxi}_{year}-{month:02d}.parquet")
+
+def plan_partitions(years, taxi_types=None, months=None):
+    """All (taxi, year, month) partitions in scheduling order."""
+    taxi_types = taxi_types or config.BACKFILL_TAXI_TYPES
+    months = months or config.MONTHS
+    partitions = [(taxi, year, month) for taxi in taxi_types for year in years for month in months]
+    return sorted(partitions, key=lambda p: (_SIZE_RANK.get(p[0], len(_SIZE_RANK)), p[1], p[2]))
+
+def load_checkpoint():
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {}
+    with open(CHECKPOINT_PATH) as f:
+        return json.load(f)
+
+def _save_checkpoint(checkpoint):
+    os.makedirs(config.BACKFILL_DIR, exist_ok=True)
+    tmp_path = CHECKPOINT_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+def is_partition_done(partition, checkpoint):
+    """
+    Done means checkpointed with its aggregate on disk and, if the raw file is
+    still around, unchanged since it was aggregated.
+    """
+    record = checkpoint.get(partition_key(*partition))
+    if record is None or not os.path.exists(aggregate_path(*partition)):
+        return False
+    raw = raw_path(*partition)
+    return not os.path.exists(raw) or record['fingerprint'] == results_bundle.fingerprint_files([raw])
+
+def _select_list(con, source):
+    """Maps a raw file's columns onto SOURCE_COLUMNS; columns a schema lacks become NULL."""
+    available = {c[0].lower() for c in con.execute(f"DESCRIBE SELECT * FROM '{source}'").fetchall()}
+    select = []
+    for column, candidates in SOURCE_COLUMNS.items():
+        match = next((c for c in candidates if c.lower() in available), None)
+        if match and column in DATETIME_COLUMNS:
+            match = f"TRY_CAST({match} AS TIMESTAMP)"
+        select.append(f"{match} AS {column}" if match else f"NULL AS {column}")
+    return ",\n        ".join(select)
+
+def aggregate_partition(taxi, year, month, threads=None):
+    """
+    Reduces one raw monthly file to per-drop-off-zone totals. Trips whose pickup
+    falls outside the partition's month are dropped so partitions never overlap.
+    Pre-2017 files carry coordinates instead of LocationIDs and are geofenced
+    into a temporary copy first. Runs in a worker process; returns the number
+    of raw rows scanned.
+    """
+    source = raw_path(taxi, year, month)
+    output = aggregate_path(taxi, year, month)
+    geofenced = None
+    if geofence.needs_geofencing(source):
+        # Outside BACKFILL_DIR, whose *.parquet files are all read as aggregates
+        os.makedirs(config.DUCKDB_TEMP_DIR, exist_ok=True)
+        geofenced = geofence.geofence_file(
+            source, os.path.join(config.DUCKDB_TEMP_DIR, f"geofenced_{taxi}_{year}-{month:02d}.parquet")
+        )
+    con = db.create_connection(memory_limit=config.BACKFILL_WORKER_MEMORY, threads=threads)
+    try:
+        source = geofenced or source
+        query = f"""
+        WITH trips AS (
+            SELECT
+            {_select_list(con, source)}
+            FROM '{source}'
+        )
+        SELECT
+            '{TAXI_LABELS.get(taxi, taxi)}' AS taxi_type,
+            {year} AS year,
+            {month} AS month,
+            DOLocationID,
+            COUNT(*) AS trip_count,
+            COUNT(*) FILTER (WHERE congestion_surcharge > 0) AS surcharge_trips,
+            SUM(congestion_surcharge) AS total_surcharge,
+            SUM(fare_amount) AS total_fare,
+            SUM(tip_amount) AS total_tip,
+            SUM(trip_distance) AS total_distance,
+            SUM(date_diff('second', pickup_datetime, dropoff_datetime)) AS total_duration_s
+        FROM trips
+        WHERE pickup_datetime >= '{year}-{month:02d}-01'
+          AND pickup_datetime < '{year}-{month:02d}-01'::DATE + INTERVAL 1 MONTH
+        GROUP BY DOLocationID
+        """
+        tmp_path = output + '.tmp'
+        con.execute(f"COPY ({query}) TO '{tmp_path}' ({db.parquet_copy_options()})")
+        os.replace(tmp_path, output)
+        return con.execute(f"SELECT count(*) FROM '{source}'").fetchone()[0]
+    finally:
+        con.close()
+        if geofenced and os.path.exists(geofenced):
+            os.remove(geofenced)
+
+def _download(partition):
+    import ingestion
+    taxi, year, month = partition
+    url = f"{config.TLC_BASE_URL}/{os.path.basename(raw_path(taxi, year, month))}"
+    return ingestion.download_file(url, raw_path(taxi, year, month))
+
+def run_backfill(years, taxi_types=None, months=None, workers=None, delete_raw=False, progress=None):
+    """
+    Backfills every partition in years x taxi_types x months that is not yet
+    checkpointed. Downloads (I/O bound) and aggregations (CPU bound, one DuckDB
+    per worker process) overlap; at most 2 x workers partitions are in flight so
+    raw files do not pile up on disk. `delete_raw` removes each raw file once
+    its aggregate is written. Returns {'done': [...], 'unavailable': [...], 'failed': [...]}.
+    """
+    workers = workers or config.BACKFILL_WORKERS
+    threads = max(1, config.DUCKDB_THREADS // workers)
+    os.makedirs(config.BACKFILL_DIR, exist_ok=True)
+
+    checkpoint = load_checkpoint()
+    partitions = plan_partitions(years, taxi_types, months)
+    todo = [p for p in partitions if not is_partition_done(p, checkpoint)]
+    logger.info(f"Backfill: {len(partitions)} partitions, {len(partitions) - len(todo)} already checkpointed.")
+
+    summary = {'done': [], 'unavailable': [], 'failed': []}
+    max_in_flight = 2 * workers
+    queue = list(todo)
+    pending = {}
+
+    # Workers are spawned, not forked: download threads (requests, logging, DuckDB)
+    # may hold locks a forked child would inherit
+    with profiling.run(), profiling.stage('backfill', category='ingestion') as metrics, \
+            ThreadPoolExecutor(config.DOWNLOAD_WORKERS) as downloads, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while queue or pending:
+            while queue and len(pending) < max_in_flight:
+                partition = queue.pop(0)
+                pending[downloads.submit(_download, partition)] = ('download', partition)
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                kind, partition = pending.pop(future)
+                key = partition_key(*partition)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Backfill {kind} failed for {key}: {e}")
+                    summary['failed'].append(key)
+                    continue
+
+                if kind == 'download':
+                    if not result:
+                        # Not published (yet), e.g. months ahead of the TLC release schedule
+                        summary['unavailable'].append(key)
+                        continue
+                    pending[pool.submit(aggregate_partition, *partition, threads=threads)] = ('aggregate', partition)
+                    continue
+
+                raw = raw_path(*partition)
+                checkpoint[key] = {
+                    'fingerprint': results_bundle.fingerprint_files([raw]),
+                    'rows': result,
+                    'completed_at': datetime.now().isoformat(timespec='seconds'),
+                }
+                _save_checkpoint(checkpoint)
+                if delete_raw:
+                    os.remove(raw)
+                    raw_manifest.forget(os.path.basename(raw))
+                summary['done'].append(key)
+                logger.info(f"Backfilled {key} ({result:,} rows)")
+                if progress:
+                    progress(len(summary['done']) / len(todo), f"Backfilled {key}")
+
+        metrics['partitions'] = len(summary['done'])
+        metrics['rows_scanned'] = sum(checkpoint[k]['rows'] for k in summary['done'])
+
+    logger.info(
+        f"Backfill complete: {len(summary['done'])} done, "
+        f"{len(summary['unavailable'])} unavailable, {len(summary['failed'])} failed."
+    )
+    return summary
+
+def monthly_aggregates(con):
+    """Registers the monthly_trips view over all backfilled aggregates on con."""
+    pattern = os.path.join(config.BACKFILL_DIR, '*.parquet')
+    con.execute(f"CREATE OR REPLACE VIEW monthly_trips AS SELECT * FROM read_parquet('{pattern}')")
+
+def _month_index(value):
+    year, month = map(int, value.split('-'))
+    return year * 100 + month
+
+def compare_periods(base, current, taxi_types=None, dropoff_zones=None):
+    """
+    Compares two month windows, e.g. base=('2024-01', '2024-03') and
+    current=('2025-01', '2025-03') (inclusive), per taxi type using only the
+    monthly aggregates. Optionally restricted to drop-offs in dropoff_zones.
+    """
+    filters = []
+    if taxi_types:
+        labels = ",".join(f"'{TAXI_LABELS.get(t, t)}'" for t in taxi_types)
+        filters.append(f"taxi_type IN ({labels})")
+    if dropoff_zones:
+        filters.append(f"DOLocationID IN ({','.join(map(str, dropoff_zones))})")
+    where = f"AND {' AND '.join(filters)}" if filters else ""
+
+    def window(bounds, label):
+        start, end = map(_month_index, bounds)
+        return f"""
+        SELECT taxi_type, '{label}' AS period,
+            SUM(trip_count) AS trips,
+            SUM(total_surcharge) AS surcharge,
+            SUM(total_distance) / NULLIF(SUM(total_duration_s), 0) * 3600 AS avg_speed
+        FROM monthly_trips
+        WHERE year * 100 + month BETWEEN {start} AND {end} {where}
+        GROUP BY taxi_type
+        """
+
+    con = db.create_connection()
+    try:
+        monthly_aggregates(con)
+        return con.execute(f"""
+        WITH b AS ({window(base, 'base')}), c AS ({window(current, 'current')})
+        SELECT
+            COALESCE(b.taxi_type, c.taxi_type) AS taxi_type,
+            b.trips AS base_trips,
+            c.trips AS current_trips,
+            (c.trips - b.trips) * 100.0 / NULLIF(b.trips, 0) AS trips_pct_change,
+            b.surcharge AS base_surcharge,
+            c.surcharge AS current_surcharge,
+            b.avg_speed AS base_avg_speed,
+            c.avg_speed AS current_avg_speed
+        FROM b FULL OUTER JOIN c ON b.taxi_type = c.taxi_type
+        ORDER BY 1
+        """).df()
+    finally:
+        con.close()
+
+def _year_range(value):
+    if '-' in value:
+        start, end = map(int, value.split('-'))
+        return list(range(start, end + 1))
+    return [int(value)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill historical TLC trip data into monthly aggregates.")
+    parser.add_argument('--years', default=f"{config.YEAR_2024}-{config.YEAR_2025}", help="Year or range, e.g. 2019-2025")
+    parser.add_argument('--taxi-types', nargs='+', choices=config.BACKFILL_TAXI_TYPES, default=None)
+    parser.add_argument('--months', nargs='+', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--delete-raw', action='store_true', help="Remove raw files once aggregated")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CURRENT'), default=None,
+                        help="Compare two windows instead, e.g. 2024-01:2024-03 2025-01:2025-03")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.compare:
+        base, current = (tuple(w.split(':')) for w in args.compare)
+        print(compare_periods(base, current, args.taxi_types).to_string(index=False))
+        return
+    run_backfill(_year_range(args.years), args.taxi_types, args.months, args.workers, args.delete_raw)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import logging
+from datetime import datetime
+
+# Benchmark harness: times each analytics stage, December imputation and the
+# dashboard data load against synthetic TLC data. Every case runs in its own
+# subprocess so peak RSS and I/O counters belong to that case alone.
+
+logger = logging.getLogger("Benchmark")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ANALYTICS_CASES = ['ghost', 'leakage', 'volume', 'velocity', 'border', 'economics']
+CASES = ANALYTICS_CASES + ['imputation', 'dashboard_load']
+
+# Relative slowdown above which --compare flags a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Cold-start budgets: each snippet runs in a fresh interpreter and must finish
+# its imports within the budget (seconds) without loading any HEAVY_MODULES.
+STARTUP_TARGETS = {
+    'pipeline': ("import pipeline", 0.25),
+    'analytics': ("import analytics", 0.75),
+    'stage_economics': ("import analytics; analytics.stage_func('economics')", 0.75),
+    'dashboard_overview': ("import streamlit, config, ghost_explorer, jobs, profiling, results_bundle", 1.0),
+}
+HEAVY_MODULES = ['geopandas', 'shapely', 'pyproj', 'scipy', 'sklearn', 'matplotlib', 'seaborn',
+                 'folium', 'fpdf', 'dask', 'requests']
+
+def _read_io_counters():
+    """Bytes read from storage and via read syscalls (Linux /proc; zeros elsewhere)."""
+    counters = {'read_bytes': 0, 'rchar': 0}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key in counters:
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+def _parquet_rows(paths):
+    import pyarrow.parquet as pq
+    return sum(pq.read_metadata(p).num_rows for p in paths)
+
+def _use_synthetic_zones_if_needed():
+    """Benchmarks run offline: fall back to the synthetic zone list when no shapefile is present."""
+    import config
+    import analytics
+    import synthetic_data
+    shapefile_path = os.path.join(config.DATA_DIR, 'taxi_zones', 'taxi_zones.shp')
+    if not os.path.exists(shapefile_path):
+        analytics.get_congestion_zones = lambda: list(synthetic_data.CONGESTION_ZONE_IDS)
+
+def run_case(name):
+    """Executes one case in this process and returns its measurements."""
+    import config
+    import analytics
+
+    _use_synthetic_zones_if_needed()
+
+    if name in ANALYTICS_CASES:
+        rows = _parquet_rows(analytics.stage_input_files(name))
+        con = analytics.create_connection()
+        analytics.setup_global_views(con)
+        func = lambda: analytics.stage_func(name)(con)
+    elif name == 'imputation':
+        import imputation
+        for taxi in config.TAXI_TYPES:
+            target = os.path.join(config.RAW_DIR, f"{taxi}_tripdata_2025-12.parquet")
+            if os.path.exists(target):
+                os.remove(target)
+        sources = [p for taxi in config.TAXI_TYPES for p in imputation.source_files(2025, 12, taxi)]
+        if config.IMPUTATION_MODE == 'aggregate':
+            # Source months' cube files are built outside the timed region, so
+            # only the imputation itself (a weighted sum of cube rows) is timed
+            import daily_cube
+            import db
+            daily_cube.build_cube(imputed=[])
+            sources = [os.path.join(d, os.path.basename(p)) for p in sources
+                       for d in (daily_cube.DAILY_DIR, daily_cube.HOURLY_DIR)]
+            con = db.create_connection()
+            func = lambda: [imputation.impute_cube_month(con, taxi, 2025, 12) for taxi in config.TAXI_TYPES]
+        else:
+            func = lambda: imputation.impute_month(2025, 12)
+        rows = _parquet_rows(sources)
+    elif name == 'dashboard_load':
+        import results_bundle
+        rows = None
+        func = results_bundle.load_dashboard_data
+    else:
+        raise ValueError(f"Unknown benchmark case: {name}")
+
+    io_before = _read_io_counters()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    result = func()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_before
+    io_after = _read_io_counters()
+
+    if name == 'dashboard_load':
+        rows = sum(len(df) for df in result[:4] if df is not None)
+
+    return {
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'rows': rows,
+        'rows_per_s': round(rows / wall, 1) if wall > 0 else None,
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'bytes_read': io_after['read_bytes'] - io_before['read_bytes'],
+        'read_chars': io_after['rchar'] - io_before['rchar'],
+    }
+
+def measure_startup(snippet, repeats=3):
+    """Best-of-`repeats` import time of `snippet` in a fresh interpreter, plus the modules it loaded."""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{snippet}\n"
+        "print(json.dumps({'import_s': time.perf_counter() - start, 'modules': sorted(sys.modules)}))"
+    )
+    best = None
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, '-c', code], cwd=BASE_DIR, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {'error': proc.stderr.strip().splitlines()[-1:]}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if best is None or result['import_s'] < best['import_s']:
+            best = result
+    return best
+
+def check_startup(targets=None, repeats=3):
+    """Prints import time and heavy modules per startup target; returns the targets that failed."""
+    failures = []
+    print(f"{'target':<20}{'import s':>10}{'budget s':>10}  heavy modules loaded")
+    for name, (snippet, budget) in STARTUP_TARGETS.items():
+        if targets and name not in targets:
+            continue
+        result = measure_startup(snippet, repeats)
+        if 'error' in result:
+            print(f"{name:<20}{'error':>10}{budget:>10.2f}  {result['error']}")
+            failures.append(name)
+            continue
+        heavy = [m for m in HEAVY_MODULES if m in result['modules']]
+        over = result['import_s'] > budget
+        if over or heavy:
+            failures.append(name)
+        print(f"{name:<20}{result['import_s']:>10.3f}{budget:>10.2f}  {', '.join(heavy) or '-'}{'  OVER BUDGET' if over else ''}")
+    return failures
+
+def prepare_dataset(data_dir, rows, seed=42):
+    """Generates synthetic data into data_dir/raw unless a matching dataset is already there."""
+    marker = os.path.join(data_dir, 'dataset.json')
+    spec = {'rows': rows, 'seed': seed}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == spec:
+                logger.info(f"Reusing synthetic dataset in {data_dir}")
+                return
+    import synthetic_data
+    logger.info(f"Generating {rows:,} synthetic rows in {data_dir}...")
+    synthetic_data.generate_dataset(rows, raw_dir=os.path.join(data_dir, 'raw'), seed=seed)
+    with open(marker, 'w') as f:
+        json.dump(spec, f)
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, text=True).strip()
+    except Exception:
+        return 'unknown'
+
+def run_benchmarks(rows, data_dir, cases=None, seed=42):
+    """Runs every case in a fresh subprocess against data_dir; returns the results document."""
+    cases = cases or CASES
+    prepare_dataset(data_dir, rows, seed)
+
+    # The query cache lives in the reused data dir; cache hits would time parquet reads
+    env = dict(os.environ, AUDIT_DATA_DIR=data_dir, AUDIT_QUERY_CACHE='0')
+    results = {
+        'commit': _git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'dataset_rows': rows,
+        'seed': seed,
+        'cases': {},
+    }
+    for name in cases:
+        logger.info(f"Running benchmark case: {name}")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-case', name],
+            env=env, cwd=BASE_DIR, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            logger.error(f"Case {name} failed:\n{proc.stderr}")
+            results['cases'][name] = {'error': proc.stderr.strip().splitlines()[-1:]}
+            continue
+        results['cases'][name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        logger.info(f"  {name}: {results['cases'][name]}")
+    return results
+
+def save_results(results, output_dir=None):
+    import config
+    output_dir = output_dir or os.path.join(config.LOGS_DIR, 'benchmarks')
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = results['timestamp'].replace(':', '').replace('-', '')
+    path = os.path.join(output_dir, f"bench-{stamp}-{results['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Benchmark results saved to {path}")
+    return path
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Prints wall-time ratios per case; returns the names of cases that regressed."""
+    regressions = []
+    print(f"{'case':<16}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+    for name, cur in current['cases'].items():
+        base = baseline['cases'].get(name)
+        if not base or 'wall_s' not in base or 'wall_s' not in cur:
+            continue
+        ratio = cur['wall_s'] / base['wall_s'] if base['wall_s'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<16}{base['wall_s']:>12.3f}{cur['wall_s']:>12.3f}{ratio:>8.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audit pipeline on synthetic TLC data.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Synthetic dataset size (1M to 500M)")
+    parser.add_argument('--data-dir', default=None, help="Benchmark data tree (default: data/benchmark)")
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--compare', default=None, help="Baseline results JSON to compare against")
+    parser.add_argument('--startup', action='store_true', help="Only check cold-start import budgets")
+    parser.add_argument('--run-case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup:
+        sys.exit(1 if check_startup() else 0)
+
+    if args.run_case:
+        # Child mode: AUDIT_DATA_DIR is already set by the parent
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_case(args.run_case)))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    data_dir = os.path.abspath(args.data_dir or os.path.join(BASE_DIR, 'data', 'benchmark'))
+    results = run_benchmarks(args.rows, data_dir, args.cases, args.seed)
+    save_results(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(json.load(f), results)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
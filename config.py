@@ -2,15 +2,39 @@ import os
 
 # Base Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+# AUDIT_DATA_DIR points the whole pipeline at another data tree (e.g. synthetic benchmark data)
+DATA_DIR = os.environ.get('AUDIT_DATA_DIR', os.path.join(BASE_DIR, 'data'))
 RAW_DIR = os.path.join(DATA_DIR, 'raw')
 PROCESSED_DIR = os.path.join(DATA_DIR, 'processed')
 OUTPUTS_DIR = os.path.join(DATA_DIR, 'outputs')
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 
-# Ensure directories exist
-for d in [RAW_DIR, PROCESSED_DIR, OUTPUTS_DIR, LOGS_DIR]:
-    os.makedirs(d, exist_ok=True)
+def ensure_dirs():
+    """Creates the data, output and log directories. Called by the code that writes
+    there rather than at import, so importing config has no side effects."""
+    for d in [RAW_DIR, PROCESSED_DIR, OUTPUTS_DIR, LOGS_DIR]:
+        os.makedirs(d, exist_ok=True)
+
+# Resource Governance (DuckDB)
+# Every analytics connection runs inside a fixed memory budget and spills to
+# DUCKDB_TEMP_DIR when an operator (sort, aggregate, join) exceeds it.
+DUCKDB_MEMORY_LIMIT = os.environ.get('AUDIT_MEMORY_LIMIT', '4GB')
+DUCKDB_THREADS = int(os.environ.get('AUDIT_THREADS', min(os.cpu_count() or 4, 8)))
+DUCKDB_TEMP_DIR = os.path.join(PROCESSED_DIR, 'duckdb_tmp')
+DUCKDB_MAX_TEMP_SIZE = os.environ.get('AUDIT_MAX_TEMP_SIZE', '100GB')
+# Rows per parquet row group for everything we write; bounds COPY buffering
+PARQUET_ROW_GROUP_SIZE = 122880
+# Smaller groups for the sorted trip store: a few per day, so date/zone filters prune finely
+TRIP_STORE_ROW_GROUP_SIZE = int(os.environ.get('AUDIT_TRIP_STORE_ROW_GROUP_SIZE', 32768))
+
+# Dashboard Query Pool
+# Live dashboard queries from every session share one read-only DuckDB instance
+# with its own memory budget: at most DASHBOARD_POOL_SIZE run at once, the rest
+# wait for a free cursor, and any query running past DASHBOARD_QUERY_TIMEOUT_S
+# seconds is interrupted.
+DASHBOARD_MEMORY_LIMIT = os.environ.get('AUDIT_DASHBOARD_MEMORY_LIMIT', '2GB')
+DASHBOARD_POOL_SIZE = int(os.environ.get('AUDIT_DASHBOARD_POOL_SIZE', 8))
+DASHBOARD_QUERY_TIMEOUT_S = float(os.environ.get('AUDIT_DASHBOARD_QUERY_TIMEOUT', 15))
 
 # TLC Data URLs
 # Base URL pattern: https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_YYYY-MM.parquet
@@ -27,6 +51,16 @@ YEAR_2024 = 2024
 MONTHS = range(1, 13)
 TAXI_TYPES = ['yellow', 'green']
 
+# Historical Backfill
+# Any year range and TLC trip type, processed one (type, month) partition at a
+# time into per-month aggregates under BACKFILL_DIR.
+BACKFILL_TAXI_TYPES = ['yellow', 'green', 'fhv', 'fhvhv']
+BACKFILL_DIR = os.path.join(PROCESSED_DIR, 'monthly')
+# Concurrent partition aggregations (each gets DUCKDB_THREADS / workers threads)
+BACKFILL_WORKERS = int(os.environ.get('AUDIT_BACKFILL_WORKERS', 2))
+BACKFILL_WORKER_MEMORY = os.environ.get('AUDIT_BACKFILL_WORKER_MEMORY', '2GB')
+DOWNLOAD_WORKERS = 4
+
 # Schema for Unification
 UNIFIED_SCHEMA = [
     'pickup_datetime',
@@ -39,11 +73,66 @@ UNIFIED_SCHEMA = [
     'congestion_surcharge'
 ]
 
-# Missing Month Imputation Weights for Dec 2025
+# Analytics Backend
+# 'duckdb' (default) or 'dask'. The Dask scheduler is 'processes' (single node),
+# 'threads' or 'distributed'; with 'distributed' and no address a LocalCluster
+# is started in-process.
+ANALYTICS_BACKEND = os.environ.get('AUDIT_ANALYTICS_BACKEND', 'duckdb')
+DASK_SCHEDULER = os.environ.get('AUDIT_DASK_SCHEDULER', 'processes')
+DASK_SCHEDULER_ADDRESS = os.environ.get('AUDIT_DASK_ADDRESS') or None
+DASK_WORKERS = int(os.environ['AUDIT_DASK_WORKERS']) if os.environ.get('AUDIT_DASK_WORKERS') else None
+
+# Weather (daily NYC observations for elasticity analysis)
+# WEATHER_SOURCE is either 'open-meteo' or a path to a local CSV/parquet stand-in
+# with a 'date' column plus the daily variables below.
+WEATHER_SOURCE = os.environ.get('WEATHER_SOURCE', 'open-meteo')
+WEATHER_API_URL = "https://archive-api.open-meteo.com/v1/archive"
+NYC_LATITUDE = 40.7831
+NYC_LONGITUDE = -73.9712
+WEATHER_TIMEZONE = "America/New_York"
+WEATHER_DAILY_VARIABLES = ['precipitation_sum', 'snowfall_sum', 'temperature_2m_mean']
+WEATHER_PARQUET = os.path.join(PROCESSED_DIR, 'weather_daily.parquet')
+WEATHER_CACHE = os.path.join(PROCESSED_DIR, 'weather_http_cache')
+
+# Weather Regression
+# Rain bins are daily precipitation (mm) lower bounds; 0 mm is the baseline.
+RAIN_BINS = {'light_rain': 0.1, 'moderate_rain': 5.0, 'heavy_rain': 15.0}
+# Temperature bins (daily mean, C); 10-25 C is the baseline.
+TEMPERATURE_BINS = {'freezing': (-100, 0), 'cold': (0, 10), 'hot': (25, 100)}
+# Hour bands [start, end) matching the dashboard's time ranges
+HOUR_BANDS = {
+    'Morning Peak': (6, 10),
+    'Midday': (10, 16),
+    'Evening Peak': (16, 20),
+    'Night': (20, 6),
+}
+
+# Missing Month Imputation
+# A missing month is rebuilt from the same month in earlier years, aligned by
+# weekday. Weights are keyed by years back (Dec 2025: 2023 = 30%, 2024 = 70%).
 IMPUTATION_WEIGHTS = {
-    '2023-12': 0.3, # source year-month: weight
-    '2024-12': 0.7
+    2: 0.3,
+    1: 0.7
 }
+IMPUTATION_TARGETS = [(2025, 12)]
+# 'sample' writes a raw-format trip file that every stage reads like any other month;
+# 'aggregate' imputes straight into the daily cube from the source months' cube
+# rows (no trips are copied), so only cube-based metrics include the month and
+# trip-level stages (ghost, weather regression, tariff, Dask, trip store, replay)
+# exclude it.
+IMPUTATION_MODE = os.environ.get('AUDIT_IMPUTATION_MODE', 'sample')
+
+# Vendor Fraud Scoring
+# Rates are compared over a trailing window against the baseline period just
+# before it. A vendor alerts when its window ghost rate is FRAUD_ALERT_RATIO x
+# its baseline (and at least FRAUD_ALERT_MIN_DELTA higher), or when it runs
+# FRAUD_ALERT_Z standard deviations above peers in the same zones and days.
+FRAUD_WINDOW_DAYS = 7
+FRAUD_BASELINE_DAYS = 28
+FRAUD_ALERT_RATIO = float(os.environ.get('AUDIT_FRAUD_ALERT_RATIO', 2.0))
+FRAUD_ALERT_MIN_DELTA = 0.01
+FRAUD_ALERT_Z = float(os.environ.get('AUDIT_FRAUD_ALERT_Z', 4.0))
+FRAUD_ALERT_MIN_TRIPS = int(os.environ.get('AUDIT_FRAUD_ALERT_MIN_TRIPS', 500))
 
 # Congestion Zone
 # Lat/Lon boundary is approx 60th St in Manhattan.
@@ -52,3 +141,61 @@ IMPUTATION_WEIGHTS = {
 # but we will rely on shapefile intersection in geospatial.py.
 MANHATTAN_BOROUGH = "Manhattan"
 
+# Geofencing (coordinate-based trips)
+# Exact CBD boundary polygon (GeoJSON/shapefile); without it the union of the
+# congestion zone polygons stands in.
+CBD_BOUNDARY_PATH = os.environ.get('AUDIT_CBD_BOUNDARY', os.path.join(DATA_DIR, 'cbd_boundary.geojson'))
+GEOFENCE_CELL_DEG = 0.002
+GEOFENCE_CHUNK_SIZE = 1_000_000
+# TLC's LocationID for "Unknown"
+UNKNOWN_LOCATION_ID = 264
+
+# Zone Graph / Border Rings
+ZONE_ADJACENCY_TOLERANCE_FT = 50
+# Rings beyond this hop count (or not connected by land) are reported together
+BORDER_MAX_RING = 4
+MORAN_PERMUTATIONS = 999
+
+
+# Query Result Cache
+# Aggregate query results are reused while their SQL and input files are
+# unchanged (see query_cache.py); AUDIT_QUERY_CACHE=0 turns the cache off.
+QUERY_CACHE_ENABLED = os.environ.get('AUDIT_QUERY_CACHE', '1') != '0'
+QUERY_CACHE_MAX_MB = int(os.environ.get('AUDIT_QUERY_CACHE_MB', 512))
+
+# Tariff Schedule
+# Per-trip fees the tariff engine (tariff.py) expects on trips that start or end
+# in the fee's `zones`, by taxi type, from `start` (and before `end`, if set).
+# `peak` rates apply within TARIFF_PEAK_HOURS, `off_peak` otherwise. Point
+# AUDIT_TARIFF_SCHEDULE at a JSON file of the same shape to audit other rates.
+TARIFF_SCHEDULE = {
+    # New York State surcharge on trips in Manhattan south of 96th St
+    'congestion_surcharge': {
+        'start': '2019-02-02',
+        'zones': 'south_of_96th',
+        'peak': {'yellow': 2.50, 'green': 2.75},
+        'off_peak': {'yellow': 2.50, 'green': 2.75},
+    },
+    # MTA congestion relief zone toll (south of 60th St)
+    'cbd_congestion_fee': {
+        'start': '2025-01-05',
+        'zones': 'cbd',
+        'peak': {'yellow': 0.75, 'green': 0.75},
+        'off_peak': {'yellow': 0.75, 'green': 0.75},
+    },
+}
+# Zone sets a schedule entry can name: 'cbd' is the congestion zone
+# (geospatial.get_congestion_zones); the others are Manhattan zones whose
+# centroid lies south of the given latitude.
+TARIFF_ZONE_LATITUDES = {'south_of_96th': 40.787}
+# [start, end) pickup hours of the peak period
+TARIFF_PEAK_HOURS = {'weekday': (5, 21), 'weekend': (9, 21)}
+TARIFF_SCHEDULE_PATH = os.environ.get('AUDIT_TARIFF_SCHEDULE') or None
+TARIFF_BATCH_SIZE = 1_000_000
+
+# Historical Replay (replay.py)
+# Events per micro-batch handed to a consumer, micro-batches buffered before the
+# producer blocks, and rows fetched from DuckDB per read.
+REPLAY_BATCH_SIZE = 1000
+REPLAY_QUEUE_SIZE = 64
+REPLAY_READ_BATCH_SIZE = 100_000
@@ -0,0 +1,256 @@
+import os
+import json
+import hashlib
+import logging
+import config
+import db
+import results_bundle
+import trip_store
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Daily aggregate cube: date x pickup zone x drop-off-in-congestion-zone x
+# taxi_type x vendor, with counts, sums and ghost-rule flag counts, plus a small
+# date x hour x taxi_type rollup. One cube file per raw monthly file, rebuilt
+# only when that file (or the congestion zone list) changes. Time-series
+# metrics (economics, leakage, weather elasticity, dashboard day counts) are
+# derived from these few hundred thousand rows instead of rescanning trips.
+#
+# Every measure is additive (sums and counts), so any roll-up is a SUM. Averages
+# are rebuilt as sum / count: avg surcharge = total_surcharge / surcharge_count,
+# avg tip ratio = tip_ratio_sum / tip_ratio_count.
+#
+# Months with no raw file that are imputed in 'aggregate' mode (see
+# imputation.py) get cube files too, the weighted sum of their source months'
+# cube rows, named like the raw file they stand in for.
+
+CUBE_DIR = os.path.join(config.PROCESSED_DIR, 'cube')
+DAILY_DIR = os.path.join(CUBE_DIR, 'daily')
+HOURLY_DIR = os.path.join(CUBE_DIR, 'hourly')
+STATE_PATH = os.path.join(CUBE_DIR, '_cube.json')
+
+DAILY_DIMENSIONS = ['source_year', 'source_month', 'date', 'taxi_type', 'VendorID', 'PULocationID', 'do_in_zone']
+DAILY_MEASURES = [
+    'trip_count', 'surcharge_count', 'surcharge_trips', 'missing_surcharge_trips',
+    'total_surcharge', 'total_fare', 'total_tip', 'total_distance', 'total_duration_s',
+    'tip_ratio_sum', 'tip_ratio_count',
+    'impossible_speed_trips', 'teleporter_trips', 'stationary_trips', 'flagged_trips',
+]
+HOURLY_DIMENSIONS = ['source_year', 'source_month', 'date', 'hour', 'taxi_type']
+HOURLY_MEASURES = ['trip_count']
+
+# Derived dimensions accepted by totals()
+_DERIVED = {'year': 'year(date)', 'month': 'month(date)', 'dow': 'dayofweek(date)'}
+
+def _load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH) as f:
+        return json.load(f)
+
+def _save_state(state):
+    tmp_path = STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, STATE_PATH)
+
+def _zones_key(zone_ids):
+    return hashlib.sha256(",".join(map(str, sorted(zone_ids))).encode()).hexdigest()[:16]
+
+def _shapefile_key():
+    """Fingerprint of the zone shapefile the congestion zones come from (None if absent)."""
+    path = os.path.join(config.DATA_DIR, 'taxi_zones', 'taxi_zones.shp')
+    return results_bundle.fingerprint_files([path]) if os.path.exists(path) else None
+
+def source_year_month(raw_path):
+    year, month = os.path.basename(raw_path).split('_')[-1].split('.')[0].split('-')
+    return int(year), int(month)
+
+def _cube_paths(raw_path):
+    name = os.path.basename(raw_path)
+    return os.path.join(DAILY_DIR, name), os.path.join(HOURLY_DIR, name)
+
+def _build_file(con, raw_path, zone_list, state):
+    """Writes the daily and hourly cube files for one raw monthly file."""
+    import analytics
+    year, month = source_year_month(raw_path)
+    daily_path, hourly_path = _cube_paths(raw_path)
+    con.execute(f"""
+    CREATE OR REPLACE TEMP VIEW cube_trips AS
+    SELECT
+        CAST(pickup_datetime AS DATE) AS date,
+        hour(pickup_datetime) AS hour,
+        taxi_type, VendorID, PULocationID,
+        DOLocationID IN ({zone_list}) AS do_in_zone,
+        congestion_surcharge, fare_amount, tip_amount, trip_distance,
+        date_diff('second', pickup_datetime, dropoff_datetime) AS duration_s,
+        tip_amount / NULLIF(total_amount - tip_amount, 0) AS tip_ratio,
+        {analytics.GHOST_STATUS_SQL} AS audit_status
+    FROM {trip_store.trips_source(raw_path, state)}
+    """)
+    daily_query = f"""
+    SELECT
+        {year} AS source_year, {month} AS source_month,
+        date, taxi_type, VendorID, PULocationID, do_in_zone,
+        COUNT(*) AS trip_count,
+        COUNT(congestion_surcharge) AS surcharge_count,
+        COUNT(*) FILTER (WHERE congestion_surcharge > 0) AS surcharge_trips,
+        COUNT(*) FILTER (WHERE congestion_surcharge IS NULL OR congestion_surcharge = 0) AS missing_surcharge_trips,
+        SUM(congestion_surcharge) AS total_surcharge,
+        SUM(fare_amount) AS total_fare,
+        SUM(tip_amount) AS total_tip,
+        SUM(trip_distance) AS total_distance,
+        SUM(duration_s) AS total_duration_s,
+        SUM(tip_ratio) AS tip_ratio_sum,
+        COUNT(tip_ratio) AS tip_ratio_count,
+        COUNT(*) FILTER (WHERE audit_status = 'Impossible Speed') AS impossible_speed_trips,
+        COUNT(*) FILTER (WHERE audit_status = 'Teleporter') AS teleporter_trips,
+        COUNT(*) FILTER (WHERE audit_status = 'Stationary') AS stationary_trips,
+        COUNT(*) FILTER (WHERE audit_status <> 'Valid') AS flagged_trips
+    FROM cube_trips
+    GROUP BY ALL
+    ORDER BY date, PULocationID
+    """
+    hourly_query = f"""
+    SELECT {year} AS source_year, {month} AS source_month, date, hour, taxi_type, COUNT(*) AS trip_count
+    FROM cube_trips
+    GROUP BY ALL
+    ORDER BY date, hour
+    """
+    for query, path in ((daily_query, daily_path), (hourly_query, hourly_path)):
+        con.execute(f"COPY ({query}) TO '{path}.tmp' ({db.parquet_copy_options()})")
+        os.replace(f"{path}.tmp", path)
+    con.execute("DROP VIEW cube_trips")
+
+def _imputed_todo(state, imputed, weights, force):
+    """(taxi, year, month, fingerprint) for imputed months that are missing or out of date."""
+    import imputation
+    todo = []
+    for year, month in imputed:
+        for taxi in config.TAXI_TYPES:
+            name = f"{taxi}_tripdata_{year}-{month:02d}.parquet"
+            sources = imputation.source_files(year, month, taxi, weights)
+            if os.path.exists(os.path.join(config.RAW_DIR, name)) or not all(os.path.exists(p) for p in sources):
+                continue
+            fingerprint = f"{results_bundle.fingerprint_files(sources)}:{sorted((weights or config.IMPUTATION_WEIGHTS).items())}"
+            built = all(os.path.exists(os.path.join(d, name)) for d in (DAILY_DIR, HOURLY_DIR))
+            if force or not built or state['imputed'].get(name) != fingerprint:
+                todo.append((taxi, year, month, fingerprint))
+    return todo
+
+def build_cube(zone_ids=None, force=False, imputed=None, weights=None):
+    """
+    Brings the cube up to date with RAW_DIR: (re)builds files for new or changed
+    raw months, and everything if the congestion zone list changed. `imputed`
+    months (default: IMPUTATION_TARGETS in 'aggregate' mode) without a raw file
+    are imputed from their source months. Cheap when nothing changed, so
+    consumers call it before querying. Returns rebuilt names.
+    The zone list is only resolved (geopandas, shapefile) when the shapefile
+    changed since the last build or a month needs rebuilding.
+    """
+    if imputed is None:
+        imputed = config.IMPUTATION_TARGETS if config.IMPUTATION_MODE == 'aggregate' else []
+    os.makedirs(DAILY_DIR, exist_ok=True)
+    os.makedirs(HOURLY_DIR, exist_ok=True)
+
+    def resolve_zones():
+        import analytics
+        return analytics.get_congestion_zones()
+
+    state = _load_state()
+    saved = dict(state)
+    shapefile_key = _shapefile_key()
+    if zone_ids is None and ('zones' not in state or state.get('shapefile') != shapefile_key):
+        zone_ids = resolve_zones()
+    zones_key = _zones_key(zone_ids) if zone_ids is not None else state['zones']
+    if state.get('zones') != zones_key:
+        state = {'zones': zones_key, 'files': {}}
+    state['shapefile'] = shapefile_key
+    state.setdefault('imputed', {})
+    store_state = trip_store._load_state()
+
+    todo = []
+    for raw_path in trip_store.raw_files():
+        name = os.path.basename(raw_path)
+        fingerprint = results_bundle.fingerprint_files([raw_path])
+        built = all(os.path.exists(p) for p in _cube_paths(raw_path))
+        if force or not built or state['files'].get(name) != fingerprint:
+            todo.append((raw_path, fingerprint))
+    if not todo and not _imputed_todo(state, imputed, weights, force):
+        if state != saved:
+            _save_state(state)
+        return []
+
+    if todo and zone_ids is None:
+        zone_ids = resolve_zones()
+        if _zones_key(zone_ids) != zones_key:
+            # Same shapefile, different zones (e.g. a new cutoff): rebuild every month
+            return build_cube(zone_ids, force=force, imputed=imputed, weights=weights)
+    zone_list = ",".join(map(str, zone_ids or [])) or "NULL"
+    con = db.create_connection()
+    try:
+        for raw_path, fingerprint in todo:
+            _build_file(con, raw_path, zone_list, store_state)
+            state['files'][os.path.basename(raw_path)] = fingerprint
+            state['imputed'].pop(os.path.basename(raw_path), None)
+            _save_state(state)
+            logger.info(f"Daily cube built for {os.path.basename(raw_path)}")
+        # After the raw months, so the source months' cube files are current
+        import imputation
+        imputed_todo = _imputed_todo(state, imputed, weights, force)
+        for taxi, year, month, fingerprint in imputed_todo:
+            imputation.impute_cube_month(con, taxi, year, month, weights)
+            state['imputed'][f"{taxi}_tripdata_{year}-{month:02d}.parquet"] = fingerprint
+            _save_state(state)
+    finally:
+        con.close()
+    return [os.path.basename(p) for p, _ in todo] + [f"{t}_tripdata_{y}-{m:02d}.parquet" for t, y, m, _ in imputed_todo]
+
+def imputed_names():
+    """Cube file names that hold imputed rather than observed trips (either imputation mode)."""
+    import raw_manifest
+    sampled = {name for name, entry in raw_manifest.load().items() if entry.get('source') == 'imputed'}
+    return set(_load_state().get('imputed', {})) | sampled
+
+def register_views(con):
+    """Creates the daily_cube and hourly_cube views on con."""
+    con.execute(f"CREATE OR REPLACE VIEW daily_cube AS SELECT * FROM read_parquet('{os.path.join(DAILY_DIR, '*.parquet')}')")
+    con.execute(f"CREATE OR REPLACE VIEW hourly_cube AS SELECT * FROM read_parquet('{os.path.join(HOURLY_DIR, '*.parquet')}')")
+
+def totals(by, measures=None, start=None, end=None, source_years=None, taxi_types=None,
+           where=None, hourly=False, con=None):
+    """
+    Sums cube measures grouped by `by` (dimension names, or 'year' / 'month' /
+    'dow' derived from date) for start <= date < end. Returns a DataFrame.
+    """
+    table = 'hourly_cube' if hourly else 'daily_cube'
+    measures = measures or (HOURLY_MEASURES if hourly else DAILY_MEASURES)
+    keys = [f"{_DERIVED[b]} AS {b}" if b in _DERIVED else b for b in by]
+    filters = []
+    if start is not None:
+        filters.append(f"date >= DATE '{start}'")
+    if end is not None:
+        filters.append(f"date < DATE '{end}'")
+    if source_years:
+        filters.append(f"source_year IN ({','.join(map(str, source_years))})")
+    if taxi_types:
+        filters.append(f"taxi_type IN ({','.join(repr(t) for t in taxi_types)})")
+    if where:
+        filters.append(f"({where})")
+
+    query = f"""
+    SELECT {', '.join(keys + [f'SUM({m}) AS {m}' for m in measures])}
+    FROM {table}
+    {'WHERE ' + ' AND '.join(filters) if filters else ''}
+    {'GROUP BY ' + ', '.join(str(i + 1) for i in range(len(keys))) if keys else ''}
+    {'ORDER BY ' + ', '.join(str(i + 1) for i in range(len(keys))) if keys else ''}
+    """
+    own = con is None
+    con = con or db.create_connection()
+    try:
+        register_views(con)
+        return con.execute(query).df()
+    finally:
+        if own:
+            con.close()
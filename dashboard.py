@@ -1,15 +1,19 @@
 import numpy as np
 import streamlit as st
 import pandas as pd
-import folium
-from streamlit_folium import st_folium
-import geopandas as gpd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import os
 import config
+import db
+import ghost_explorer
+import jobs
+import profiling
+import results_bundle
 from datetime import datetime
 
+# Mapping (folium, geopandas) and plotting (matplotlib, seaborn) libraries are
+# imported just before the tab that first uses them, so the sidebar and overview
+# render on a cold start before those imports run.
+
 # Set page configuration
 st.set_page_config(
     layout="wide", 
@@ -341,6 +345,64 @@ with col_title3:
     st.markdown(f"**Report Date:** {datetime.now().strftime('%Y-%m-%d')}")
 st.markdown("</div>", unsafe_allow_html=True)
 
+# Background Jobs
+@st.cache_resource
+def get_job_manager():
+    # One manager per server process, shared by all sessions
+    return jobs.JobManager()
+
+@st.cache_data(max_entries=2)
+def load_report_bytes(path, job_id):
+    # Read once per export job, not on every rerun of the status fragment
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _job_status():
+    job_manager = get_job_manager()
+    
+    refresh_job = job_manager.latest('refresh')
+    if refresh_job is not None:
+        if refresh_job.is_active:
+            st.progress(refresh_job.progress, text=refresh_job.message)
+        elif refresh_job.status == 'failed':
+            st.error(f"Refresh failed: {refresh_job.error}")
+        else:
+            st.success(refresh_job.message)
+            if st.session_state.get('refreshed_job') != refresh_job.id:
+                # New outputs on disk: drop cached data and redraw the page once
+                st.session_state['refreshed_job'] = refresh_job.id
+                clear_data_caches()
+                st.rerun(scope="app")
+    
+    export_job = job_manager.latest('export')
+    if export_job is not None:
+        if export_job.is_active:
+            st.progress(export_job.progress, text=export_job.message)
+        elif export_job.status == 'failed':
+            st.error(f"Export failed: {export_job.error}")
+        elif export_job.result and os.path.exists(export_job.result):
+            st.download_button(
+                "⬇️ Download Report (PDF)",
+                data=load_report_bytes(export_job.result, export_job.id),
+                file_name=os.path.basename(export_job.result),
+                mime="application/pdf",
+                use_container_width=True
+            )
+
+    # A polling fragment keeps its interval until the app reruns, so redraw the
+    # page once when a job it was polling for settles
+    settled = {job.id for job in (refresh_job, export_job) if job is not None and not job.is_active}
+    if settled & st.session_state.get('polled_jobs', set()):
+        st.rerun(scope="app")
+
+def render_job_status():
+    """Shows background jobs, polling every second only while one is active."""
+    job_manager = get_job_manager()
+    active = [job for job in (job_manager.latest('refresh'), job_manager.latest('export'))
+              if job is not None and job.is_active]
+    st.session_state['polled_jobs'] = {job.id for job in active}
+    st.fragment(_job_status, run_every=1 if active else None)()
+
 # Sidebar with enhanced controls
 with st.sidebar:
     st.markdown("### Analysis Controls")
@@ -403,52 +465,79 @@ with st.sidebar:
     # Quick actions
     st.markdown("---")
     st.markdown("#### Quick Actions")
+    job_manager = get_job_manager()
     if st.button("🔄 Refresh Analysis", use_container_width=True):
-        st.rerun()
+        import analytics
+        job_manager.submit('refresh', analytics.refresh_stale_outputs)
     
     if st.button("📥 Export Report", use_container_width=True):
-        st.info("Report export functionality would be implemented here.")
+        import report_generator
+        job_manager.submit('export', report_generator.export_report)
 
 # Load Data functions
 @st.cache_data
 def load_data():
-    outputs = config.OUTPUTS_DIR
-    
-    # Border Analysis
-    border_df = pd.read_csv(os.path.join(outputs, 'border_analysis.csv'))
-    
-    # Velocity
-    velocity_df = pd.read_csv(os.path.join(outputs, 'velocity_metrics.csv'))
-    
-    # Economics
-    economics_df = pd.read_csv(os.path.join(outputs, 'economics_metrics.csv'))
-    
-    # Rain Elasticity
-    try:
-        elasticity_df = pd.read_csv(os.path.join(outputs, 'trips_vs_weather.csv'))
-        elasticity_score_path = os.path.join(outputs, 'elasticity_score.txt')
-        if os.path.exists(elasticity_score_path):
-            with open(elasticity_score_path, 'r') as f:
-                elasticity_score = float(f.read().strip())
-        else:
-            elasticity_score = None
-    except:
-        elasticity_df = None
-        elasticity_score = None
-    
-    return border_df, velocity_df, economics_df, elasticity_df, elasticity_score
+    # All results come from the typed results bundle; schema problems raise
+    # BundleError and are shown below instead of being masked.
+    return results_bundle.load_dashboard_data()
+
+@st.cache_data
+def load_border_rings():
+    return results_bundle.read_tables(['border_rings'])['border_rings']
+
+@st.cache_data
+def load_fee_leakage():
+    # None until the tariff stage has run
+    if not results_bundle.has_table('fee_leakage'):
+        return None
+    return results_bundle.read_tables(['fee_leakage'])['fee_leakage']
+
+def clear_data_caches():
+    """Drops every cached bundle read after a refresh wrote new results."""
+    load_data.clear()
+    load_border_rings.clear()
+    load_fee_leakage.clear()
+
+@st.cache_resource
+def get_query_pool():
+    # One DuckDB instance per server process; sessions borrow its cursors
+    return db.ConnectionPool()
+
+# Ghost trip explorer: every function takes the file fingerprint so a new ghost
+# audit invalidates its cached options, counts, page keys and pages.
+@st.cache_data(max_entries=4)
+def load_ghost_options(fingerprint):
+    return ghost_explorer.filter_options(con=get_query_pool())
+
+@st.cache_data(max_entries=64)
+def load_ghost_count(fingerprint, filters):
+    return ghost_explorer.count_trips(filters, con=get_query_pool())
+
+@st.cache_data(max_entries=16)
+def load_ghost_boundaries(fingerprint, filters, sort, descending, page_size):
+    return ghost_explorer.page_boundaries(filters, sort, descending, page_size, con=get_query_pool())
+
+@st.cache_data(max_entries=512)
+def load_ghost_page(fingerprint, filters, sort, descending, page_size, page):
+    boundary = None
+    if page > 0:
+        boundary = load_ghost_boundaries(fingerprint, filters, sort, descending, page_size)[page]
+    return ghost_explorer.fetch_page(filters, sort, descending, page_size, boundary, con=get_query_pool())
 
 @st.cache_data
 def load_shapefile():
     shape_dir = os.path.join(config.DATA_DIR, 'taxi_zones')
     shapefile_path = os.path.join(shape_dir, 'taxi_zones.shp')
+    import geopandas as gpd
     return gpd.read_file(shapefile_path).to_crs("EPSG:4326")
 
+with st.sidebar:
+    render_job_status()
+
 # Data loading with status
 try:
     with st.spinner("Loading analysis data..."):
-        border_df, velocity_df, economics_df, elasticity_df, elasticity_score = load_data()
-        gdf = load_shapefile()
+        border_df, velocity_df, economics_df, elasticity_df, elasticity_score, days_covered = load_data()
     
     # Update sidebar with data status
     with st.sidebar:
@@ -459,8 +548,8 @@ try:
             st.markdown(f"**Trips:** {len(velocity_df):,}")
         with col_stat2:
             st.markdown(f"**Months:** {len(economics_df)}")
-            if elasticity_df is not None:
-                st.markdown(f"**Days:** {len(elasticity_df)}")
+            if days_covered is not None:
+                st.markdown(f"**Days:** {days_covered}")
             
 except Exception as e:
     st.error(f"Error loading data: {e}")
@@ -546,11 +635,13 @@ with col4:
 
 # Main Analysis Tabs
 st.markdown("### Detailed Analysis")
-tab1, tab2, tab3, tab4 = st.tabs([
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
     "Geographic Impact Analysis", 
     "Traffic Flow Analysis", 
     "Economic Impact Assessment", 
-    "Environmental Sensitivity"
+    "Environmental Sensitivity",
+    "Ghost Trip Explorer",
+    "Pipeline Profile"
 ])
 
 with tab1:
@@ -578,6 +669,14 @@ with tab1:
         """, unsafe_allow_html=True)
     
     # Merge data with shapefile
+    import folium
+    from streamlit_folium import st_folium
+    try:
+        with st.spinner("Loading zone map..."):
+            gdf = load_shapefile()
+    except Exception as e:
+        st.error(f"Error loading zone shapefile: {e}")
+        st.stop()
     border_df['DOLocationID'] = border_df['DOLocationID'].astype(int)
     gdf['LocationID'] = gdf['LocationID'].astype(int)
     
@@ -658,6 +757,26 @@ with tab1:
                  f"+{max_increase:.1f}% / {max_decrease:.1f}%",
                  delta="Max increase / decrease")
 
+    # Spillover by distance from the zone: rings of neighbouring zones around the CBD
+    if results_bundle.has_table('border_rings'):
+        rings_df = load_border_rings()
+        st.markdown("#### Change by Ring Around the Congestion Zone")
+        col_ring1, col_ring2 = st.columns([3, 1])
+        with col_ring1:
+            st.bar_chart(rings_df.set_index('ring_label')['pct_change'])
+        with col_ring2:
+            try:
+                scalars = results_bundle.read_scalars(['border_morans_i', 'border_morans_p'])
+                st.metric("Moran's I (zone % change)", f"{scalars['border_morans_i']:.3f}",
+                          delta=f"p = {scalars['border_morans_p']:.3f}", delta_color="off")
+            except results_bundle.BundleError:
+                pass
+        st.dataframe(rings_df[['ring_label', 'zones', 'count_2024', 'count_2025', 'pct_change', 'avg_cbd_distance_mi']],
+                     use_container_width=True, hide_index=True)
+
+import matplotlib.pyplot as plt
+import seaborn as sns
+
 with tab2:
     st.markdown('<div class="section-header">Traffic Flow & Velocity Analysis</div>', unsafe_allow_html=True)
     
@@ -821,6 +940,36 @@ with tab3:
     st.pyplot(fig)
     st.markdown("</div>", unsafe_allow_html=True)
     
+    # Expected vs charged fees from the tariff engine
+    fee_df = load_fee_leakage()
+    if fee_df is not None and not fee_df.empty:
+        st.markdown("### Revenue at Risk")
+        st.markdown("Fees expected under the rate schedule but missing from the trip record, in dollars.")
+        fee_totals = fee_df.groupby('fee')[['expected_amount', 'shortfall_amount', 'short_trips']].sum()
+        fee_cols = st.columns(len(fee_totals) + 1)
+        with fee_cols[0]:
+            st.metric("Total Revenue at Risk", f"${fee_totals['shortfall_amount'].sum():,.0f}")
+        for col_fee, (fee, row) in zip(fee_cols[1:], fee_totals.iterrows()):
+            with col_fee:
+                share = row['shortfall_amount'] / row['expected_amount'] * 100 if row['expected_amount'] else 0
+                st.metric(fee.replace('_', ' ').title(), f"${row['shortfall_amount']:,.0f}",
+                          delta=f"{share:.1f}% of expected", delta_color="off")
+        
+        col_risk1, col_risk2 = st.columns(2)
+        with col_risk1:
+            st.markdown("#### By Hour of Day")
+            st.bar_chart(fee_df.pivot_table(index='hour', columns='fee', values='shortfall_amount', aggfunc='sum', fill_value=0))
+        with col_risk2:
+            st.markdown("#### By Vendor")
+            st.bar_chart(fee_df.pivot_table(index='VendorID', columns='fee', values='shortfall_amount', aggfunc='sum', fill_value=0))
+        
+        st.markdown("#### Top Pickup Zones")
+        top_zones = (
+            fee_df.groupby('PULocationID')[['short_trips', 'shortfall_amount']].sum()
+            .sort_values('shortfall_amount', ascending=False).head(10).reset_index()
+        )
+        st.dataframe(top_zones, width='stretch', hide_index=True)
+    
     # Economic insights
     st.markdown("### Economic Insights")
     if 'avg_surcharge' in economics_df.columns and 'avg_tip_pct' in economics_df.columns:
@@ -1041,6 +1190,133 @@ with tab4:
         """)
         st.markdown('</div>', unsafe_allow_html=True)
 
+with tab5:
+    st.markdown('<div class="section-header">Ghost Trip Explorer</div>', unsafe_allow_html=True)
+    
+    st.markdown("""
+    <div class="info-box">
+    <h4>Analysis Insight</h4>
+    Every trip flagged by the ghost trip audit (impossible speed, teleporter or stationary), filtered, sorted
+    and paged on the server so only the visible page is loaded.
+    </div>
+    """, unsafe_allow_html=True)
+    
+    if os.path.exists(ghost_explorer.GHOST_TRIPS_PATH):
+        ghost_fingerprint = results_bundle.fingerprint_files([ghost_explorer.GHOST_TRIPS_PATH])
+        try:
+            ghost_options = load_ghost_options(ghost_fingerprint)
+        except db.QueryTimeout as e:
+            st.warning(f"Loading the filter options timed out ({e}); try again shortly.")
+            ghost_options = {'vendors': [], 'pu_zones': [], 'do_zones': [], 'first_pickup': None, 'last_pickup': None}
+        
+        col_gf1, col_gf2, col_gf3, col_gf4 = st.columns(4)
+        with col_gf1:
+            ghost_rules = st.multiselect("Rule", options=ghost_explorer.RULES)
+        with col_gf2:
+            ghost_vendors = st.multiselect("Vendor", options=ghost_options['vendors'])
+        with col_gf3:
+            ghost_pu_zones = st.multiselect("Pickup Zone", options=ghost_options['pu_zones'])
+        with col_gf4:
+            ghost_do_zones = st.multiselect("Drop-off Zone", options=ghost_options['do_zones'])
+        
+        col_gs1, col_gs2, col_gs3, col_gs4 = st.columns(4)
+        with col_gs1:
+            first_day = pd.Timestamp(ghost_options['first_pickup']).date() if pd.notna(ghost_options['first_pickup']) else None
+            last_day = pd.Timestamp(ghost_options['last_pickup']).date() if pd.notna(ghost_options['last_pickup']) else None
+            ghost_dates = st.date_input("Pickup Dates", value=(first_day, last_day) if first_day else (),
+                                        min_value=first_day, max_value=last_day)
+        with col_gs2:
+            ghost_sort = st.selectbox("Sort By", options=ghost_explorer.SORT_COLUMNS)
+        with col_gs3:
+            ghost_descending = st.radio("Order", options=["Ascending", "Descending"], horizontal=True) == "Descending"
+        with col_gs4:
+            ghost_page_size = st.selectbox("Rows per Page", options=[25, 50, 100], index=1)
+        
+        ghost_filters = {
+            'rules': ghost_rules,
+            'vendors': ghost_vendors,
+            'pu_zones': ghost_pu_zones,
+            'do_zones': ghost_do_zones,
+        }
+        if len(ghost_dates) == 2:
+            ghost_filters['start'] = str(ghost_dates[0])
+            ghost_filters['end'] = str(pd.Timestamp(ghost_dates[1]) + pd.Timedelta(days=1))
+        
+        try:
+            ghost_total, ghost_by_rule = load_ghost_count(ghost_fingerprint, ghost_filters)
+        except db.QueryTimeout as e:
+            st.warning(f"Counting matching trips timed out ({e}); narrow the filters and try again.")
+            ghost_total, ghost_by_rule = 0, {}
+        col_gm1, col_gm2, col_gm3, col_gm4 = st.columns(4)
+        col_gm1.metric("Matching Trips", f"{ghost_total:,}")
+        for col_gm, rule in zip((col_gm2, col_gm3, col_gm4), ghost_explorer.RULES):
+            col_gm.metric(rule, f"{ghost_by_rule.get(rule, 0):,}")
+        
+        if ghost_total:
+            ghost_pages = (ghost_total - 1) // ghost_page_size + 1
+            ghost_page = st.number_input(f"Page (of {ghost_pages:,})", min_value=1, max_value=ghost_pages, value=1, step=1)
+            page_start = datetime.now()
+            try:
+                ghost_df = load_ghost_page(ghost_fingerprint, ghost_filters, ghost_sort, ghost_descending,
+                                           ghost_page_size, int(ghost_page) - 1)
+            except db.QueryTimeout as e:
+                st.warning(f"Loading this page timed out ({e}); try again shortly.")
+            else:
+                page_ms = (datetime.now() - page_start).total_seconds() * 1000
+                st.dataframe(ghost_df, width='stretch', hide_index=True)
+                first_row = (int(ghost_page) - 1) * ghost_page_size + 1
+                st.caption(f"Rows {first_row:,}–{first_row + len(ghost_df) - 1:,} of {ghost_total:,} · page loaded in {page_ms:.0f} ms")
+        else:
+            st.info("No ghost trips match these filters.")
+    else:
+        st.info("No ghost trip audit found yet. Run the ghost stage to browse flagged trips.")
+
+with tab6:
+    st.markdown('<div class="section-header">Pipeline Stage Profile</div>', unsafe_allow_html=True)
+    
+    st.markdown("""
+    <div class="info-box">
+    <h4>Analysis Insight</h4>
+    Wall time, CPU time, rows scanned/output, bytes read and peak memory for every ingestion and analytics stage
+    of a pipeline run. Trace files are in Chrome trace format and can also be opened in chrome://tracing or Perfetto.
+    </div>
+    """, unsafe_allow_html=True)
+    
+    trace_files = profiling.list_traces()
+    if trace_files:
+        selected_trace = st.selectbox(
+            "Pipeline Run",
+            options=trace_files,
+            format_func=lambda p: os.path.basename(p).replace('trace-', '').replace('.json', '')
+        )
+        profile_df = pd.DataFrame(profiling.load_trace_events(selected_trace))
+        
+        col_prof1, col_prof2, col_prof3 = st.columns(3)
+        with col_prof1:
+            st.metric("Total Stage Time", f"{profile_df['wall_s'].sum():,.1f} s")
+        with col_prof2:
+            slowest = profile_df.loc[profile_df['wall_s'].idxmax()]
+            st.metric("Slowest Stage", slowest['stage'], delta=f"{slowest['wall_s'] / profile_df['wall_s'].sum() * 100:.0f}% of total",
+                      delta_color="off")
+        with col_prof3:
+            st.metric("Peak Memory", f"{profile_df['peak_rss_mb'].max():,.0f} MB")
+        
+        st.bar_chart(profile_df.set_index('stage')['wall_s'])
+        st.dataframe(profile_df, width='stretch')
+        
+        # EXPLAIN ANALYZE profiles are only captured when AUDIT_PROFILE_QUERIES=1
+        run_id = os.path.basename(selected_trace).replace('trace-', '').replace('.json', '')
+        query_dir = os.path.join(profiling.QUERY_PROFILES_DIR, run_id)
+        if os.path.isdir(query_dir):
+            query_files = sorted(os.listdir(query_dir))
+            selected_query = st.selectbox("Query Profile (EXPLAIN ANALYZE)", options=query_files)
+            with open(os.path.join(query_dir, selected_query)) as f:
+                st.json(f.read(), expanded=False)
+        else:
+            st.caption("Query plans were not captured for this run. Set AUDIT_PROFILE_QUERIES=1 to record them.")
+    else:
+        st.info("No pipeline traces found yet. Run the pipeline to record stage profiles.")
+
 # Footer
 st.markdown('<div class="footer">', unsafe_allow_html=True)
 footer_col1, footer_col2, footer_col3 = st.columns(3)
@@ -0,0 +1,368 @@
+import os
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import dask
+import dask.dataframe as dd
+import config
+import analytics
+import db
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Out-of-core execution of the analytics audits on Dask DataFrames.
+# Each stage mirrors its DuckDB counterpart in analytics.py (same filters, same
+# NULL handling, same output schema) and writes the same results-bundle tables,
+# so the two backends are interchangeable. Select it with
+# AUDIT_ANALYTICS_BACKEND=dask or analytics.run_stages(backend='dask').
+
+TRIP_COLUMNS = [
+    'VendorID', 'pickup_datetime', 'dropoff_datetime', 'trip_distance', 'fare_amount',
+    'total_amount', 'tip_amount', 'congestion_surcharge', 'PULocationID', 'DOLocationID'
+]
+
+class DaskSession:
+    """
+    Scheduler plus lazily-built trip frames for one analytics run. With the
+    'distributed' scheduler it connects to `address`, or starts a LocalCluster
+    when no address is given.
+    """
+
+    def __init__(self, scheduler=None, address=None, workers=None):
+        self.scheduler = scheduler or config.DASK_SCHEDULER
+        self.workers = workers or config.DASK_WORKERS
+        self.client = None
+        self._cluster = None
+        if self.scheduler == 'distributed':
+            from dask.distributed import Client, LocalCluster
+            address = address or config.DASK_SCHEDULER_ADDRESS
+            if address:
+                self.client = Client(address)
+            else:
+                self._cluster = LocalCluster(n_workers=self.workers, threads_per_worker=1, processes=True)
+                self.client = Client(self._cluster)
+            logger.info(f"Dask distributed client: {self.client.dashboard_link}")
+
+    def compute(self, *collections):
+        """Computes collections on this session's scheduler (the client, if distributed)."""
+        if self.client is not None:
+            return dask.compute(*collections)
+        return dask.compute(*collections, scheduler=self.scheduler, num_workers=self.workers)
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        if self._cluster is not None:
+            self._cluster.close()
+
+    def trips(self, year, columns=None):
+        """
+        Yellow + green trips for one year with unified column names (cf. all_trips_2025).
+        Read from raw files, so months imputed only into the daily cube are excluded.
+        """
+        import imputation
+        imputation.warn_cube_only(f'Dask trips {year}', year)
+        columns = columns or TRIP_COLUMNS
+        frames = []
+        for taxi, prefix in (('yellow', 'tpep'), ('green', 'lpep')):
+            renames = {
+                f'{prefix}_pickup_datetime': 'pickup_datetime',
+                f'{prefix}_dropoff_datetime': 'dropoff_datetime',
+            }
+            source_columns = [{v: k for k, v in renames.items()}.get(c, c) for c in columns]
+            path = os.path.join(config.RAW_DIR, f"{taxi}_tripdata_{year}-*.parquet")
+            ddf = dd.read_parquet(path, columns=source_columns).rename(columns=renames)
+            frames.append(ddf.assign(taxi_type=taxi.capitalize()))
+        return dd.concat(frames)
+
+def _duration_seconds(df):
+    """Matches DuckDB date_diff('second', pickup, dropoff): whole-second boundaries crossed."""
+    delta = df['dropoff_datetime'].dt.floor('s') - df['pickup_datetime'].dt.floor('s')
+    return delta // pd.Timedelta(seconds=1)
+
+def _speed_mph(df, duration):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return df['trip_distance'] / (duration.where(duration != 0) / 3600.0)
+
+def _add_ghost_columns(df):
+    duration = _duration_seconds(df)
+    speed = _speed_mph(df, duration).where(duration > 0, 0.0)
+    status = analytics.classify_ghost_trips(df['trip_distance'], duration, df['fare_amount'])
+    return df.assign(duration_seconds=duration, speed_mph=speed, audit_status=status)
+
+def _write_partitions(session, ddf, output_path, batch_size=None):
+    """
+    Streams a Dask frame into one parquet file, a batch of partitions at a time,
+    so memory stays bounded. Returns the computed partitions' VendorID counts.
+    """
+    batch_size = batch_size or session.workers or os.cpu_count() or 4
+    parts = ddf.to_delayed()
+    schema = pa.Schema.from_pandas(ddf._meta, preserve_index=False)
+    counts = []
+    with pq.ParquetWriter(output_path, schema, compression='zstd') as writer:
+        for start in range(0, len(parts), batch_size):
+            for part in session.compute(*parts[start:start + batch_size]):
+                if part.empty:
+                    continue
+                table = pa.Table.from_pandas(part, preserve_index=False).cast(schema)
+                writer.write_table(table, row_group_size=config.PARQUET_ROW_GROUP_SIZE)
+                counts.append(part['VendorID'].value_counts(dropna=False))
+    return pd.concat(counts).groupby(level=0, dropna=False).sum() if counts else pd.Series(dtype='int64')
+
+def run_ghost_trip_audit(session):
+    """Dask version of analytics.run_ghost_trip_audit."""
+    logger.info("Running Ghost Trip Audit (Dask)...")
+    trips = session.trips(2025)
+    ghosts = trips.map_partitions(_add_ghost_columns)
+    ghosts = ghosts[ghosts['audit_status'] != 'Valid']
+
+    output_path = os.path.join(config.OUTPUTS_DIR, 'audit_ghost_trips.parquet')
+    unsorted_path = output_path + '.unsorted'
+    vendor_counts = _write_partitions(session, ghosts, unsorted_path)
+    # Same layout as the DuckDB stage (sorted by pickup time, small row groups)
+    # so the dashboard's ghost trip explorer can skip row groups
+    con = db.create_connection()
+    try:
+        con.execute(f"""
+        COPY (SELECT * FROM read_parquet('{unsorted_path}') ORDER BY pickup_datetime)
+        TO '{output_path}' ({db.parquet_copy_options(config.TRIP_STORE_ROW_GROUP_SIZE)})
+        """)
+    finally:
+        con.close()
+        os.remove(unsorted_path)
+    logger.info(f"Ghost Trip Audit saved to {output_path}")
+
+    df_vendors = (
+        vendor_counts.rename_axis('VendorID').reset_index(name='ghost_trip_count')
+        .sort_values(['ghost_trip_count', 'VendorID'], ascending=[False, True])
+        .head(5).reset_index(drop=True)
+    )
+    results_bundle.write_table('suspicious_vendors', df_vendors)
+    logger.info("Suspicious Vendor Audit Complete.")
+
+def run_leakage_audit(session):
+    """Dask version of analytics.run_leakage_audit."""
+    logger.info("Running Leakage Audit (Dask)...")
+    zone_ids = analytics.get_congestion_zones()
+    if not zone_ids:
+        logger.warning("No congestion zones found. Skipping Leakage Audit.")
+        return
+
+    trips = session.trips(2025, ['pickup_datetime', 'PULocationID', 'DOLocationID', 'congestion_surcharge'])
+    # SQL NOT IN never matches a NULL PULocationID
+    eligible = trips[
+        (trips['pickup_datetime'] >= pd.Timestamp('2025-01-05'))
+        & trips['PULocationID'].notnull() & ~trips['PULocationID'].isin(zone_ids)
+        & trips['DOLocationID'].isin(zone_ids)
+    ]
+    surcharge = eligible['congestion_surcharge']
+    missing = eligible[surcharge.isna() | (surcharge == 0)]
+
+    top, paid, total = session.compute(
+        missing.groupby('PULocationID').size(), (surcharge > 0).sum(), eligible.shape[0]
+    )
+    df_top = (
+        top.reset_index(name='missing_surcharge_trips')
+        .sort_values(['missing_surcharge_trips', 'PULocationID'], ascending=[False, True])
+        .head(3).reset_index(drop=True)
+    )
+    results_bundle.write_table('leakage_top_locations', df_top)
+
+    df_comp = pd.DataFrame([{
+        'paid_trips': paid,
+        'total_eligible_trips': total,
+        'compliance_rate': paid * 100.0 / total if total else np.nan,
+    }])
+    results_bundle.write_table('compliance_stats', df_comp)
+    logger.info("Leakage Audit Complete.")
+
+def _q1_trips(session, columns):
+    """Q1 2024 and Q1 2025 trips (cf. setup_q1_views: month <= 3 of each year's files)."""
+    frames = {}
+    for year in (2024, 2025):
+        trips = session.trips(year, columns)
+        frames[year] = trips[trips['pickup_datetime'].dt.month <= 3]
+    return frames
+
+def run_volume_analysis(session):
+    """Dask version of analytics.run_volume_analysis."""
+    logger.info("Running Volume Analysis (Dask)...")
+    zone_ids = analytics.get_congestion_zones()
+    q1 = _q1_trips(session, ['pickup_datetime', 'DOLocationID'])
+
+    counts = session.compute(*(
+        q1[year][q1[year]['DOLocationID'].isin(zone_ids)].groupby('taxi_type').size()
+        for year in (2024, 2025)
+    ))
+    df_vol = pd.concat([
+        c.reset_index(name='trip_count').assign(period=f'{year} Q1')
+        for year, c in zip((2024, 2025), counts)
+    ], ignore_index=True)[['period', 'taxi_type', 'trip_count']]
+    results_bundle.write_table('volume_comparison', df_vol)
+    logger.info("Volume Analysis Complete.")
+
+def run_velocity_metrics(session):
+    """Dask version of analytics.run_velocity_metrics."""
+    logger.info("Running Velocity Metrics (Dask)...")
+    zone_ids = analytics.get_congestion_zones()
+    q1 = _q1_trips(session, ['pickup_datetime', 'dropoff_datetime', 'trip_distance', 'PULocationID', 'DOLocationID'])
+
+    def speeds(df):
+        duration = _duration_seconds(df)
+        speed = _speed_mph(df, duration)
+        keep = (
+            df['PULocationID'].isin(zone_ids) & df['DOLocationID'].isin(zone_ids)
+            & (duration > 60) & (df['trip_distance'] > 0.1) & (speed < 100)
+        )
+        pickup = df['pickup_datetime'][keep]
+        return pd.DataFrame({
+            # DuckDB dayofweek: Sunday = 0
+            'dow': (pickup.dt.dayofweek + 1) % 7,
+            'hod': pickup.dt.hour,
+            'avg_speed': speed[keep],
+        })
+
+    results = session.compute(*(
+        q1[year].map_partitions(speeds).groupby(['dow', 'hod'])['avg_speed'].mean()
+        for year in (2024, 2025)
+    ))
+    df_vel = pd.concat([
+        r.reset_index().assign(period=f'{year} Q1')
+        for year, r in zip((2024, 2025), results)
+    ], ignore_index=True)[['period', 'dow', 'hod', 'avg_speed']]
+    results_bundle.write_table('velocity_metrics', df_vel)
+    logger.info("Velocity Metrics Complete.")
+
+def run_border_analysis(session):
+    """Dask version of analytics.run_border_analysis."""
+    logger.info("Running Border Analysis (Dask)...")
+    q1 = _q1_trips(session, ['pickup_datetime', 'DOLocationID'])
+    c24, c25 = session.compute(*(
+        q1[year].groupby('DOLocationID', dropna=False).size() for year in (2024, 2025)
+    ))
+    merged = analytics.border_change(
+        c24.reset_index(name='count_2024'), c25.reset_index(name='count_2025')
+    )
+    analytics.write_border_results(merged)
+    logger.info("Border Analysis Complete.")
+
+def run_economics_metrics(session):
+    """Dask version of analytics.run_economics_metrics."""
+    logger.info("Running Economics Metrics (Dask)...")
+    trips = session.trips(2025, ['pickup_datetime', 'congestion_surcharge', 'tip_amount', 'total_amount'])
+    base = trips['total_amount'] - trips['tip_amount']
+    frame = trips.assign(
+        year=trips['pickup_datetime'].dt.year,
+        month=trips['pickup_datetime'].dt.month,
+        tip_pct=trips['tip_amount'] / base.where(base != 0),
+    )
+    grouped = frame.groupby(['year', 'month']).agg(
+        total_surcharge=('congestion_surcharge', 'sum'),
+        surcharge_count=('congestion_surcharge', 'count'),
+        avg_surcharge=('congestion_surcharge', 'mean'),
+        avg_tip_pct=('tip_pct', 'mean'),
+    )
+    # Days with trips, for the dashboard's data-status panel, in the same pass
+    days = trips['pickup_datetime'].dt.floor('D').nunique()
+    econ_df, days = session.compute(grouped, days)
+    econ_df = econ_df.sort_index().reset_index()
+    # SQL SUM over only NULLs is NULL, not 0
+    econ_df['total_surcharge'] = econ_df['total_surcharge'].where(econ_df['surcharge_count'] > 0)
+    econ_df['avg_tip_pct'] = econ_df['avg_tip_pct'] * 100
+    econ_df = econ_df[['year', 'month', 'total_surcharge', 'avg_surcharge', 'avg_tip_pct']]
+    results_bundle.write_table('economics_metrics', econ_df)
+
+    results_bundle.write_scalar('total_revenue', econ_df['total_surcharge'].sum())
+    results_bundle.write_scalar('days_covered', int(days))
+    logger.info("Economics Metrics Complete.")
+
+# Stage name -> Dask implementation (names match analytics.STAGES)
+STAGES = {
+    'ghost': run_ghost_trip_audit,
+    'leakage': run_leakage_audit,
+    'volume': run_volume_analysis,
+    'velocity': run_velocity_metrics,
+    'border': run_border_analysis,
+    'economics': run_economics_metrics,
+}
+
+# Key columns used to line up rows before comparing backends
+_COMPARE_KEYS = {
+    'suspicious_vendors': ['VendorID'],
+    'leakage_top_locations': ['PULocationID'],
+    'compliance_stats': [],
+    'volume_comparison': ['period', 'taxi_type'],
+    'velocity_metrics': ['period', 'dow', 'hod'],
+    'border_analysis': ['DOLocationID'],
+    'border_rings': ['ring'],
+    'economics_metrics': ['year', 'month'],
+}
+
+def compare_backends(names=None, session=None, rtol=1e-9):
+    """
+    Runs each stage on DuckDB and then on Dask and checks that the bundle tables
+    match (floats up to rtol). Returns {table: None or mismatch message}.
+    """
+    names = [n for n in STAGES if names is None or n in names]
+    own_session = session is None
+    session = session or DaskSession()
+    con = analytics.create_connection()
+    report = {}
+    try:
+        analytics.setup_global_views(con)
+        for name in names:
+            tables = [t for t in analytics.STAGES[name]['tables'] if t in _COMPARE_KEYS]
+            analytics.stage_func(name)(con)
+            expected = results_bundle.read_tables(tables)
+            STAGES[name](session)
+            actual = results_bundle.read_tables(tables)
+            for table in tables:
+                keys = _COMPARE_KEYS[table]
+                left = expected[table].sort_values(keys).reset_index(drop=True) if keys else expected[table]
+                right = actual[table].sort_values(keys).reset_index(drop=True) if keys else actual[table]
+                try:
+                    pd.testing.assert_frame_equal(left, right, check_exact=False, rtol=rtol)
+                    report[table] = None
+                except AssertionError as e:
+                    report[table] = str(e)
+                logger.info(f"{name}/{table}: {'identical' if report[table] is None else 'MISMATCH'}")
+    finally:
+        con.close()
+        if own_session:
+            session.close()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the analytics audits on the Dask backend.")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None)
+    parser.add_argument('--scheduler', choices=['processes', 'threads', 'distributed'], default=None)
+    parser.add_argument('--address', default=None, help="Distributed scheduler address (default: start a LocalCluster)")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--compare', action='store_true', help="Check results against the DuckDB backend")
+    args = parser.parse_args()
+
+    if not args.compare:
+        # Same bookkeeping (fingerprints, traces) as any other analytics run
+        config.DASK_SCHEDULER = args.scheduler or config.DASK_SCHEDULER
+        config.DASK_SCHEDULER_ADDRESS = args.address or config.DASK_SCHEDULER_ADDRESS
+        config.DASK_WORKERS = args.workers or config.DASK_WORKERS
+        analytics.run_stages(args.stages or list(STAGES), backend='dask')
+        return
+
+    session = DaskSession(args.scheduler, args.address, args.workers)
+    try:
+        report = compare_backends(args.stages, session=session)
+    finally:
+        session.close()
+    mismatches = {t: m for t, m in report.items() if m}
+    for table, message in mismatches.items():
+        logger.error(f"{table} differs between backends:\n{message}")
+    raise SystemExit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
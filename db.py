@@ -0,0 +1,148 @@
+import os
+import queue
+import threading
+import contextlib
+import duckdb
+import config
+
+def create_connection(database=':memory:', read_only=False, memory_limit=None, threads=None):
+    """
+    Opens a DuckDB connection inside the configured resource budget:
+    memory limit, thread count and a spill directory under PROCESSED_DIR.
+    Insertion order is not preserved so large COPY/aggregate jobs can stream
+    instead of buffering whole results in memory.
+    """
+    config.ensure_dirs()
+    os.makedirs(config.DUCKDB_TEMP_DIR, exist_ok=True)
+    settings = {
+        'memory_limit': memory_limit or config.DUCKDB_MEMORY_LIMIT,
+        'threads': threads or config.DUCKDB_THREADS,
+        'temp_directory': config.DUCKDB_TEMP_DIR,
+        'max_temp_directory_size': config.DUCKDB_MAX_TEMP_SIZE,
+        'preserve_insertion_order': False,
+    }
+    return duckdb.connect(database, read_only=read_only, config=settings)
+
+class QueryTimeout(TimeoutError):
+    """A pooled query waited too long for a cursor or ran past its timeout."""
+
+class ConnectionPool:
+    """
+    Thread-safe pool of cursors over one in-memory DuckDB instance, for serving
+    many concurrent readers (dashboard sessions) inside one memory budget.
+    The instance's configuration is locked once set up, at most `size` queries
+    run at once, and each query is interrupted after `timeout` seconds.
+
+    DuckDB's Python API has no prepared statement handle, so execute() keeps the
+    parsed statement for each distinct SQL text and binds parameters to it on
+    every call; callers keep values out of the SQL (as ? parameters) so one
+    statement serves every filter value.
+    """
+
+    def __init__(self, size=None, memory_limit=None, threads=None, timeout=None):
+        self.size = size or config.DASHBOARD_POOL_SIZE
+        self.timeout = timeout or config.DASHBOARD_QUERY_TIMEOUT_S
+        self.connection = create_connection(memory_limit=memory_limit or config.DASHBOARD_MEMORY_LIMIT, threads=threads)
+        self.connection.execute("SET lock_configuration = true")
+        self._idle = queue.LifoQueue()
+        for _ in range(self.size):
+            self._idle.put(self.connection.cursor())
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def cursor(self, wait=None):
+        """Borrows an idle cursor, waiting up to `wait` seconds (default: the query timeout)."""
+        try:
+            cursor = self._idle.get(timeout=self.timeout if wait is None else wait)
+        except queue.Empty:
+            raise QueryTimeout(f"No free DuckDB cursor after {self.timeout if wait is None else wait}s ({self.size} in use)")
+        try:
+            yield cursor
+        finally:
+            self._idle.put(cursor)
+
+    def statement(self, query):
+        """Parsed statement for a SQL text, parsed once per pool."""
+        with self._lock:
+            statement = self._statements.get(query)
+            if statement is None:
+                if len(self._statements) >= 256:
+                    self._statements.clear()
+                statement = self._statements[query] = self.connection.extract_statements(query)[0]
+            return statement
+
+    def execute(self, query, params=None, timeout=None, as_arrow=False):
+        """Runs query on a pooled cursor; returns a DataFrame (or a pyarrow Table with as_arrow)."""
+        timeout = timeout or self.timeout
+        statement = self.statement(query)
+        with self.cursor() as cursor:
+            timer = threading.Timer(timeout, cursor.interrupt)
+            timer.start()
+            try:
+                result = cursor.execute(statement, params)
+                return result.to_arrow_table() if as_arrow else result.df()
+            except duckdb.InterruptException:
+                raise QueryTimeout(f"Query interrupted after {timeout}s")
+            finally:
+                timer.cancel()
+
+    def close(self):
+        self.connection.close()
+
+def parquet_copy_options(row_group_size=None):
+    """COPY ... TO options for streamed parquet output with bounded row groups."""
+    return f"FORMAT PARQUET, ROW_GROUP_SIZE {row_group_size or config.PARQUET_ROW_GROUP_SIZE}, COMPRESSION ZSTD"
+
+# Arrow handoff
+# Results move between DuckDB, the caches and the dashboard as Arrow tables.
+# IPC files are uncompressed, so read_ipc() memory-maps them and the column
+# buffers are views of the page cache rather than copies.
+
+def fetch_arrow(con, query, params=None):
+    """Query result as a pyarrow Table (no pandas conversion)."""
+    return con.execute(query, params).to_arrow_table()
+
+def write_ipc(table, path):
+    """Writes a pyarrow Table to an Arrow IPC file via a temp file."""
+    import pyarrow as pa
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def stream_to_ipc(con, query, path, batch_size=None):
+    """Streams a query result into an Arrow IPC file one record batch at a time. Returns rows written."""
+    import pyarrow as pa
+    reader = con.execute(query).to_arrow_reader(batch_size or config.PARQUET_ROW_GROUP_SIZE)
+    rows = 0
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(tmp_path, path)
+    return rows
+
+def read_ipc(path, columns=None):
+    """Memory-mapped pyarrow Table from an Arrow IPC file."""
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.select(columns) if columns else table
+
+def arrow_to_pandas(table):
+    """
+    DataFrame with the dtypes DuckDB's .df() gives (DATE as datetime64,
+    integer columns with NULLs as nullable Int*), so callers see no difference.
+    """
+    import pyarrow as pa
+    import pandas as pd
+    for i, field in enumerate(table.schema):
+        if pa.types.is_date(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.timestamp('us')))
+    df = table.to_pandas(split_blocks=True)
+    nullable = {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}
+    for field in table.schema:
+        if field.type in nullable and table.column(field.name).null_count:
+            df[field.name] = table.column(field.name).to_pandas(types_mapper=nullable.get)
+    return df
@@ -0,0 +1,292 @@
+import os
+import glob
+import json
+import logging
+from datetime import date, timedelta
+import pandas as pd
+import config
+import daily_cube
+import db
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Vendor fraud scoring over the daily cube's ghost-rule counts.
+# Zone level (vendor x day x pickup zone): ghost rate, rule mix and the peer rate,
+# i.e. the ghost rate of every other vendor in the same zone on the same day.
+# Vendor level (vendor x day): the same rolled up, with the expected ghost trips
+# at peer rates (so a vendor is judged against its own zone mix), plus windowed
+# aggregates: the trailing FRAUD_WINDOW_DAYS rate and the FRAUD_BASELINE_DAYS
+# baseline just before that window.
+#
+# Scores are kept per cube month under FRAUD_DIR. A month is rescored only when
+# its cube files, or those of the months its windows reach back into, change, so
+# a newly landed month costs one month of cube rows, never a full-year scan.
+
+FRAUD_DIR = os.path.join(config.PROCESSED_DIR, 'fraud')
+ZONE_DIR = os.path.join(FRAUD_DIR, 'zone_daily')
+VENDOR_DIR = os.path.join(FRAUD_DIR, 'vendor_daily')
+STATE_PATH = os.path.join(FRAUD_DIR, '_fraud.json')
+
+RULES = {
+    'impossible_speed': 'impossible_speed_trips',
+    'teleporter': 'teleporter_trips',
+    'stationary': 'stationary_trips',
+}
+
+# Weight of the citywide daily rate in each zone's peer rate, in trips
+PEER_PRIOR_TRIPS = 50
+
+def _load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH) as f:
+        return json.load(f)
+
+def _save_state(state):
+    tmp_path = STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, STATE_PATH)
+
+def _month_name(year, month):
+    return f"{year}-{month:02d}"
+
+def cube_months():
+    """
+    {(year, month): [daily cube files]} for every month in the cube. Imputed
+    months are left out: their rows blend other years' vendors, so scoring them
+    would raise alerts no vendor earned.
+    """
+    months = {}
+    imputed = daily_cube.imputed_names()
+    for path in sorted(glob.glob(os.path.join(daily_cube.DAILY_DIR, '*.parquet'))):
+        if os.path.basename(path) in imputed:
+            continue
+        months.setdefault(daily_cube.source_year_month(path), []).append(path)
+    return months
+
+def context_months(year, month, months):
+    """The month plus every earlier cube month its window and baseline reach into."""
+    first = date(year, month, 1)
+    reach = first - timedelta(days=config.FRAUD_WINDOW_DAYS + config.FRAUD_BASELINE_DAYS)
+    return [
+        (y, m) for y, m in sorted(months)
+        if (reach.year, reach.month) <= (y, m) <= (year, month)
+    ]
+
+def _score_query(files, start, end):
+    """
+    Zone-level scores for cube rows in `files`, restricted to start <= date < end.
+    Rows whose date falls outside their own source month (stray timestamps in
+    TLC files) are dropped so each day is owned by exactly one month.
+    Peer rates are shrunk towards that day's citywide rate by PEER_PRIOR_TRIPS
+    pseudo-trips, so thin zone-days neither dominate nor give infinite z-scores.
+    """
+    file_list = ", ".join(f"'{p}'" for p in files)
+    rule_sums = ",\n        ".join(f"SUM({col}) AS {col}" for col in RULES.values())
+    return f"""
+    WITH zone_day AS (
+        SELECT date, VendorID, PULocationID,
+            SUM(trip_count) AS trip_count,
+            SUM(flagged_trips) AS flagged_trips,
+            {rule_sums}
+        FROM read_parquet([{file_list}])
+        WHERE date >= DATE '{start}' AND date < DATE '{end}'
+          AND date_trunc('month', date) = make_date(source_year, source_month, 1)
+        GROUP BY ALL
+    ),
+    zone_peers AS (
+        SELECT *,
+            COUNT(*) OVER zone_w > 1 AS has_peers,
+            SUM(flagged_trips) OVER zone_w - flagged_trips AS peer_flagged,
+            SUM(trip_count) OVER zone_w - trip_count AS peer_trips,
+            SUM(flagged_trips) OVER day_w / SUM(trip_count) OVER day_w AS day_rate
+        FROM zone_day
+        WINDOW
+            zone_w AS (PARTITION BY date, PULocationID),
+            day_w AS (PARTITION BY date)
+    ),
+    peers AS (
+        SELECT * EXCLUDE (peer_flagged, peer_trips, day_rate),
+            (peer_flagged + {PEER_PRIOR_TRIPS} * day_rate) / (peer_trips + {PEER_PRIOR_TRIPS}) AS peer_rate
+        FROM zone_peers
+    )
+    SELECT *,
+        flagged_trips / trip_count AS ghost_rate,
+        {", ".join(f"{col} / NULLIF(flagged_trips, 0) AS {rule}_share" for rule, col in RULES.items())},
+        CASE WHEN has_peers THEN trip_count * peer_rate END AS expected_flagged,
+        CASE WHEN has_peers THEN trip_count * peer_rate * (1 - peer_rate) END AS expected_variance
+    FROM peers
+    """
+
+def _vendor_query(zone_query):
+    """Vendor x day roll-up of zone scores with the trailing window and baseline."""
+    window = config.FRAUD_WINDOW_DAYS
+    baseline_end = window + config.FRAUD_BASELINE_DAYS - 1
+    return f"""
+    WITH vendor_day AS (
+        SELECT date, VendorID,
+            SUM(trip_count) AS trip_count,
+            SUM(flagged_trips) AS flagged_trips,
+            {", ".join(f"SUM({col}) AS {col}" for col in RULES.values())},
+            SUM(trip_count) FILTER (WHERE has_peers) AS peered_trips,
+            SUM(flagged_trips) FILTER (WHERE has_peers) AS peered_flagged,
+            SUM(expected_flagged) AS expected_flagged,
+            SUM(expected_variance) AS expected_variance
+        FROM ({zone_query})
+        GROUP BY ALL
+    ),
+    windowed AS (
+        SELECT *,
+            SUM(trip_count) OVER recent AS window_trips,
+            SUM(flagged_trips) OVER recent AS window_flagged,
+            SUM(peered_flagged) OVER recent AS window_peered_flagged,
+            SUM(expected_flagged) OVER recent AS window_expected,
+            SUM(expected_variance) OVER recent AS window_variance,
+            SUM(trip_count) OVER baseline AS baseline_trips,
+            SUM(flagged_trips) OVER baseline AS baseline_flagged
+        FROM vendor_day
+        WINDOW
+            recent AS (PARTITION BY VendorID ORDER BY date
+                RANGE BETWEEN INTERVAL {window - 1} DAYS PRECEDING AND CURRENT ROW),
+            baseline AS (PARTITION BY VendorID ORDER BY date
+                RANGE BETWEEN INTERVAL {baseline_end} DAYS PRECEDING AND INTERVAL {window} DAYS PRECEDING)
+    )
+    SELECT
+        date, VendorID, trip_count, flagged_trips,
+        flagged_trips / trip_count AS ghost_rate,
+        {", ".join(f"{col} / NULLIF(flagged_trips, 0) AS {rule}_share" for rule, col in RULES.items())},
+        expected_flagged / NULLIF(peered_trips, 0) AS peer_rate,
+        (peered_flagged - expected_flagged) / NULLIF(peered_trips, 0) AS peer_deviation,
+        (peered_flagged - expected_flagged) / NULLIF(sqrt(expected_variance), 0) AS peer_z,
+        window_trips,
+        window_flagged / window_trips AS window_rate,
+        baseline_flagged / NULLIF(baseline_trips, 0) AS baseline_rate,
+        (window_peered_flagged - window_expected) / NULLIF(sqrt(window_variance), 0) AS window_peer_z
+    FROM windowed
+    """
+
+def _write(con, query, path):
+    con.execute(f"COPY ({query} ORDER BY ALL) TO '{path}.tmp' ({db.parquet_copy_options()})")
+    os.replace(f"{path}.tmp", path)
+
+def update_scores(con=None, force=False):
+    """
+    Rescores every cube month whose inputs changed since the last run.
+    Returns the rescored month names.
+    """
+    os.makedirs(ZONE_DIR, exist_ok=True)
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    months = cube_months()
+    state = _load_state()
+    params = [config.FRAUD_WINDOW_DAYS, config.FRAUD_BASELINE_DAYS, PEER_PRIOR_TRIPS]
+    if state.get('params') != params:
+        state = {'params': params, 'months': {}}
+
+    todo = []
+    for year, month in sorted(months):
+        name = _month_name(year, month)
+        context = context_months(year, month, months)
+        files = [p for ym in context for p in months[ym]]
+        fingerprint = results_bundle.fingerprint_files(files)
+        built = all(os.path.exists(os.path.join(d, f"{name}.parquet")) for d in (ZONE_DIR, VENDOR_DIR))
+        if force or not built or state['months'].get(name) != fingerprint:
+            todo.append((year, month, files, fingerprint))
+
+    stale = set(state['months']) - {_month_name(y, m) for y, m in months}
+    for name in stale:
+        for d in (ZONE_DIR, VENDOR_DIR):
+            path = os.path.join(d, f"{name}.parquet")
+            if os.path.exists(path):
+                os.remove(path)
+        del state['months'][name]
+    if not todo:
+        if stale:
+            _save_state(state)
+        return []
+
+    own = con is None
+    con = con or db.create_connection()
+    try:
+        for year, month, files, fingerprint in todo:
+            name = _month_name(year, month)
+            first = date(year, month, 1)
+            end = date(year + month // 12, month % 12 + 1, 1)
+            reach = first - timedelta(days=config.FRAUD_WINDOW_DAYS + config.FRAUD_BASELINE_DAYS)
+            # Windows need the days before the month; only the month itself is kept
+            vendor_query = f"SELECT * FROM ({_vendor_query(_score_query(files, reach, end))}) WHERE date >= DATE '{first}'"
+            _write(con, _score_query(months[(year, month)], first, end), os.path.join(ZONE_DIR, f"{name}.parquet"))
+            _write(con, vendor_query, os.path.join(VENDOR_DIR, f"{name}.parquet"))
+            state['months'][name] = fingerprint
+            _save_state(state)
+            logger.info(f"Vendor fraud scores updated for {name}")
+    finally:
+        if own:
+            con.close()
+    return [_month_name(y, m) for y, m, _, _ in todo]
+
+def alerts_query(source):
+    """Alert rows (one per vendor, day and alert type) from vendor-level scores in `source`."""
+    return f"""
+    SELECT date, VendorID, 'rate_jump' AS alert_type, window_rate, baseline_rate, window_peer_z, window_trips
+    FROM {source}
+    WHERE window_trips >= {config.FRAUD_ALERT_MIN_TRIPS}
+      AND window_rate >= baseline_rate * {config.FRAUD_ALERT_RATIO}
+      AND window_rate - baseline_rate >= {config.FRAUD_ALERT_MIN_DELTA}
+    UNION ALL
+    SELECT date, VendorID, 'peer_outlier' AS alert_type, window_rate, baseline_rate, window_peer_z, window_trips
+    FROM {source}
+    WHERE window_trips >= {config.FRAUD_ALERT_MIN_TRIPS}
+      AND window_peer_z >= {config.FRAUD_ALERT_Z}
+    ORDER BY date, VendorID, alert_type
+    """
+
+def zone_scores(start=None, end=None, vendor_ids=None, con=None, as_arrow=False):
+    """Zone-level scores for start <= date < end (optionally some vendors) as a DataFrame (or Arrow table)."""
+    filters = []
+    if start is not None:
+        filters.append(f"date >= DATE '{start}'")
+    if end is not None:
+        filters.append(f"date < DATE '{end}'")
+    if vendor_ids:
+        filters.append(f"VendorID IN ({','.join(map(str, vendor_ids))})")
+    own = con is None
+    con = con or db.create_connection()
+    try:
+        table = db.fetch_arrow(con, f"""
+        SELECT * FROM read_parquet('{os.path.join(ZONE_DIR, '*.parquet')}')
+        {'WHERE ' + ' AND '.join(filters) if filters else ''}
+        ORDER BY date, VendorID, PULocationID
+        """)
+        return table if as_arrow else db.arrow_to_pandas(table)
+    finally:
+        if own:
+            con.close()
+
+def run_fraud_scoring(con):
+    """
+    Updates the cube and per-month scores, then writes vendor_fraud_daily and
+    vendor_fraud_alerts to the results bundle.
+    """
+    logger.info("Running Vendor Fraud Scoring...")
+    daily_cube.build_cube()
+    rescored = update_scores(con)
+    logger.info(f"Rescored months: {rescored or 'none'}")
+
+    if not glob.glob(os.path.join(VENDOR_DIR, '*.parquet')):
+        logger.warning("No cube months to score. Skipping Vendor Fraud Scoring.")
+        return
+    source = f"read_parquet('{os.path.join(VENDOR_DIR, '*.parquet')}')"
+    daily = db.fetch_arrow(con, f"SELECT * FROM {source} ORDER BY date, VendorID")
+    alerts = con.execute(alerts_query(source)).df()
+    results_bundle.write_table('vendor_fraud_daily', daily)
+    results_bundle.write_table('vendor_fraud_alerts', alerts)
+    if not alerts.empty:
+        for vendor, group in alerts.groupby('VendorID'):
+            logger.warning(
+                f"Vendor {vendor}: {len(group)} fraud alerts "
+                f"({', '.join(sorted(group['alert_type'].unique()))}), latest {pd.Timestamp(group['date'].max()).date()}"
+            )
+    logger.info(f"Vendor Fraud Scoring complete: {daily.num_rows} vendor-days, {len(alerts)} alerts.")
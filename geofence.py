@@ -0,0 +1,198 @@
+import os
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+import config
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Point-in-polygon geofencing for coordinate-based trips (pre-2017 TLC files,
+# GPS feeds). A regular lon/lat grid is laid over the taxi zones once: cells
+# that sit wholly inside one zone (or wholly outside every zone / the CBD)
+# answer directly from an array lookup, and only points in cells that straddle
+# a boundary are tested exactly against an STRtree of the zone polygons with
+# shapely's vectorized predicates. Points are processed in chunks.
+
+OUTSIDE = -1
+AMBIGUOUS = -2
+
+# Coordinate columns across TLC schema years, first match wins (case-insensitive)
+COORDINATE_COLUMNS = {
+    'PU': [('pickup_longitude', 'pickup_latitude'), ('Start_Lon', 'Start_Lat')],
+    'DO': [('dropoff_longitude', 'dropoff_latitude'), ('End_Lon', 'End_Lat')],
+}
+
+def load_zone_polygons():
+    """Taxi zone polygons in lon/lat (EPSG:4326) as a GeoDataFrame with LocationID."""
+    import geopandas as gpd
+    import geospatial
+    gdf = gpd.read_file(geospatial.download_and_extract_shapefile(), columns=['LocationID'])
+    if gdf.crs is not None and gdf.crs.to_string() != 'EPSG:4326':
+        gdf = gdf.to_crs('EPSG:4326')
+    return gdf.astype({'LocationID': int})
+
+def load_cbd_boundary(zones=None):
+    """
+    The exact congestion pricing (CBD) boundary from config.CBD_BOUNDARY_PATH.
+    Without that file, falls back to the union of the congestion zone polygons.
+    """
+    import geopandas as gpd
+    if os.path.exists(config.CBD_BOUNDARY_PATH):
+        boundary = gpd.read_file(config.CBD_BOUNDARY_PATH)
+        if boundary.crs is not None and boundary.crs.to_string() != 'EPSG:4326':
+            boundary = boundary.to_crs('EPSG:4326')
+        return shapely.union_all(boundary.geometry.values)
+
+    from geospatial import get_congestion_zones
+    logger.warning(f"{config.CBD_BOUNDARY_PATH} not found; using the union of congestion zone polygons as the CBD.")
+    zones = load_zone_polygons() if zones is None else zones
+    return shapely.union_all(zones[zones['LocationID'].isin(get_congestion_zones())].geometry.values)
+
+class ZoneIndex:
+    """
+    Grid + STRtree index over zone polygons and the CBD boundary.
+    locate(lon, lat) returns (LocationID, in_cbd) arrays; points in no zone get
+    config.UNKNOWN_LOCATION_ID, as in the TLC files.
+    """
+
+    def __init__(self, zones, cbd=None, cell_size=None):
+        self.cell_size = cell_size or config.GEOFENCE_CELL_DEG
+        zones = zones.sort_values('LocationID')
+        self.polygons = np.asarray(zones.geometry.values)
+        self.location_ids = zones['LocationID'].to_numpy()
+        self.tree = shapely.STRtree(self.polygons)
+        self.cbd = cbd
+        if cbd is not None:
+            shapely.prepare(cbd)
+        self._build_grid()
+
+    def _build_grid(self):
+        minx, miny, maxx, maxy = shapely.total_bounds(self.polygons)
+        self.origin = (minx, miny)
+        self.nx = int(np.ceil((maxx - minx) / self.cell_size)) or 1
+        self.ny = int(np.ceil((maxy - miny) / self.cell_size)) or 1
+        ix, iy = np.meshgrid(np.arange(self.nx), np.arange(self.ny))
+        x0 = minx + ix.ravel() * self.cell_size
+        y0 = miny + iy.ravel() * self.cell_size
+        cells = shapely.box(x0, y0, x0 + self.cell_size, y0 + self.cell_size)
+
+        cell_idx, poly_idx = self.tree.query(cells, predicate='intersects')
+        counts = np.bincount(cell_idx, minlength=len(cells))
+        self.cell_zone = np.full(len(cells), OUTSIDE, dtype=np.int32)
+        self.cell_zone[counts > 1] = AMBIGUOUS
+        single = counts[cell_idx] == 1
+        inside = shapely.contains_properly(self.polygons[poly_idx[single]], cells[cell_idx[single]])
+        self.cell_zone[cell_idx[single]] = np.where(inside, self.location_ids[poly_idx[single]], AMBIGUOUS)
+
+        # 1 inside the CBD, 0 outside, -1 on its boundary (exact test needed)
+        self.cell_cbd = np.zeros(len(cells), dtype=np.int8)
+        if self.cbd is not None:
+            self.cell_cbd[shapely.intersects(self.cbd, cells)] = -1
+            self.cell_cbd[shapely.contains_properly(self.cbd, cells)] = 1
+        logger.info(
+            f"Zone grid: {self.nx}x{self.ny} cells, "
+            f"{(self.cell_zone == AMBIGUOUS).mean() * 100:.1f}% need an exact polygon test"
+        )
+
+    def _locate_chunk(self, x, y):
+        location_ids = np.full(len(x), config.UNKNOWN_LOCATION_ID, dtype=np.int32)
+        in_cbd = np.zeros(len(x), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            ix = np.floor((x - self.origin[0]) / self.cell_size)
+            iy = np.floor((y - self.origin[1]) / self.cell_size)
+        on_grid = np.flatnonzero((ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny))
+        cell = iy[on_grid].astype(np.int64) * self.nx + ix[on_grid].astype(np.int64)
+
+        zone = self.cell_zone[cell]
+        direct = zone >= 0
+        location_ids[on_grid[direct]] = zone[direct]
+        exact = on_grid[zone == AMBIGUOUS]
+        if len(exact):
+            point_idx, poly_idx = self.tree.query(shapely.points(x[exact], y[exact]), predicate='intersects')
+            # Points on a shared border match several zones; keep the lowest LocationID
+            order = np.lexsort((poly_idx, point_idx))
+            first = np.unique(point_idx[order], return_index=True)[1]
+            location_ids[exact[point_idx[order][first]]] = self.location_ids[poly_idx[order][first]]
+
+        if self.cbd is not None:
+            cbd = self.cell_cbd[cell]
+            in_cbd[on_grid[cbd == 1]] = True
+            boundary = on_grid[cbd == -1]
+            in_cbd[boundary] = shapely.contains_xy(self.cbd, x[boundary], y[boundary])
+        return location_ids, in_cbd
+
+    def locate(self, lon, lat, chunk_size=None):
+        """(LocationID, in_cbd) for each lon/lat pair; NaN or off-map points are unknown / outside."""
+        x = np.asarray(lon, dtype='float64')
+        y = np.asarray(lat, dtype='float64')
+        chunk_size = chunk_size or config.GEOFENCE_CHUNK_SIZE
+        location_ids = np.empty(len(x), dtype=np.int32)
+        in_cbd = np.empty(len(x), dtype=bool)
+        for start in range(0, len(x), chunk_size):
+            end = start + chunk_size
+            location_ids[start:end], in_cbd[start:end] = self._locate_chunk(x[start:end], y[start:end])
+        return location_ids, in_cbd
+
+_zone_index = None
+
+def get_zone_index():
+    """Process-wide ZoneIndex over the taxi zone shapefile (built on first use)."""
+    global _zone_index
+    if _zone_index is None:
+        zones = load_zone_polygons()
+        _zone_index = ZoneIndex(zones, load_cbd_boundary(zones))
+    return _zone_index
+
+def coordinate_columns(names):
+    """{'PU': (lon, lat), 'DO': (lon, lat)} column names present in a schema."""
+    lower = {n.lower(): n for n in names}
+    found = {}
+    for prefix, candidates in COORDINATE_COLUMNS.items():
+        for lon, lat in candidates:
+            if lon.lower() in lower and lat.lower() in lower:
+                found[prefix] = (lower[lon.lower()], lower[lat.lower()])
+                break
+    return found
+
+def needs_geofencing(path):
+    """True for files with pickup/drop-off coordinates but no LocationID columns."""
+    names = pq.read_schema(path).names
+    has_ids = any(n.lower() == 'dolocationid' for n in names)
+    return not has_ids and bool(coordinate_columns(names))
+
+def geofence_file(source, output, index=None, chunk_size=None):
+    """
+    Streams a coordinate-based trip file into `output` with PULocationID,
+    DOLocationID, pu_in_cbd and do_in_cbd added, one chunk of rows at a time.
+    Returns the output path.
+    """
+    index = index or get_zone_index()
+    chunk_size = chunk_size or config.GEOFENCE_CHUNK_SIZE
+    pf = pq.ParquetFile(source)
+    if pf.metadata.num_rows == 0:
+        raise ValueError(f"{source} has no rows to geofence")
+    columns = coordinate_columns(pf.schema_arrow.names)
+    tmp_path = output + '.tmp'
+    writer = None
+    try:
+        for batch in pf.iter_batches(batch_size=chunk_size):
+            for prefix, (lon, lat) in columns.items():
+                ids, in_cbd = index.locate(
+                    batch.column(lon).to_numpy(zero_copy_only=False),
+                    batch.column(lat).to_numpy(zero_copy_only=False),
+                    chunk_size
+                )
+                batch = batch.append_column(f'{prefix}LocationID', pa.array(ids))
+                batch = batch.append_column(f'{prefix.lower()}_in_cbd', pa.array(in_cbd))
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, batch.schema)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, output)
+    logger.info(f"Geofenced {pf.metadata.num_rows:,} trips from {os.path.basename(source)}")
+    return output
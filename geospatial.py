@@ -1,13 +1,14 @@
 import os
-import requests
 import zipfile
 import io
-import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point
 import config
 import logging
 
+# geopandas, shapely, scipy and requests are imported where they are used, so
+# importing this module (e.g. for get_congestion_zones) stays cheap.
+
 # Setup Logger
 logger = logging.getLogger(__name__)
 
@@ -23,6 +24,7 @@ def download_and_extract_shapefile():
         return shapefile_path
     
     logger.info("Downloading Taxi Zone Shapefile...")
+    import requests
     try:
         r = requests.get(config.SHAPEFILE_URL)
         r.raise_for_status()
@@ -45,6 +47,7 @@ def get_manhattan_zones():
     if not os.path.exists(shapefile_path):
         download_and_extract_shapefile()
         
+    import geopandas as gpd
     gdf = gpd.read_file(shapefile_path)
     
     # Filter for Manhattan
@@ -52,6 +55,15 @@ def get_manhattan_zones():
     
     return manhattan_zones
 
+def get_zone_lookup():
+    """
+    Returns a plain DataFrame of LocationID, zone, borough (no geometry).
+    """
+    import geopandas as gpd
+    shapefile_path = download_and_extract_shapefile()
+    gdf = gpd.read_file(shapefile_path, columns=['LocationID', 'zone', 'borough'], ignore_geometry=True)
+    return pd.DataFrame(gdf).astype({'LocationID': int})
+
 def get_congestion_zones():
     """
     Identifies zones South of 60th St.
@@ -68,6 +80,14 @@ def get_congestion_zones():
     Let's use a rough latitude cutoff for automation: 40.764 (approx 60th St).
     Zones with centroid.y < 40.764 in Manhattan.
     """
+    # Latitude Threshold for 60th St (approx)
+    # 60th St is roughly 40.764
+    LAT_THRESHOLD = 40.764
+    
+    return get_manhattan_zones_south_of(LAT_THRESHOLD)
+
+def get_manhattan_zones_south_of(latitude):
+    """LocationIDs of Manhattan zones whose centroid lies south of `latitude`."""
     zones = get_manhattan_zones()
     
     # Calculate centroids
@@ -75,14 +95,114 @@ def get_congestion_zones():
     # We check crs.
     if zones.crs.to_string() != 'EPSG:4326':
         zones = zones.to_crs('EPSG:4326')
-        
-    # Latitude Threshold for 60th St (approx)
-    # 60th St is roughly 40.764
-    LAT_THRESHOLD = 40.764
-    
-    congestion_zones = zones[zones.geometry.centroid.y < LAT_THRESHOLD]
     
-    return congestion_zones['LocationID'].tolist()
+    return zones[zones.geometry.centroid.y < latitude]['LocationID'].tolist()
+
+# Zone Graph
+# Zones sharing a border (within ZONE_ADJACENCY_TOLERANCE_FT, which bridges
+# digitising slivers) form a sparse adjacency matrix. Each zone's ring is its
+# hop count to the nearest congestion zone (0 = inside, -1 = not connected by
+# land, e.g. EWR). Cached next to the shapefile's derived data and rebuilt when
+# the shapefile or the congestion zone list changes.
+ZONE_GRAPH_PATH = os.path.join(config.PROCESSED_DIR, 'zone_graph.npz')
+
+_zone_graph = None
+
+def _zone_graph_key(shapefile_path, cbd_ids):
+    import results_bundle
+    return f"{results_bundle.fingerprint_files([shapefile_path])}:{','.join(map(str, sorted(cbd_ids)))}"
+
+def build_zone_graph(cbd_ids=None, force=False):
+    """
+    Returns (rings_df, adjacency): rings_df has one row per LocationID (ring,
+    cbd_distance_mi) in the same order as the rows of the CSR adjacency matrix.
+    Rings count hops to `cbd_ids` (default: get_congestion_zones()).
+    """
+    global _zone_graph
+    import geopandas as gpd
+    import shapely
+    from scipy import sparse
+    from scipy.sparse.csgraph import shortest_path
+
+    shapefile_path = download_and_extract_shapefile()
+    cbd_ids = get_congestion_zones() if cbd_ids is None else cbd_ids
+    key = _zone_graph_key(shapefile_path, cbd_ids)
+    if not force and _zone_graph is not None and _zone_graph[0] == key:
+        return _zone_graph[1]
+    if not force and os.path.exists(ZONE_GRAPH_PATH):
+        cached = np.load(ZONE_GRAPH_PATH)
+        if str(cached['key']) == key:
+            n = len(cached['location_ids'])
+            adjacency = sparse.csr_matrix((cached['data'], cached['indices'], cached['indptr']), shape=(n, n))
+            rings = pd.DataFrame({k: cached[k] for k in ('location_ids', 'ring', 'cbd_distance_mi')})
+            rings = rings.rename(columns={'location_ids': 'LocationID'})
+            _zone_graph = (key, (rings, adjacency))
+            return rings, adjacency
+
+    # Distances in feet: the shapefile's native CRS is EPSG:2263
+    zones = gpd.read_file(shapefile_path, columns=['LocationID']).to_crs('EPSG:2263')
+    zones = zones.astype({'LocationID': int}).dissolve(by='LocationID').reset_index()
+    geoms = np.asarray(zones.geometry.values)
+    n = len(geoms)
+
+    tree = shapely.STRtree(geoms)
+    i, j = tree.query(shapely.buffer(geoms, config.ZONE_ADJACENCY_TOLERANCE_FT), predicate='intersects')
+    keep = i != j
+    adjacency = sparse.csr_matrix((np.ones(keep.sum()), (i[keep], j[keep])), shape=(n, n))
+    adjacency = ((adjacency + adjacency.T) > 0).astype(np.float64).tocsr()
+
+    is_cbd = zones['LocationID'].isin(cbd_ids).to_numpy()
+    if is_cbd.any():
+        hops = shortest_path(adjacency, unweighted=True, directed=False, indices=np.flatnonzero(is_cbd)).min(axis=0)
+        cbd = shapely.union_all(geoms[is_cbd])
+        distance_mi = shapely.distance(geoms, cbd) / 5280.0
+    else:
+        hops = np.full(n, np.inf)
+        distance_mi = np.full(n, np.nan)
+    rings = pd.DataFrame({
+        'LocationID': zones['LocationID'].to_numpy(),
+        'ring': np.where(np.isfinite(hops), hops, -1).astype(int),
+        'cbd_distance_mi': distance_mi,
+    })
+
+    os.makedirs(os.path.dirname(ZONE_GRAPH_PATH), exist_ok=True)
+    tmp_path = ZONE_GRAPH_PATH + '.tmp.npz'
+    np.savez(tmp_path, key=key, location_ids=rings['LocationID'].to_numpy(), ring=rings['ring'].to_numpy(),
+             cbd_distance_mi=distance_mi, data=adjacency.data, indices=adjacency.indices, indptr=adjacency.indptr)
+    os.replace(tmp_path, ZONE_GRAPH_PATH)
+    logger.info(f"Zone graph: {n} zones, {adjacency.nnz // 2} adjacent pairs, max ring {rings['ring'].max()}")
+    _zone_graph = (key, (rings, adjacency))
+    return rings, adjacency
+
+def morans_i(values, adjacency, permutations=None, seed=0):
+    """
+    Global Moran's I for one value per adjacency row (row-standardised weights;
+    NaN zones are dropped) and a one-sided pseudo p-value from random
+    permutations, all computed as sparse x dense products.
+    Returns (I, p_value).
+    """
+    from scipy import sparse
+    permutations = config.MORAN_PERMUTATIONS if permutations is None else permutations
+    x = np.asarray(values, dtype='float64')
+    keep = np.isfinite(x)
+    weights = adjacency[keep][:, keep]
+    row_sums = np.asarray(weights.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    weights = (sparse.diags(inverse) @ weights).tocsr()
+
+    z = x[keep] - x[keep].mean()
+    n, s0, zz = len(z), weights.sum(), z @ z
+    if n < 3 or s0 == 0 or zz == 0:
+        return float('nan'), float('nan')
+    moran = n / s0 * (z @ (weights @ z)) / zz
+    if not permutations:
+        return float(moran), float('nan')
+
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permuted(np.broadcast_to(z[:, None], (n, permutations)), axis=0)
+    simulated = n / s0 * np.einsum('ij,ij->j', shuffled, weights @ shuffled) / zz
+    p_value = (np.sum(simulated >= moran) + 1) / (permutations + 1)
+    return float(moran), float(p_value)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,169 @@
+import os
+import logging
+import pandas as pd
+import config
+import db
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Server-side browsing of audit_ghost_trips.parquet for the dashboard. Filters,
+# sorting and paging all run in DuckDB, so only one page of rows is ever
+# materialized. Pages use keyset pagination on (sort column, file row number)
+# rather than OFFSET: page_boundaries() finds the first key of every page in one
+# narrow scan, and fetch_page() then reads just the rows from that key on. The
+# ghost audit writes the file sorted by pickup time in small row groups, so
+# date filters (and the default sort) skip row groups from their min/max stats.
+# Filter values are bound as ? parameters, so the SQL text depends only on which
+# filters are set and a pooled connection reuses its parsed statements.
+
+GHOST_TRIPS_PATH = os.path.join(config.OUTPUTS_DIR, 'audit_ghost_trips.parquet')
+RULES = ['Impossible Speed', 'Teleporter', 'Stationary']
+SORT_COLUMNS = [
+    'pickup_datetime', 'speed_mph', 'fare_amount', 'trip_distance', 'duration_seconds',
+    'total_amount', 'VendorID', 'PULocationID', 'DOLocationID'
+]
+DISPLAY_COLUMNS = [
+    'pickup_datetime', 'dropoff_datetime', 'audit_status', 'VendorID', 'taxi_type',
+    'PULocationID', 'DOLocationID', 'trip_distance', 'duration_seconds', 'speed_mph',
+    'fare_amount', 'total_amount', 'congestion_surcharge'
+]
+DEFAULT_PAGE_SIZE = 50
+
+def _source(path=None):
+    return f"read_parquet('{path or GHOST_TRIPS_PATH}', file_row_number = true)"
+
+def where_clause(filters):
+    """
+    (SQL predicate, parameters) for a filters dict with optional keys: rules,
+    vendors, pu_zones, do_zones (lists) and start, end (start <= pickup < end).
+    """
+    filters = filters or {}
+    conditions = []
+    params = []
+    rules = [r for r in filters.get('rules') or [] if r in RULES]
+    if rules:
+        conditions.append(f"audit_status IN ({', '.join('?' for _ in rules)})")
+        params += rules
+    for key, column in (('vendors', 'VendorID'), ('pu_zones', 'PULocationID'), ('do_zones', 'DOLocationID')):
+        values = filters.get(key)
+        if values:
+            conditions.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            params += [int(v) for v in values]
+    if filters.get('start') is not None:
+        conditions.append("pickup_datetime >= ?")
+        params.append(pd.Timestamp(filters['start']).to_pydatetime())
+    if filters.get('end') is not None:
+        conditions.append("pickup_datetime < ?")
+        params.append(pd.Timestamp(filters['end']).to_pydatetime())
+    return ' AND '.join(conditions) or 'TRUE', params
+
+def _order_by(sort, descending):
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort ghost trips by {sort!r}; choose one of {SORT_COLUMNS}")
+    return f"{sort} {'DESC' if descending else 'ASC'} NULLS LAST, file_row_number"
+
+def _has_nulls(column, path=None):
+    """True unless the parquet footer statistics show the column has no NULLs."""
+    import pyarrow.parquet as pq
+    meta = pq.read_metadata(path or GHOST_TRIPS_PATH)
+    index = meta.schema.names.index(column)
+    for i in range(meta.num_row_groups):
+        stats = meta.row_group(i).column(index).statistics
+        if stats is None or not stats.has_null_count or stats.null_count:
+            return True
+    return False
+
+def _run(query, params=None, con=None):
+    """Query result as a DataFrame on con: a connection, a db.ConnectionPool, or None for a new connection."""
+    if isinstance(con, db.ConnectionPool):
+        return con.execute(query, params or None)
+    own = con is None
+    con = con or db.create_connection()
+    try:
+        return con.execute(query, params or None).df()
+    finally:
+        if own:
+            con.close()
+
+def filter_options(con=None, path=None):
+    """Vendors, pickup/drop-off zones and the pickup date range present in the file."""
+    df = _run(f"""
+    SELECT
+        list(DISTINCT VendorID ORDER BY VendorID) AS vendors,
+        list(DISTINCT PULocationID ORDER BY PULocationID) AS pu_zones,
+        list(DISTINCT DOLocationID ORDER BY DOLocationID) AS do_zones,
+        min(pickup_datetime) AS first_pickup,
+        max(pickup_datetime) AS last_pickup
+    FROM {_source(path)}
+    """, con=con)
+    row = df.iloc[0]
+    return {
+        'vendors': [int(v) for v in row['vendors'] if v is not None],
+        'pu_zones': [int(z) for z in row['pu_zones'] if z is not None],
+        'do_zones': [int(z) for z in row['do_zones'] if z is not None],
+        'first_pickup': row['first_pickup'],
+        'last_pickup': row['last_pickup'],
+    }
+
+def count_trips(filters=None, con=None, path=None):
+    """Ghost trips matching filters, plus a per-rule breakdown as {rule: count}."""
+    where, params = where_clause(filters)
+    df = _run(f"""
+    SELECT audit_status, count(*) AS trips
+    FROM {_source(path)}
+    WHERE {where}
+    GROUP BY 1
+    ORDER BY 1
+    """, params, con=con)
+    return int(df['trips'].sum()), dict(zip(df['audit_status'], df['trips'].astype(int)))
+
+def page_boundaries(filters=None, sort='pickup_datetime', descending=False, page_size=DEFAULT_PAGE_SIZE,
+                    con=None, path=None):
+    """
+    (sort value, file row number) of the first row of every page, in page order.
+    One scan of the sort column; every page after that is a keyset lookup.
+    """
+    where, params = where_clause(filters)
+    df = _run(f"""
+    SELECT sort_value, file_row_number FROM (
+        SELECT
+            {sort} AS sort_value,
+            file_row_number,
+            row_number() OVER (ORDER BY {_order_by(sort, descending)}) - 1 AS position
+        FROM {_source(path)}
+        WHERE {where}
+    )
+    WHERE position % {int(page_size)} = 0
+    ORDER BY position
+    """, params, con=con)
+    return list(zip(df['sort_value'], df['file_row_number']))
+
+def fetch_page(filters=None, sort='pickup_datetime', descending=False, page_size=DEFAULT_PAGE_SIZE,
+               boundary=None, con=None, path=None):
+    """
+    One page of ghost trips (DISPLAY_COLUMNS) starting at `boundary`, a
+    (sort value, file row number) key from page_boundaries(); None is the first page.
+    """
+    where, params = where_clause(filters)
+    conditions = [where]
+    if boundary is not None:
+        value, row_number = boundary
+        if pd.isna(value):
+            # NULLs sort last, so only NULL rows from this row number on remain
+            conditions.append(f"{sort} IS NULL AND file_row_number >= ?")
+            params.append(int(row_number))
+        else:
+            op = '<' if descending else '>'
+            keyset = f"{sort} {op}= ? AND ({sort} {op} ? OR file_row_number >= ?)"
+            if _has_nulls(sort, path):
+                keyset = f"({keyset}) OR {sort} IS NULL"
+            conditions.append(f"({keyset})")
+            params += [value, value, int(row_number)]
+    return _run(f"""
+    SELECT {', '.join(DISPLAY_COLUMNS)}
+    FROM {_source(path)}
+    WHERE {' AND '.join(conditions)}
+    ORDER BY {_order_by(sort, descending)}
+    LIMIT {int(page_size)}
+    """, params, con=con)
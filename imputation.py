@@ -0,0 +1,238 @@
+import os
+import calendar
+import logging
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import config
+import db
+import raw_manifest
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Missing-month imputation. Each source month (the same month N years earlier)
+# is aligned to the target by weekday: a source day moves forward by whole
+# 52-week blocks (364 days), so Mondays stay Mondays. By default ('sample') a
+# raw-format trip file is written with a seeded, weighted share of each source's
+# trips, so every stage reads the month. 'aggregate' copies no trips: the target
+# month's daily cube files are the weighted sum of the source months' cube rows,
+# written under the target's raw file name so every cube consumer (economics,
+# leakage, weather, fraud) sees the month, while trip-level stages do not (see
+# warn_cube_only).
+PICKUP_COLUMNS = {'yellow': ('tpep_pickup_datetime', 'tpep_dropoff_datetime'),
+                  'green': ('lpep_pickup_datetime', 'lpep_dropoff_datetime')}
+
+def source_months(year, month, weights=None):
+    """[(source_year, weight)] for a target month, newest first (its schema leads the output)."""
+    weights = weights or config.IMPUTATION_WEIGHTS
+    return [(year - back, weight) for back, weight in sorted(weights.items())]
+
+def weekday_day_map(target_year, target_month, source_year):
+    """
+    [(target_date, source_date)] pairing every target day with a source day on the
+    same weekday: the source day is 52-week blocks back, nudged by whole weeks
+    to stay inside the source month. A source day may serve two target days.
+    """
+    blocks = 364 * (target_year - source_year)
+    first = date(source_year, target_month, 1)
+    last = date(source_year, target_month, calendar.monthrange(source_year, target_month)[1])
+    pairs = []
+    for day in range(1, calendar.monthrange(target_year, target_month)[1] + 1):
+        target = date(target_year, target_month, day)
+        source = target - timedelta(days=blocks)
+        while source > last:
+            source -= timedelta(days=7)
+        while source < first:
+            source += timedelta(days=7)
+        pairs.append((target, source))
+    return pairs
+
+def _register_day_map(con, name, pairs):
+    values = ", ".join(f"(DATE '{t}', DATE '{s}')" for t, s in pairs)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {name} AS SELECT * FROM (VALUES {values}) v(target_date, source_date)")
+
+def _raw_path(taxi, year, month):
+    return os.path.join(config.RAW_DIR, f"{taxi}_tripdata_{year}-{month:02d}.parquet")
+
+def fetch_sources(targets, taxi_types=None, weights=None):
+    """Downloads every missing source file for the targets concurrently."""
+    import ingestion
+    taxi_types = taxi_types or config.TAXI_TYPES
+    tasks = {
+        _raw_path(taxi, source_year, month)
+        for year, month in targets
+        for source_year, _ in source_months(year, month, weights)
+        for taxi in taxi_types
+    }
+    missing = sorted(p for p in tasks if not os.path.exists(p))
+    with ThreadPoolExecutor(max_workers=config.DOWNLOAD_WORKERS) as executor:
+        results = list(executor.map(
+            lambda path: ingestion.download_file(f"{config.TLC_BASE_URL}/{os.path.basename(path)}", path), missing
+        ))
+    return [p for p, ok in zip(missing, results) if not ok]
+
+def _sample_query(con, taxi, year, month, weights, seed):
+    """
+    Weighted sample in one streaming pass: each source keeps the trips whose
+    seeded hash falls below its weight, so every (day, hour, zone) stratum keeps
+    that share in expectation and reruns pick the same trips.
+    """
+    pu_col, do_col = PICKUP_COLUMNS[taxi]
+    parts = []
+    for i, (source_year, weight) in enumerate(source_months(year, month, weights)):
+        day_map = f"day_map_{i}"
+        _register_day_map(con, day_map, weekday_day_map(year, month, source_year))
+        shift = "to_days(CAST(m.target_date - m.source_date AS INTEGER))"
+        parts.append(f"""
+        SELECT src.* REPLACE ({pu_col} + {shift} AS {pu_col}, {do_col} + {shift} AS {do_col})
+        FROM '{_raw_path(taxi, source_year, month)}' src
+        JOIN {day_map} m ON CAST(src.{pu_col} AS DATE) = m.source_date
+        WHERE hash({pu_col}, {do_col}, PULocationID, DOLocationID, total_amount, m.target_date, {seed}) % 1000000
+            < {round(weight * 1000000)}
+        """)
+    return " UNION ALL BY NAME ".join(parts)
+
+def _cube_query(con, cube_dir, measures, taxi, year, month, weights):
+    """
+    Weighted sum of the source months' cube rows, moved to their aligned target
+    dates. Count measures are rounded back to integers after summing.
+    """
+    parts = []
+    for i, (source_year, weight) in enumerate(source_months(year, month, weights)):
+        day_map = f"cube_day_map_{i}"
+        _register_day_map(con, day_map, weekday_day_map(year, month, source_year))
+        source = os.path.join(cube_dir, os.path.basename(_raw_path(taxi, source_year, month)))
+        parts.append(f"""
+        SELECT m.target_date AS date, c.* EXCLUDE (source_year, source_month, date), {weight} AS _weight
+        FROM '{source}' c
+        JOIN {day_map} m ON c.date = m.source_date
+        """)
+    types = {row[0]: row[1] for row in con.execute(f"DESCRIBE SELECT * FROM '{source}'").fetchall()}
+    columns = []
+    for name, dtype in types.items():
+        if name in ('source_year', 'source_month'):
+            columns.append(f"{year if name == 'source_year' else month} AS {name}")
+        elif name not in measures:
+            columns.append(name)
+        elif dtype == 'BIGINT':
+            columns.append(f"CAST(round(SUM({name} * _weight)) AS BIGINT) AS {name}")
+        else:
+            columns.append(f"SUM({name} * _weight) AS {name}")
+    keys = [c for c in types if c not in measures and c not in ('source_year', 'source_month')]
+    return f"""
+    SELECT {', '.join(columns)}
+    FROM ({" UNION ALL ".join(parts)})
+    GROUP BY {', '.join(keys)}
+    ORDER BY {', '.join(k for k in ('date', 'hour', 'PULocationID') if k in keys)}
+    """
+
+def source_files(year, month, taxi, weights=None):
+    """Raw files of the source months a target month is imputed from."""
+    return [_raw_path(taxi, y, month) for y, _ in source_months(year, month, weights)]
+
+def impute_cube_month(con, taxi, year, month, weights=None):
+    """
+    Writes the daily and hourly cube files for a month with no raw file from its
+    source months' cube files (which must be built). Returns the written paths.
+    """
+    import daily_cube
+    name = os.path.basename(_raw_path(taxi, year, month))
+    written = []
+    for cube_dir, measures in ((daily_cube.DAILY_DIR, daily_cube.DAILY_MEASURES),
+                               (daily_cube.HOURLY_DIR, daily_cube.HOURLY_MEASURES)):
+        target = os.path.join(cube_dir, name)
+        query = _cube_query(con, cube_dir, measures, taxi, year, month, weights)
+        con.execute(f"COPY ({query}) TO '{target}.tmp' ({db.parquet_copy_options()})")
+        os.replace(f"{target}.tmp", target)
+        written.append(target)
+    logger.info(f"Imputed {taxi} {year}-{month:02d} into the daily cube from {[y for y, _ in source_months(year, month, weights)]}")
+    return written
+
+def output_path(taxi, year, month, mode=None):
+    """The raw file ('sample') or daily cube file ('aggregate') an imputed month is written to."""
+    if (mode or config.IMPUTATION_MODE) == 'aggregate':
+        import daily_cube
+        return os.path.join(daily_cube.DAILY_DIR, os.path.basename(_raw_path(taxi, year, month)))
+    return _raw_path(taxi, year, month)
+
+def impute_month(year, month, taxi_types=None, mode=None, weights=None, seed=42, force=False):
+    """
+    Imputes one missing month for each taxi type from its weighted source months.
+    'aggregate' brings the daily cube up to date with the month imputed into it;
+    'sample' writes a TLC-format monthly file, its row groups written in parallel
+    since insertion order is not preserved. Returns the written paths.
+    """
+    mode = mode or config.IMPUTATION_MODE
+    taxi_types = taxi_types or config.TAXI_TYPES
+    if mode == 'aggregate':
+        import daily_cube
+        daily_cube.build_cube(imputed=[(year, month)], weights=weights)
+        return [
+            output_path(taxi, year, month, mode) for taxi in taxi_types
+            if not os.path.exists(_raw_path(taxi, year, month))
+            and os.path.exists(output_path(taxi, year, month, mode))
+        ]
+
+    written = []
+    con = db.create_connection()
+    try:
+        for taxi in taxi_types:
+            target = output_path(taxi, year, month, mode)
+            if os.path.exists(target) and not force:
+                logger.info(f"{target} already exists. Skipping imputation.")
+                continue
+            sources = source_files(year, month, taxi, weights)
+            absent = [p for p in sources if not os.path.exists(p)]
+            if absent:
+                logger.error(f"Cannot impute {taxi} {year}-{month:02d}; missing sources: {absent}")
+                continue
+
+            query = _sample_query(con, taxi, year, month, weights, seed)
+            tmp_path = target + '.tmp'
+            con.execute(f"COPY ({query}) TO '{tmp_path}' ({db.parquet_copy_options()})")
+            os.replace(tmp_path, target)
+            raw_manifest.record(target, source='imputed')
+            logger.info(f"Imputed {taxi} {year}-{month:02d} ({mode}) -> {target}")
+            written.append(target)
+    finally:
+        con.close()
+    return written
+
+def cube_only_months(year=None, taxi_types=None):
+    """Imputation targets (optionally of one year) that have no raw trip file, only cube rows ('aggregate' mode)."""
+    if config.IMPUTATION_MODE != 'aggregate':
+        return []
+    taxi_types = taxi_types or config.TAXI_TYPES
+    return [
+        (y, m) for y, m in config.IMPUTATION_TARGETS
+        if (year is None or y == year) and any(not os.path.exists(_raw_path(t, y, m)) for t in taxi_types)
+    ]
+
+def warn_cube_only(stage, year=None, taxi_types=None):
+    """Logs that a trip-level stage excludes months imputed only into the daily cube."""
+    months = cube_only_months(year, taxi_types)
+    if months:
+        logger.warning(f"{stage}: months {months} are imputed into the daily cube only "
+                       f"(IMPUTATION_MODE='aggregate') and are excluded from this stage.")
+    return months
+
+def impute_missing_months(targets=None, taxi_types=None, mode=None):
+    """Fetches sources for all targets concurrently, then imputes each missing month."""
+    targets = targets or config.IMPUTATION_TARGETS
+    taxi_types = taxi_types or config.TAXI_TYPES
+    todo = [
+        (year, month) for year, month in targets
+        if any(not os.path.exists(_raw_path(t, year, month)) for t in taxi_types)
+    ]
+    if not todo:
+        logger.info("No months need imputation.")
+        return []
+    failed = fetch_sources(todo, taxi_types)
+    if failed:
+        logger.warning(f"Could not download imputation sources: {failed}")
+    if (mode or config.IMPUTATION_MODE) == 'aggregate':
+        # The daily cube imputes these months on its next build (before any
+        # analytics query), from the source months' cube files
+        logger.info(f"Months {todo} will be imputed into the daily cube.")
+        return []
+    return [path for year, month in todo for path in impute_month(year, month, taxi_types, mode)]
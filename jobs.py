@@ -0,0 +1,72 @@
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+class Job:
+    """State of a single background job, updated by the worker thread and read by the UI."""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex[:8]
+        self.kind = kind
+        self.status = 'pending'  # pending -> running -> done | failed
+        self.progress = 0.0
+        self.message = "Queued"
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def is_active(self):
+        return self.status in ('pending', 'running')
+
+    def update(self, fraction, message):
+        self.progress = max(0.0, min(1.0, fraction))
+        self.message = message
+
+class JobManager:
+    """
+    Runs long tasks (analytics refresh, report export) off the Streamlit script thread.
+    Only one job per kind runs at a time; submitting a kind that is already active
+    returns the running job instead of starting duplicate work.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._latest = {}
+
+    def submit(self, kind, func, *args, **kwargs):
+        """Schedules func(*args, progress=callback, **kwargs) and returns its Job."""
+        with self._lock:
+            current = self._latest.get(kind)
+            if current is not None and current.is_active:
+                return current
+            job = Job(kind)
+            self._latest[kind] = job
+
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def latest(self, kind):
+        return self._latest.get(kind)
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        job.update(0.0, "Started")
+        try:
+            job.result = func(*args, progress=job.update, **kwargs)
+            job.status = 'done'
+            job.update(1.0, job.message)
+        except Exception as e:
+            logger.error(f"Job {job.kind} ({job.id}) failed: {e}", exc_info=True)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
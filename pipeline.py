@@ -6,52 +6,188 @@ import config
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-import ingestion
-import geospatial
-import analytics
-import weather
-import report_generator
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(config.LOGS_DIR, 'pipeline.log')),
-        logging.StreamHandler()
-    ]
-)
+import profiling
+
+# Phase modules (and their geo / PDF / HTTP dependencies) are imported when the
+# phase runs, so a run that skips a phase never pays for its imports.
+
 logger = logging.getLogger("Pipeline")
 
-def main():
+# Stages outside the analytics registry, in run order around it
+PRE_STAGES = ['ingest', 'trip_store']
+POST_STAGES = ['report']
+
+def setup_logging():
+    config.ensure_dirs()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(config.LOGS_DIR, 'pipeline.log')),
+            logging.StreamHandler()
+        ]
+    )
+
+def all_stages():
+    import analytics
+    return PRE_STAGES + list(analytics.STAGES) + POST_STAGES
+
+def parse_month(value):
+    """'YYYY-MM' -> (year, month)."""
+    try:
+        year, month = (int(part) for part in value.split('-'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"month out of range in {value!r}")
+    return year, month
+
+def selected_months(start=None, end=None):
+    """Default ingestion months within [start, end] (inclusive), or None for all of them."""
+    if start is None and end is None:
+        return None
+    import ingestion
+    return [m for m in ingestion.default_months() if (start is None or m >= start) and (end is None or m <= end)]
+
+def _format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f"{n:,.0f} {unit}" if unit == 'B' else f"{n:,.1f} {unit}"
+        n /= 1024
+
+def build_plan(stages, months=None, taxi_types=None):
+    """
+    One row per selected stage: whether it is stale, how many files it reads and
+    the estimated compressed bytes it scans (from parquet footers only).
+    """
+    import analytics
+    import ingestion
+    import results_bundle
+    import trip_store
+
+    years = sorted({year for year, _ in months}) if months is not None else None
+    records = results_bundle.read_stage_records()
+    plan = []
+    for name in stages:
+        if name == 'ingest':
+            missing = [dest for _, dest in ingestion.planned_downloads(months, taxi_types) if not os.path.exists(dest)]
+            row = {'stale': bool(missing), 'files': len(missing), 'bytes': 0, 'note': f"{len(missing)} file(s) to download"}
+        elif name == 'trip_store':
+            state = trip_store._load_state()
+            raws = [p for y in years for p in trip_store.raw_files(y, taxi_types)] if years else trip_store.raw_files(taxi_types=taxi_types)
+            todo = [p for p in raws if not trip_store.is_current(p, state)]
+            row = {'stale': bool(todo), 'files': len(todo), 'bytes': analytics.scan_bytes(todo), 'note': f"{len(raws) - len(todo)}/{len(raws)} current"}
+        elif name == 'report':
+            # fpdf loads with report_generator, so only when the report is planned
+            import report_generator
+            stale = not os.path.exists(results_bundle.BUNDLE_PATH) or report_generator.is_report_stale()
+            row = {'stale': stale, 'files': 1, 'bytes': 0, 'note': 'reads the results bundle'}
+        else:
+            files, scan = analytics.scan_estimate(name)
+            row = {'stale': analytics.is_stage_stale(name, records), 'files': len(files), 'bytes': scan, 'note': ''}
+        plan.append({'stage': name, **row})
+    return plan
+
+def print_plan(plan, only_stale=False):
+    print("\nExecution plan:")
+    print(f"  {'stage':<20} {'action':<8} {'files':>6} {'est. scan':>12}  note")
+    total = 0
+    for row in plan:
+        run = row['stale'] or not only_stale
+        total += row['bytes'] if run else 0
+        action = ('run' if row['stale'] else 'rerun') if run else 'skip'
+        print(f"  {row['stage']:<20} {action:<8} {row['files']:>6} {_format_bytes(row['bytes']):>12}  {row['note']}")
+    print(f"  {'total':<20} {'':<8} {'':>6} {_format_bytes(total):>12}\n")
+
+def run(stages, months=None, taxi_types=None, only_stale=False, report_boroughs=(), report_months=()):
+    """
+    Runs the selected stages in pipeline order; with only_stale, skips stages whose outputs are current.
+    The report stage also writes a variant per borough in report_boroughs and month in report_months.
+    """
+    import analytics
+    analytics_stages = [s for s in stages if s in analytics.STAGES]
+    years = sorted({year for year, _ in months}) if months is not None else None
+
+    with profiling.run():
+        if 'ingest' in stages:
+            logger.info("=== Phase 1: Data Ingestion ===")
+            import ingestion
+            ingestion.run_ingestion(months, taxi_types)
+        if 'trip_store' in stages:
+            import trip_store
+            with profiling.stage('trip_store', category='ingestion'):
+                trip_store.build_trip_store(years, taxi_types=taxi_types)
+
+        if analytics_stages:
+            logger.info("=== Phase 2: Analytics & Processing ===")
+            # Re-checked here: ingestion may have changed the inputs since the plan was printed
+            if only_stale:
+                stale = set(analytics.get_stale_stages())
+                skipped = [s for s in analytics_stages if s not in stale]
+                if skipped:
+                    logger.info(f"Skipping up-to-date stages: {', '.join(skipped)}")
+                analytics_stages = [s for s in analytics_stages if s in stale]
+            if analytics_stages:
+                analytics.run_stages(analytics_stages)
+
+        if 'report' in stages:
+            logger.info("=== Phase 3: Reporting_Generator ===")
+            import report_generator
+            if report_boroughs or report_months:
+                # Variants have no staleness check of their own, so they always run
+                with profiling.stage('report', category='reporting'):
+                    report_generator.generate_reports(report_boroughs, report_months)
+            elif only_stale and not report_generator.is_report_stale():
+                logger.info("Report is up to date.")
+            else:
+                with profiling.stage('report', category='reporting'):
+                    report_generator.generate_report()
+
+def build_parser():
+    stages = all_stages()
+    parser = argparse.ArgumentParser(description="NYC Congestion Pricing Audit pipeline.")
+    parser.add_argument('--stages', '--stage', nargs='+', choices=stages, metavar='STAGE',
+                        help=f"Stages to run (default: all). One or more of: {', '.join(stages)}")
+    parser.add_argument('--start', type=parse_month, help="First month to ingest, YYYY-MM")
+    parser.add_argument('--end', type=parse_month, help="Last month to ingest (inclusive), YYYY-MM")
+    parser.add_argument('--taxi-types', nargs='+', choices=config.TAXI_TYPES, help="Taxi types to ingest and store")
+    parser.add_argument('--only-stale', action='store_true', help="Skip stages whose outputs are up to date")
+    parser.add_argument('--report-boroughs', nargs='+', default=[], metavar='BOROUGH',
+                        help="Report stage: also write a report per drop-off borough")
+    parser.add_argument('--report-months', nargs='+', type=int, choices=range(1, 13), default=[], metavar='MONTH',
+                        help="Report stage: also write a report per 2025 month (1-12)")
+    parser.add_argument('--plan', action='store_true', help="Print the execution plan and exit")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    setup_logging()
+    order = all_stages()
+    stages = [s for s in order if s in args.stages] if args.stages else order
+    months = selected_months(args.start, args.end)
+    if months == []:
+        print("No audit months fall within the requested date range.")
+        sys.exit(1)
+
+    print_plan(build_plan(stages, months, args.taxi_types), args.only_stale)
+    if args.plan:
+        return
+
     logger.info("Starting NYC Congestion Pricing Audit Pipeline...")
-    
     try:
-        # Phase 1: Ingestion
-        logger.info("=== Phase 1: Data Ingestion ===")
-        ingestion.run_ingestion()
-        
-        # Phase 2: Geospatial & Analytics
-        logger.info("=== Phase 2: Analytics & Processing ===")
-        analytics.main()
-        weather.fetch_weather_data()
-        con = analytics.create_connection()
-        analytics.setup_global_views(con) # Re-create views
-        weather.calculate_elasticity(con)
-        con.close()
-        
-        # Phase 3: Reporting
-        logger.info("=== Phase 3: Reporting_Generator ===")
-        report_generator.generate_report()
-        
+        run(stages, months, args.taxi_types, args.only_stale, args.report_boroughs, args.report_months)
+
         logger.info("Pipeline Execution Complete Successfully.")
         print("\n\nPipeline Complete!")
-        print(f"Report available at: {os.path.join(config.BASE_DIR, 'audit_report.pdf')}")
+        if 'report' in stages:
+            print(f"Report available at: {os.path.join(config.BASE_DIR, 'audit_report.pdf')}")
+            if args.report_boroughs or args.report_months:
+                print(f"Report variants written to: {config.OUTPUTS_DIR}")
         print("To view the dashboard, run: streamlit run dashboard.py\n")
-        
+
     except Exception as e:
         logger.error(f"Pipeline Failed: {e}", exc_info=True)
         sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
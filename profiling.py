@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import shutil
+import threading
+import resource
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+import config
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Per-stage instrumentation. Every profiled stage becomes one Chrome trace
+# event ("ph": "X") whose args hold wall/CPU time, rows scanned/output, bytes
+# read and peak RSS. Open the trace files in chrome://tracing or Perfetto, or
+# on the dashboard's Pipeline Profile tab.
+TRACES_DIR = os.path.join(config.LOGS_DIR, 'traces')
+QUERY_PROFILES_DIR = os.path.join(config.LOGS_DIR, 'query_profiles')
+
+# Capture DuckDB EXPLAIN ANALYZE profiles for every query (costly; on demand only)
+PROFILE_QUERIES = os.environ.get('AUDIT_PROFILE_QUERIES', '0') == '1'
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_local = threading.local()
+
+def _current_rss():
+    """Resident set size in bytes (Linux /proc; falls back to the lifetime peak)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _read_chars():
+    """Bytes returned by read syscalls so far, which includes parquet reads served from page cache."""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split(':')[1])
+    except OSError:
+        pass
+    return 0
+
+class _PeakMemorySampler(threading.Thread):
+    """Samples RSS in the background so each stage gets its own peak."""
+
+    def __init__(self, interval=0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, _current_rss())
+        return self.peak
+
+class Trace:
+    """Collects stage events for one pipeline / refresh run."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.events = []
+        self.t0 = time.perf_counter()
+
+    def save(self):
+        os.makedirs(TRACES_DIR, exist_ok=True)
+        path = os.path.join(TRACES_DIR, f"trace-{self.run_id}.json")
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                       'otherData': {'run_id': self.run_id}}, f, indent=1)
+        logger.info(f"Stage trace written to {path}")
+        return path
+
+@contextmanager
+def run(run_id=None):
+    """
+    Opens a trace for a top-level run and writes it on exit. Nested runs (e.g.
+    analytics.run_stages inside the pipeline) join the outer trace.
+    """
+    if getattr(_local, 'trace', None) is not None:
+        yield _local.trace
+        return
+    _local.trace = Trace(run_id or datetime.now().strftime('%Y%m%dT%H%M%S'))
+    try:
+        yield _local.trace
+    finally:
+        trace, _local.trace = _local.trace, None
+        if trace.events:
+            trace.save()
+
+@contextmanager
+def stage(name, category='analytics', rows_scanned=None):
+    """
+    Measures one stage. Yields a dict the caller may fill with extra metrics
+    (e.g. rows_output); everything ends up in the trace event's args.
+    """
+    metrics = {'rows_scanned': rows_scanned}
+    sampler = _PeakMemorySampler()
+    sampler.start()
+    chars_before = _read_chars()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        wall = time.perf_counter() - start
+        metrics.update({
+            'wall_s': round(wall, 4),
+            'cpu_s': round(time.process_time() - cpu_before, 4),
+            'bytes_read': _read_chars() - chars_before,
+            'peak_rss_mb': round(sampler.stop() / 2**20, 1),
+        })
+        logger.info(f"[profile] {category}.{name}: {metrics}")
+
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': round((start - trace.t0) * 1e6),
+                'dur': round(wall * 1e6),
+                'pid': os.getpid(),
+                'tid': threading.get_ident() % 2**31,
+                'args': metrics,
+            })
+
+class ProfiledConnection:
+    """
+    Wraps a DuckDB connection so every query's EXPLAIN ANALYZE profile (JSON) is
+    kept as LOGS_DIR/query_profiles/<run>/<stage>-<n>.json. Only used when
+    PROFILE_QUERIES is on, since profiling adds per-operator overhead.
+    """
+
+    def __init__(self, con, run_id):
+        self._con = con
+        self._dir = os.path.join(QUERY_PROFILES_DIR, run_id)
+        self._scratch = os.path.join(self._dir, '_last.json')
+        self._count = 0
+        self._pending = None
+        self.stage = 'setup'
+        os.makedirs(self._dir, exist_ok=True)
+        con.execute("PRAGMA enable_profiling = 'json'")
+        con.execute(f"PRAGMA profiling_output = '{self._scratch}'")
+
+    def _flush(self):
+        # DuckDB writes the profile once the result is fully consumed (e.g. by .df()),
+        # so the previous query's profile is collected right before the next one runs.
+        if self._pending and os.path.exists(self._scratch):
+            shutil.move(self._scratch, os.path.join(self._dir, f"{self._pending}.json"))
+        self._pending = None
+
+    def execute(self, query, *args, **kwargs):
+        self._flush()
+        result = self._con.execute(query, *args, **kwargs)
+        self._count += 1
+        self._pending = f"{self.stage}-{self._count:03d}"
+        return result
+
+    def close(self):
+        self._flush()
+        self._con.close()
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+def list_traces():
+    """Trace files, newest first."""
+    if not os.path.exists(TRACES_DIR):
+        return []
+    files = [os.path.join(TRACES_DIR, f) for f in os.listdir(TRACES_DIR) if f.endswith('.json')]
+    return sorted(files, key=os.path.getmtime, reverse=True)
+
+def load_trace_events(path):
+    """Flattens a trace file into one record per stage (for tables/charts)."""
+    with open(path) as f:
+        trace = json.load(f)
+    return [
+        {'stage': e['name'], 'category': e['cat'], 'start_s': e['ts'] / 1e6, **e.get('args', {})}
+        for e in trace['traceEvents']
+    ]
@@ -0,0 +1,161 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import logging
+import tempfile
+import config
+import db
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Persistent result cache for aggregate queries. A result is keyed on the
+# normalized SQL text, its parameters and the fingerprints of the files the
+# query reads, and stored as one Arrow IPC file under CACHE_DIR. Unchanged
+# queries are answered from a memory-mapped file without touching DuckDB; a
+# changed input file or query simply misses. The entry files themselves are the
+# source of truth: a hit touches the file's mtime, and entries are evicted
+# least-recently-used by mtime once CACHE_DIR grows past
+# config.QUERY_CACHE_MAX_MB. The index only carries hit counts and SQL text, so
+# an index save lost to a concurrent writer cannot orphan an entry file.
+
+CACHE_DIR = os.path.join(config.PROCESSED_DIR, 'query_cache')
+INDEX_PATH = os.path.join(CACHE_DIR, '_index.json')
+# Bump when the views queries run against (all_trips_*, daily_cube) change meaning
+CACHE_VERSION = 2
+
+_LITERAL = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+def normalize_sql(sql):
+    """Drops comments, collapses whitespace and lowercases everything outside literals."""
+    parts = _LITERAL.split(sql)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r'--[^\n]*', ' ', parts[i])
+        parts[i] = re.sub(r'\s+', ' ', part).lower()
+    return ''.join(parts).strip().rstrip(';').strip()
+
+def cache_key(sql, params=None, inputs=()):
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSION};".encode())
+    h.update(normalize_sql(sql).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    h.update(results_bundle.fingerprint_files(inputs).encode())
+    return h.hexdigest()[:32]
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.arrow")
+
+def _load_index():
+    # An unreadable index only costs misses: entries are rewritten as queries rerun
+    if not os.path.exists(INDEX_PATH):
+        return {}
+    try:
+        with open(INDEX_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Query cache index unreadable ({e}); starting from an empty index.")
+        return {}
+
+def _save_index(index):
+    # A temp file per writer: the dashboard refresh job and the pipeline CLI may
+    # save at the same time, and os.replace keeps whichever lands last intact
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix='_index.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, INDEX_PATH)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _scan_entries():
+    """{key: (bytes, mtime)} for every entry file in CACHE_DIR, indexed or not."""
+    entries = {}
+    for path in glob.glob(os.path.join(CACHE_DIR, '*.arrow')):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries[os.path.basename(path)[:-len('.arrow')]] = (st.st_size, st.st_mtime)
+    return entries
+
+def _remove_entry(key):
+    try:
+        os.remove(_entry_path(key))
+    except FileNotFoundError:
+        pass
+
+def _evict(index, max_bytes):
+    """
+    Removes least-recently-used entry files until CACHE_DIR fits in max_bytes,
+    and drops index entries whose file is gone.
+    """
+    entries = _scan_entries()
+    total = sum(size for size, _ in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k][1]):
+        if total <= max_bytes:
+            break
+        total -= entries.pop(key)[0]
+        _remove_entry(key)
+        logger.info(f"Query cache evicted {key}")
+    for key in set(index) - set(entries):
+        del index[key]
+
+def cached_arrow(con, sql, inputs=(), params=None):
+    """
+    Arrow result of con.execute(sql, params), served from the cache when the
+    same query already ran over the same `inputs` (the files it reads).
+    """
+    if not config.QUERY_CACHE_ENABLED:
+        return db.fetch_arrow(con, sql, params)
+
+    key = cache_key(sql, params, inputs)
+    path = _entry_path(key)
+    index = _load_index()
+    try:
+        table = db.read_ipc(path)
+        os.utime(path)
+    except FileNotFoundError:
+        # Not cached, or evicted by another process since
+        pass
+    else:
+        entry = index.setdefault(key, {'hits': 0, 'sql': normalize_sql(sql)[:200]})
+        entry['hits'] += 1
+        _save_index(index)
+        logger.info(f"Query cache hit {key} ({table.num_rows:,} rows)")
+        return table
+
+    table = db.fetch_arrow(con, sql, params)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db.write_ipc(table, path)
+    index[key] = {
+        'hits': 0,
+        'sql': normalize_sql(sql)[:200],
+    }
+    _evict(index, config.QUERY_CACHE_MAX_MB * 1024 * 1024)
+    _save_index(index)
+    return table
+
+def cached_query(con, sql, inputs=(), params=None):
+    """cached_arrow() as a DataFrame."""
+    return db.arrow_to_pandas(cached_arrow(con, sql, inputs, params))
+
+def cache_stats():
+    """Entry count, total bytes and hits across the cache."""
+    entries = _scan_entries()
+    index = _load_index()
+    return {
+        'entries': len(entries),
+        'bytes': sum(size for size, _ in entries.values()),
+        'hits': sum(index[key]['hits'] for key in entries if key in index),
+    }
+
+def clear_cache():
+    for key in _scan_entries():
+        _remove_entry(key)
+    if os.path.exists(INDEX_PATH):
+        os.remove(INDEX_PATH)
@@ -0,0 +1,180 @@
+import os
+import json
+import glob
+import threading
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow.parquet as pq
+import config
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Integrity manifest for RAW_DIR. Every raw parquet file gets an entry with its
+# size, mtime, HTTP validators (ETag / Last-Modified), row count and row-group
+# stats. validate() re-reads only parquet footers, in parallel, so a partial or
+# corrupt download is caught at startup instead of deep inside an analytics query.
+
+MANIFEST_PATH = os.path.join(config.RAW_DIR, '_manifest.json')
+PARQUET_MAGIC = b'PAR1'
+
+_lock = threading.Lock()
+
+class ManifestError(Exception):
+    """Raised when raw files fail validation and cannot be repaired."""
+
+def load():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def _save(manifest):
+    config.ensure_dirs()
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def _pickup_column(names):
+    return next((c for c in names if c.lower().endswith('pickup_datetime')), None)
+
+def inspect_file(path):
+    """Footer-only facts about one parquet file (raises if the file is not valid parquet)."""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        f.seek(-4, os.SEEK_END)
+        tail = f.read(4)
+    if head != PARQUET_MAGIC or tail != PARQUET_MAGIC:
+        raise ValueError("missing parquet magic bytes (partial or corrupt file)")
+
+    meta = pq.read_metadata(path)
+    pickup = _pickup_column(meta.schema.names)
+    pickup_index = meta.schema.names.index(pickup) if pickup else None
+    row_groups = []
+    for i in range(meta.num_row_groups):
+        rg = meta.row_group(i)
+        entry = {'rows': rg.num_rows, 'bytes': rg.total_byte_size}
+        if pickup_index is not None:
+            stats = rg.column(pickup_index).statistics
+            if stats is not None and stats.has_min_max:
+                entry['pickup_min'] = str(stats.min)
+                entry['pickup_max'] = str(stats.max)
+        row_groups.append(entry)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'num_rows': meta.num_rows,
+        'num_columns': meta.num_columns,
+        'row_groups': row_groups,
+    }
+
+def record(path, url=None, headers=None, source='download'):
+    """Adds or refreshes a file's manifest entry (thread-safe; called after each download/imputation)."""
+    entry = inspect_file(path)
+    headers = headers or {}
+    entry.update({
+        'source': source,
+        'url': url,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+    })
+    with _lock:
+        manifest = load()
+        manifest[os.path.basename(path)] = entry
+        _save(manifest)
+    return entry
+
+def forget(name):
+    """Drops a file's entry (e.g. after the backfill deletes an aggregated raw file)."""
+    with _lock:
+        manifest = load()
+        if manifest.pop(name, None) is not None:
+            _save(manifest)
+
+def _check(path, entry):
+    """Returns (reason or None, footer facts) for one file against its manifest entry."""
+    try:
+        stat = os.stat(path)
+        if entry and stat.st_size != entry['size']:
+            return f"size {stat.st_size} != recorded {entry['size']}", None
+        facts = inspect_file(path)
+    except Exception as e:
+        return str(e), None
+    if entry:
+        if facts['num_rows'] != entry['num_rows']:
+            return f"row count {facts['num_rows']} != recorded {entry['num_rows']}", facts
+        if len(facts['row_groups']) != len(entry['row_groups']):
+            return "row group layout changed", facts
+    return None, facts
+
+def validate(paths=None, max_workers=16):
+    """
+    Checks raw files against the manifest using footer reads only, in parallel.
+    Files without an entry are validated and adopted. Returns {filename: reason}
+    for every bad file.
+    """
+    paths = paths if paths is not None else sorted(glob.glob(os.path.join(config.RAW_DIR, '*.parquet')))
+    manifest = load()
+    names = [os.path.basename(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda p, n: _check(p, manifest.get(n)), paths, names))
+
+    bad = {n: reason for n, (reason, _) in zip(names, results) if reason}
+    adopted = {n: facts for n, (reason, facts) in zip(names, results) if not reason and n not in manifest}
+    if adopted:
+        recorded_at = datetime.now().isoformat(timespec='seconds')
+        with _lock:
+            manifest = load()
+            for name, facts in adopted.items():
+                manifest[name] = dict(facts, source='adopted', url=None, etag=None,
+                                      last_modified=None, recorded_at=recorded_at)
+            _save(manifest)
+    logger.info(f"Validated {len(paths)} raw files: {len(bad)} bad, {len(adopted)} newly recorded.")
+    return bad
+
+def ensure_valid_raw_files(paths=None, refetch=True):
+    """
+    Startup check. Bad files are deleted so the regular download / imputation
+    steps rebuild just those files; with refetch=False they raise ManifestError.
+    """
+    bad = validate(paths)
+    if not bad:
+        return []
+    for name, reason in bad.items():
+        logger.error(f"Invalid raw file {name}: {reason}")
+    if not refetch:
+        raise ManifestError(f"Invalid raw files: {', '.join(sorted(bad))}")
+
+    with _lock:
+        manifest = load()
+        for name in bad:
+            path = os.path.join(config.RAW_DIR, name)
+            if os.path.exists(path):
+                os.remove(path)
+            manifest.pop(name, None)
+        _save(manifest)
+    return sorted(bad)
+
+def check_remote(names=None, max_workers=8):
+    """
+    Sends HEAD requests for downloaded files and returns the names whose upstream
+    ETag / Last-Modified differ from the manifest (i.e. TLC republished them).
+    """
+    import requests
+    manifest = load()
+    entries = {n: e for n, e in manifest.items() if e.get('url') and (names is None or n in names)}
+
+    def changed(item):
+        name, entry = item
+        response = requests.head(entry['url'], allow_redirects=True, timeout=10)
+        if not response.ok:
+            return False
+        return (response.headers.get('ETag'), response.headers.get('Last-Modified')) != (entry['etag'], entry['last_modified'])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        flags = list(executor.map(changed, entries.items()))
+    return [name for name, flag in zip(entries, flags) if flag]
@@ -0,0 +1,286 @@
+import os
+import time
+import asyncio
+import argparse
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import config
+import db
+import profiling
+import trip_store
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Historical replay load generator. Trips from the processed trip store are
+# streamed in pickup-time order as micro-batches of events and paced at
+# `speedup` x real time (None = as fast as possible). An asyncio producer feeds
+# a bounded queue, so a slow consumer blocks the producer (back-pressure)
+# instead of growing memory; consumer workers drain it. The run reports
+# sustained events/s, queue-to-processed latency percentiles, how far the
+# producer fell behind schedule and peak memory.
+#
+# A consumer is any object with consume(batch) (plain or async) taking a
+# pyarrow RecordBatch of all_trips columns, and optionally summary() -> dict.
+# consume() may be called from several workers at once.
+
+class GhostValidator:
+    """Applies the ghost trip rules to each batch and counts trips per audit_status."""
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def consume(self, batch):
+        import analytics
+        pickup = batch.column('pickup_datetime').to_numpy(zero_copy_only=False).astype('datetime64[s]')
+        dropoff = batch.column('dropoff_datetime').to_numpy(zero_copy_only=False).astype('datetime64[s]')
+        # Whole seconds crossed, as DuckDB's date_diff('second', ...)
+        duration = (dropoff - pickup) / np.timedelta64(1, 's')
+        status = analytics.classify_ghost_trips(
+            batch.column('trip_distance').to_numpy(zero_copy_only=False),
+            duration,
+            batch.column('fare_amount').to_numpy(zero_copy_only=False)
+        )
+        values, counts = np.unique(status, return_counts=True)
+        with self._lock:
+            for value, count in zip(values, counts):
+                self.counts[str(value)] = self.counts.get(str(value), 0) + int(count)
+
+    def summary(self):
+        return {'audit_status': dict(sorted(self.counts.items()))}
+
+class ZoneAggregator:
+    """Running drop-off counts per zone and pickup hour."""
+
+    def __init__(self):
+        self.counts = np.zeros((266, 24), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def consume(self, batch):
+        zones = np.nan_to_num(batch.column('DOLocationID').to_numpy(zero_copy_only=False).astype('float64')).astype(np.int64)
+        pickup = batch.column('pickup_datetime').to_numpy(zero_copy_only=False)
+        hours = ((pickup - pickup.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(np.int64)
+        keep = (zones >= 0) & (zones < 266) & ~np.isnat(pickup)
+        cells = np.bincount(zones[keep] * 24 + hours[keep], minlength=266 * 24).reshape(266, 24)
+        with self._lock:
+            self.counts += cells
+
+    def summary(self):
+        busiest = np.unravel_index(self.counts.argmax(), self.counts.shape)
+        return {'zones_seen': int((self.counts.sum(axis=1) > 0).sum()),
+                'busiest_zone_hour': (int(busiest[0]), int(busiest[1]))}
+
+class ParquetSink:
+    """Writes every batch to a parquet file (e.g. to size an ingest sink)."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(config.PROCESSED_DIR, 'replay_sink.parquet')
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def consume(self, batch):
+        import pyarrow.parquet as pq
+        with self._lock:
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, batch.schema, compression='zstd')
+            self._writer.write_batch(batch)
+
+    def summary(self):
+        if self._writer is not None:
+            self._writer.close()
+        return {'path': self.path}
+
+class NullSink:
+    """Discards batches; measures the replay machinery alone."""
+
+    def consume(self, batch):
+        pass
+
+CONSUMERS = {
+    'ghost': GhostValidator,
+    'aggregate': ZoneAggregator,
+    'sink': ParquetSink,
+    'null': NullSink,
+}
+
+def _months(start, end):
+    """(year, month) pairs overlapping [start, end)."""
+    periods = pd.period_range(pd.Timestamp(start), pd.Timestamp(end) - pd.Timedelta(microseconds=1), freq='M')
+    return [(p.year, p.month) for p in periods]
+
+def replay_query(year, month, start, end, taxi_types=None, con=None):
+    """
+    Time-ordered SELECT over one month of trips (trip store where current, raw
+    otherwise), or None. With `con`, stored files are read through the trip
+    store index: only row groups overlapping [start, end) are registered on con.
+    """
+    import daily_cube
+    state = trip_store._load_state()
+    raws = [p for p in trip_store.raw_files(year, taxi_types) if daily_cube.source_year_month(p) == (year, month)]
+    stored = [trip_store.store_path(p) for p in raws if trip_store.is_current(p, state)]
+    sources = [trip_store.trips_source(p, state) for p in raws if not trip_store.is_current(p, state)]
+    dataset = trip_store.pruned_dataset(stored, start, end) if con is not None else None
+    if dataset is not None:
+        name = f"replay_trips_{year}_{month:02d}"
+        con.register(name, dataset)
+        sources.append(name)
+    else:
+        sources += [f"'{p}'" for p in stored]
+    if not sources:
+        return None
+    union = " UNION ALL ".join(f"SELECT {', '.join(trip_store.UNIFIED_COLUMNS)} FROM {s}" for s in sources)
+    return f"""
+    SELECT * FROM ({union})
+    WHERE pickup_datetime >= TIMESTAMP '{pd.Timestamp(start)}' AND pickup_datetime < TIMESTAMP '{pd.Timestamp(end)}'
+    ORDER BY pickup_datetime
+    """
+
+class _Stats:
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.latencies = []
+        self.max_lag = 0.0
+        self.max_queue = 0
+        self.blocked_s = 0.0
+
+def _next_batch(reader):
+    # StopIteration cannot cross asyncio.to_thread, so the end of the stream is None
+    try:
+        return reader.read_next_batch()
+    except StopIteration:
+        return None
+
+async def _produce(queue, start, end, speedup, batch_size, taxi_types, limit, stats, workers):
+    con = db.create_connection()
+    t0 = None
+    wall0 = None
+    sent = 0
+    try:
+        for year, month in _months(start, end):
+            query = replay_query(year, month, start, end, taxi_types, con)
+            if query is None:
+                continue
+            reader = await asyncio.to_thread(lambda: con.execute(query).to_arrow_reader(config.REPLAY_READ_BATCH_SIZE))
+            while (chunk := await asyncio.to_thread(_next_batch, reader)) is not None:
+                for offset in range(0, chunk.num_rows, batch_size):
+                    batch = chunk.slice(offset, batch_size)
+                    if limit is not None:
+                        if sent >= limit:
+                            return
+                        batch = batch.slice(0, limit - sent)
+                    # Release the batch when its last event is due at `speedup` x real time
+                    last_event = batch.column('pickup_datetime')[-1].value
+                    if speedup:
+                        # The schedule starts with the first batch, after the first query ran
+                        if t0 is None:
+                            t0, wall0 = last_event, time.perf_counter()
+                        due = wall0 + (last_event - t0) / 1e6 / speedup
+                        delay = due - time.perf_counter()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        stats.max_lag = max(stats.max_lag, -delay)
+                    waiting = time.perf_counter()
+                    await queue.put((time.perf_counter(), batch))
+                    stats.blocked_s += time.perf_counter() - waiting
+                    stats.max_queue = max(stats.max_queue, queue.qsize())
+                    sent += batch.num_rows
+    finally:
+        con.close()
+        for _ in range(workers):
+            await queue.put(None)
+
+async def _consume(queue, consumer, stats):
+    is_async = asyncio.iscoroutinefunction(consumer.consume)
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        emitted_at, batch = item
+        if is_async:
+            await consumer.consume(batch)
+        else:
+            await asyncio.to_thread(consumer.consume, batch)
+        stats.latencies.append(time.perf_counter() - emitted_at)
+        stats.events += batch.num_rows
+        stats.batches += 1
+
+async def replay(consumer, start, end, speedup=None, batch_size=None, workers=1, queue_size=None,
+                 taxi_types=None, limit=None):
+    """
+    Streams trips with start <= pickup < end through `consumer` and returns a
+    report dict: events, wall_s, events_per_s, latency_ms percentiles,
+    max_lag_s (behind schedule), producer_blocked_s (back-pressure), peak_rss_mb.
+    Months imputed only into the daily cube have no trips and are skipped.
+    """
+    import imputation
+    skipped = [m for m in imputation.cube_only_months(taxi_types=taxi_types) if m in _months(start, end)]
+    if skipped:
+        logger.warning(f"Replay: months {skipped} are imputed into the daily cube only and have no trips to replay.")
+    batch_size = batch_size or config.REPLAY_BATCH_SIZE
+    queue = asyncio.Queue(maxsize=queue_size or config.REPLAY_QUEUE_SIZE)
+    stats = _Stats()
+    sampler = profiling._PeakMemorySampler()
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            _produce(queue, start, end, speedup, batch_size, taxi_types, limit, stats, workers),
+            *[_consume(queue, consumer, stats) for _ in range(workers)]
+        )
+    finally:
+        peak = sampler.stop()
+    wall = time.perf_counter() - started
+
+    latencies = np.array(stats.latencies) * 1000 if stats.latencies else np.zeros(1)
+    report = {
+        'consumer': type(consumer).__name__,
+        'speedup': speedup,
+        'events': stats.events,
+        'batches': stats.batches,
+        'wall_s': round(wall, 3),
+        'events_per_s': round(stats.events / wall, 1) if wall > 0 else 0.0,
+        'latency_ms': {f'p{q}': round(float(np.percentile(latencies, q)), 3) for q in (50, 95, 99)},
+        'max_latency_ms': round(float(latencies.max()), 3),
+        'max_lag_s': round(stats.max_lag, 3),
+        'producer_blocked_s': round(stats.blocked_s, 3),
+        'max_queue_depth': stats.max_queue,
+        'peak_rss_mb': round(peak / 2**20, 1),
+    }
+    if hasattr(consumer, 'summary'):
+        report['consumer_summary'] = consumer.summary()
+    return report
+
+def run_replay(consumer='ghost', start=None, end=None, **kwargs):
+    """Synchronous entry point; `consumer` is a CONSUMERS name or a consumer object."""
+    consumer = CONSUMERS[consumer]() if isinstance(consumer, str) else consumer
+    start = start or f"{config.YEAR_2025}-01-01"
+    end = end or str((pd.Timestamp(start) + pd.Timedelta(days=1)).date())
+    return asyncio.run(replay(consumer, start, end, **kwargs))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored trips as a time-ordered event feed.")
+    parser.add_argument('--start', default=f"{config.YEAR_2025}-01-01", help="First pickup time, e.g. 2025-01-01")
+    parser.add_argument('--end', default=None, help="End of the window (exclusive); default one day after --start")
+    parser.add_argument('--speedup', type=float, default=None, help="x real time, e.g. 3600; default as fast as possible")
+    parser.add_argument('--consumer', choices=sorted(CONSUMERS), default='ghost')
+    parser.add_argument('--batch-size', type=int, default=None, help="Events per micro-batch")
+    parser.add_argument('--workers', type=int, default=1, help="Concurrent consumer workers")
+    parser.add_argument('--queue-size', type=int, default=None, help="Micro-batches buffered before the producer blocks")
+    parser.add_argument('--taxi-types', nargs='+', choices=config.TAXI_TYPES, default=None)
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many events")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = run_replay(
+        args.consumer, args.start, args.end, speedup=args.speedup, batch_size=args.batch_size,
+        workers=args.workers, queue_size=args.queue_size, taxi_types=args.taxi_types, limit=args.limit
+    )
+    for key, value in report.items():
+        print(f"{key:>20}: {value}")
+
+if __name__ == "__main__":
+    main()
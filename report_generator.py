@@ -1,15 +1,53 @@
 from fpdf import FPDF
 import pandas as pd
 import os
+import string
+import hashlib
+import calendar
 import config
+import results_bundle
 import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+CHARTS_DIR = os.path.join(config.OUTPUTS_DIR, 'charts')
+
+# Section Templates
+# Text sections are filled per report variant; tables and charts are added
+# around them in build_report().
+SECTION_TEMPLATES = {
+    'summary': string.Template(
+        "This report provides a technical and business audit of the Manhattan Congestion Relief Zone Toll.\n\n"
+        "Total 2025 Surcharge Revenue: $total_revenue\n"
+        "Rain Elasticity Score (Correlation): $elasticity\n"
+        "$scope"
+    ),
+    'scope_borough': string.Template(
+        "Scope: $borough drop-off zones ($zone_count zones). "
+        "Average change in Q1 drop-offs vs 2024: $avg_change\n"
+    ),
+    'scope_month': string.Template(
+        "Scope: $month_name 2025. Surcharge revenue: $month_revenue, "
+        "average surcharge: $avg_surcharge, average tip: $avg_tip_pct\n"
+    ),
+    'recommendation': string.Template(
+        "Based on the analysis, we observe significant ghost trip activity. "
+        "We recommend implementing stricter real-time validation of trip physics (speed/duration) "
+        "at the point of data submission to reject impossible trips."
+    ),
+}
+
 class PDFReport(FPDF):
+    def __init__(self, title='2025 NYC Congestion Pricing Audit Report'):
+        super().__init__()
+        self.report_title = title
+
     def header(self):
         self.set_font('Arial', 'B', 15)
-        self.cell(0, 10, '2025 NYC Congestion Pricing Audit Report', 0, 1, 'C')
+        self.cell(0, 10, self.report_title, 0, 1, 'C')
         self.ln(10)
 
     def footer(self):
@@ -17,79 +55,237 @@ class PDFReport(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
-def generate_report():
-    logger.info("Generating PDF Report...")
-    
-    outputs = config.OUTPUTS_DIR
-    
-    # Load Data
-    try:
-        with open(os.path.join(outputs, 'total_revenue.txt'), 'r') as f:
-            total_revenue = float(f.read().strip())
-    except Exception:
-        total_revenue = 0.0
-
-    try:
-        with open(os.path.join(outputs, 'elasticity_score.txt'), 'r') as f:
-            elasticity = float(f.read().strip())
-    except Exception:
-        elasticity = "N/A"
-
-    try:
-        suspicious_vendors = pd.read_csv(os.path.join(outputs, 'suspicious_vendors.csv'))
-    except Exception:
-        suspicious_vendors = pd.DataFrame()
-
-    pdf = PDFReport()
+    def section_title(self, text):
+        self.set_font('Arial', 'B', 12)
+        self.cell(0, 10, text, 0, 1)
+        self.set_font('Arial', '', 11)
+
+    def table(self, headers, widths, rows):
+        for header, width in zip(headers, widths):
+            self.cell(width, 10, header, 1)
+        self.ln()
+        for row in rows:
+            for value, width in zip(row, widths):
+                self.cell(width, 10, str(value), 1)
+            self.ln()
+
+    def chart(self, path, width=180):
+        if self.get_y() > 150:
+            self.add_page()
+        self.image(path, x=15, w=width)
+        self.ln(5)
+
+def default_report_path():
+    return os.path.join(config.BASE_DIR, 'audit_report.pdf')
+
+def variant_report_path(variant):
+    kind, value = variant
+    if kind == 'all':
+        return default_report_path()
+    suffix = str(value).lower().replace(' ', '_') if kind == 'borough' else f"{int(value):02d}"
+    return os.path.join(config.OUTPUTS_DIR, f"audit_report_{kind}_{suffix}.pdf")
+
+def is_report_stale(output_path=None):
+    """The report is stale if it or the results bundle is missing, or it is older than the bundle."""
+    output_path = output_path or default_report_path()
+    if not os.path.exists(output_path) or not os.path.exists(results_bundle.BUNDLE_PATH):
+        return True
+    return os.path.getmtime(results_bundle.BUNDLE_PATH) > os.path.getmtime(output_path)
+
+def export_report(output_path=None, progress=None):
+    """Generates the report only if its inputs changed; returns the PDF path."""
+    output_path = output_path or default_report_path()
+    if not is_report_stale(output_path):
+        if progress:
+            progress(1.0, "Report is up to date.")
+        return output_path
+    if progress:
+        progress(0.1, "Generating PDF report...")
+    generate_report(output_path)
+    if progress:
+        progress(1.0, "Report ready.")
+    return output_path
+
+def load_report_data(with_zones=False):
+    """Loads everything the report variants share from the results bundle, once."""
+    data = results_bundle.read_tables(
+        ['suspicious_vendors', 'economics_metrics', 'velocity_metrics', 'border_analysis']
+    )
+    data.update(results_bundle.read_scalars(['total_revenue', 'elasticity_score']))
+
+    import geospatial
+    data['shapefile_path'] = geospatial.download_and_extract_shapefile()
+    if with_zones:
+        data['zones'] = geospatial.get_zone_lookup()
+    return data
+
+def _chart_key(name, df, kwargs):
+    """Content hash of a chart's inputs; identical inputs reuse the cached PNG."""
+    h = hashlib.sha256(name.encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    h.update(repr(sorted(kwargs.items())).encode())
+    return h.hexdigest()[:16]
+
+def _chart_specs(variant, data):
+    """Returns [(title, func_name, df, kwargs)] for one report variant."""
+    kind, value = variant
+    economics = data['economics_metrics']
+    if kind == 'month':
+        # Year-to-date view up to the variant's month
+        economics = economics[economics['month'] <= value].reset_index(drop=True)
+
+    specs = [
+        ('Monthly Surcharge vs Tip Percentage', 'plot_economics', economics, {}),
+        ('Average Speed - Q1 2024', 'plot_velocity_heatmap', data['velocity_metrics'], {'period': '2024 Q1'}),
+        ('Average Speed - Q1 2025', 'plot_velocity_heatmap', data['velocity_metrics'], {'period': '2025 Q1'}),
+    ]
+    map_kwargs = {'shapefile_path': data['shapefile_path']}
+    if kind == 'borough':
+        map_kwargs['borough'] = value
+    specs.append(('Border Effect Map', 'plot_border_map', data['border_analysis'], map_kwargs))
+    return specs
+
+def render_charts(specs, max_workers=None):
+    """
+    Renders every distinct chart across all variants concurrently in a process pool.
+    Charts already on disk for the same input hash are reused.
+    Returns {chart_key: png_path}.
+    """
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+    pending = {}
+    paths = {}
+    for _, func_name, df, kwargs in specs:
+        key = _chart_key(func_name, df, kwargs)
+        path = os.path.join(CHARTS_DIR, f"{func_name}-{key}.png")
+        paths[key] = path
+        if not os.path.exists(path) and key not in pending:
+            pending[key] = (func_name, df, path, kwargs)
+
+    logger.info(f"Charts: {len(paths)} distinct, {len(pending)} to render, {len(paths) - len(pending)} cached.")
+    if pending:
+        import visualization
+        # Spawned, not forked: exports run on the dashboard's job thread, and a
+        # fork of a multithreaded process can inherit held locks
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [
+                executor.submit(getattr(visualization, func_name), df, path, **kwargs)
+                for func_name, df, path, kwargs in pending.values()
+            ]
+            for f in futures:
+                f.result()
+    return paths
+
+def _summary_context(variant, data):
+    kind, value = variant
+    context = {
+        'total_revenue': f"${data['total_revenue']:,.2f}",
+        'elasticity': f"{data['elasticity_score']:.4f}",
+        'scope': '',
+    }
+    if kind == 'borough':
+        zone_ids = data['zones'].loc[data['zones']['borough'] == value, 'LocationID']
+        border = data['border_analysis'][data['border_analysis']['DOLocationID'].isin(zone_ids)]
+        context['scope'] = SECTION_TEMPLATES['scope_borough'].substitute(
+            borough=value, zone_count=len(border), avg_change=f"{border['pct_change'].mean():+.1f}%"
+        )
+    elif kind == 'month':
+        econ = data['economics_metrics']
+        row = econ[econ['month'] == value]
+        if row.empty:
+            raise ValueError(f"No economics metrics for month {value}")
+        row = row.iloc[0]
+        context['scope'] = SECTION_TEMPLATES['scope_month'].substitute(
+            month_name=calendar.month_name[int(value)],
+            month_revenue=f"${row['total_surcharge']:,.2f}",
+            avg_surcharge=f"${row['avg_surcharge']:.2f}",
+            avg_tip_pct=f"{row['avg_tip_pct']:.1f}%"
+        )
+    return context
+
+def build_report(variant, data, chart_paths, output_path):
+    """Assembles one PDF from the section templates, vendor table and rendered charts."""
+    kind, value = variant
+    title = '2025 NYC Congestion Pricing Audit Report'
+    if kind == 'borough':
+        title += f' - {value}'
+    elif kind == 'month':
+        title += f' - {calendar.month_name[int(value)]}'
+
+    pdf = PDFReport(title)
     pdf.add_page()
-    
+
     # Executive Summary
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, 'Executive Summary', 0, 1)
-    pdf.set_font('Arial', '', 11)
-    
-    summary_text = (
-        f"This report provides a technical and business audit of the Manhattan Congestion Relief Zone Toll.\n\n"
-        f"Total 2025 Surcharge Revenue: ${total_revenue:,.2f}\n"
-        f"Rain Elasticity Score (Correlation): {elasticity}\n"
-    )
-    pdf.multi_cell(0, 10, summary_text)
+    pdf.section_title('Executive Summary')
+    pdf.multi_cell(0, 10, SECTION_TEMPLATES['summary'].substitute(_summary_context(variant, data)))
     pdf.ln(5)
-    
+
     # Suspicious Vendors
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, 'Top Suspicious Vendors (Ghost Trips)', 0, 1)
-    pdf.set_font('Arial', '', 11)
-    
-    if not suspicious_vendors.empty:
-        pdf.cell(40, 10, 'VendorID', 1)
-        pdf.cell(60, 10, 'Ghost Trip Count', 1)
-        pdf.ln()
-        for index, row in suspicious_vendors.iterrows():
-            pdf.cell(40, 10, str(row['VendorID']), 1)
-            pdf.cell(60, 10, str(row['ghost_trip_count']), 1)
-            pdf.ln()
+    pdf.section_title('Top Suspicious Vendors (Ghost Trips)')
+    vendors = data['suspicious_vendors']
+    if not vendors.empty:
+        pdf.table(['VendorID', 'Ghost Trip Count'], [40, 60],
+                  vendors[['VendorID', 'ghost_trip_count']].itertuples(index=False))
     else:
         pdf.cell(0, 10, "No suspicious vendor data found.", 0, 1)
-    
     pdf.ln(10)
-    
+
+    # Charts
+    pdf.add_page()
+    pdf.section_title('Charts')
+    for chart_title, func_name, df, kwargs in _chart_specs(variant, data):
+        pdf.cell(0, 8, chart_title, 0, 1)
+        pdf.chart(chart_paths[_chart_key(func_name, df, kwargs)])
+
     # Policy Recommendation
-    pdf.set_font('Arial', 'B', 12)
-    pdf.cell(0, 10, 'Policy Recommendation', 0, 1)
-    pdf.set_font('Arial', '', 11)
-    
-    recommendation = (
-        "Based on the analysis, we observe significant ghost trip activity. "
-        "We recommend implementing stricter real-time validation of trip physics (speed/duration) "
-        "at the point of data submission to reject impossible trips."
-    )
-    pdf.multi_cell(0, 10, recommendation)
-    
-    output_path = os.path.join(config.BASE_DIR, 'audit_report.pdf')
+    pdf.section_title('Policy Recommendation')
+    pdf.multi_cell(0, 10, SECTION_TEMPLATES['recommendation'].substitute())
+
     pdf.output(output_path)
     logger.info(f"Report generated: {output_path}")
+    return output_path
 
-if __name__ == "__main__":
-    generate_report()
+def generate_reports(boroughs=(), months=(), include_main=True, max_workers=None):
+    """
+    Generates the main report plus per-borough / per-month variants in one run.
+    Data is loaded once and charts shared between variants are rendered once.
+    Returns {variant: pdf_path}.
+    """
+    logger.info("Generating PDF Reports...")
+    variants = ([('all', None)] if include_main else [])
+    variants += [('borough', b) for b in boroughs] + [('month', int(m)) for m in months]
+
+    data = load_report_data(with_zones=bool(boroughs))
+    specs = [spec for variant in variants for spec in _chart_specs(variant, data)]
+    chart_paths = render_charts(specs, max_workers=max_workers)
+
+    return {
+        variant: build_report(variant, data, chart_paths, variant_report_path(variant))
+        for variant in variants
+    }
 
+def generate_report(output_path=None):
+    """Generates the main (all boroughs, full year) report."""
+    logger.info("Generating PDF Report...")
+    data = load_report_data()
+    variant = ('all', None)
+    chart_paths = render_charts(_chart_specs(variant, data))
+    return build_report(variant, data, chart_paths, output_path or default_report_path())
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the audit PDF report and its variants.")
+    parser.add_argument('--borough', nargs='+', default=[], help="Also write a report per drop-off borough, e.g. Manhattan")
+    parser.add_argument('--month', nargs='+', type=int, choices=range(1, 13), default=[], metavar='MONTH',
+                        help="Also write a report per 2025 month (1-12)")
+    parser.add_argument('--variants-only', action='store_true', help="Skip the main report")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not (args.borough or args.month):
+        print(f"Report available at: {generate_report()}")
+        return
+    paths = generate_reports(args.borough, args.month, include_main=not args.variants_only)
+    for path in paths.values():
+        print(f"Report available at: {path}")
+
+if __name__ == "__main__":
+    main()
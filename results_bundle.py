@@ -0,0 +1,318 @@
+import os
+import json
+import threading
+import contextlib
+import time
+import uuid
+import hashlib
+import logging
+from datetime import datetime
+import duckdb
+import config
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Single versioned results store shared by analytics, report and dashboard.
+# Bump BUNDLE_VERSION whenever a table schema below changes.
+BUNDLE_PATH = os.path.join(config.OUTPUTS_DIR, 'results.duckdb')
+BUNDLE_VERSION = 1
+# Seconds to wait for another process to release the bundle file
+BUNDLE_LOCK_TIMEOUT_S = 10
+# Arrow IPC copy of every table, exported after each analytics run. Readers
+# memory-map it while it matches the bundle file and fall back to DuckDB otherwise.
+SNAPSHOT_DIR = os.path.join(config.OUTPUTS_DIR, 'arrow')
+SNAPSHOT_STATE_PATH = os.path.join(SNAPSHOT_DIR, '_snapshot.json')
+
+SCHEMAS = {
+    'suspicious_vendors': {'VendorID': 'BIGINT', 'ghost_trip_count': 'BIGINT'},
+    'leakage_top_locations': {'PULocationID': 'BIGINT', 'missing_surcharge_trips': 'BIGINT'},
+    'compliance_stats': {'paid_trips': 'BIGINT', 'total_eligible_trips': 'BIGINT', 'compliance_rate': 'DOUBLE'},
+    'fee_leakage': {
+        'fee': 'VARCHAR', 'PULocationID': 'BIGINT', 'hour': 'BIGINT', 'VendorID': 'BIGINT',
+        'eligible_trips': 'BIGINT', 'expected_amount': 'DOUBLE', 'charged_amount': 'DOUBLE',
+        'shortfall_amount': 'DOUBLE', 'short_trips': 'BIGINT'
+    },
+    'volume_comparison': {'period': 'VARCHAR', 'taxi_type': 'VARCHAR', 'trip_count': 'BIGINT'},
+    'velocity_metrics': {'period': 'VARCHAR', 'dow': 'BIGINT', 'hod': 'BIGINT', 'avg_speed': 'DOUBLE'},
+    'border_analysis': {'DOLocationID': 'BIGINT', 'count_2024': 'BIGINT', 'count_2025': 'BIGINT', 'pct_change': 'DOUBLE'},
+    'border_rings': {
+        'ring': 'BIGINT', 'ring_label': 'VARCHAR', 'zones': 'BIGINT', 'count_2024': 'BIGINT',
+        'count_2025': 'BIGINT', 'pct_change': 'DOUBLE', 'avg_cbd_distance_mi': 'DOUBLE'
+    },
+    'economics_metrics': {
+        'year': 'BIGINT', 'month': 'BIGINT', 'total_surcharge': 'DOUBLE',
+        'avg_surcharge': 'DOUBLE', 'avg_tip_pct': 'DOUBLE'
+    },
+    'trips_vs_weather': {'date': 'DATE', 'trip_count': 'BIGINT', 'precipitation_sum': 'DOUBLE'},
+    'elasticity_by_zone': {'PULocationID': 'BIGINT', 'trip_count': 'BIGINT', 'elasticity': 'DOUBLE'},
+    'elasticity_by_hour': {'hour': 'BIGINT', 'trip_count': 'BIGINT', 'elasticity': 'DOUBLE'},
+    'weather_regression': {
+        'borough': 'VARCHAR', 'hour_band': 'VARCHAR', 'taxi_type': 'VARCHAR', 'term': 'VARCHAR',
+        'coef': 'DOUBLE', 'std_err': 'DOUBLE', 'pct_effect': 'DOUBLE', 'n_days': 'BIGINT'
+    },
+    'vendor_fraud_daily': {
+        'date': 'DATE', 'VendorID': 'BIGINT', 'trip_count': 'BIGINT', 'flagged_trips': 'BIGINT',
+        'ghost_rate': 'DOUBLE', 'impossible_speed_share': 'DOUBLE', 'teleporter_share': 'DOUBLE',
+        'stationary_share': 'DOUBLE', 'peer_rate': 'DOUBLE', 'peer_deviation': 'DOUBLE', 'peer_z': 'DOUBLE',
+        'window_trips': 'BIGINT', 'window_rate': 'DOUBLE', 'baseline_rate': 'DOUBLE', 'window_peer_z': 'DOUBLE'
+    },
+    'vendor_fraud_alerts': {
+        'date': 'DATE', 'VendorID': 'BIGINT', 'alert_type': 'VARCHAR', 'window_rate': 'DOUBLE',
+        'baseline_rate': 'DOUBLE', 'window_peer_z': 'DOUBLE', 'window_trips': 'BIGINT'
+    },
+    # Single-value results such as total_revenue and elasticity_score
+    'scalars': {'name': 'VARCHAR', 'value': 'DOUBLE'},
+}
+
+class BundleError(Exception):
+    """Raised when the results bundle is missing, outdated or does not match SCHEMAS."""
+
+def fingerprint_files(paths):
+    """Stable hash of (name, size, mtime) for a set of input files."""
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        h.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+def new_run_id():
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+# One bundle connection per process, open while anyone is using it. Readers and
+# writers each get a cursor from it: DuckDB refuses a read-only and a read-write
+# connection to the same file side by side, and a dashboard session may read
+# while the refresh job writes. Closing it when idle frees the file for other
+# processes (the pipeline CLI); opening retries while one of them holds it.
+_shared = None
+_users = 0
+_shared_lock = threading.Lock()
+
+def _open_shared():
+    deadline = time.monotonic() + BUNDLE_LOCK_TIMEOUT_S
+    while True:
+        try:
+            return duckdb.connect(BUNDLE_PATH)
+        except (duckdb.ConnectionException, duckdb.IOException) as e:
+            if time.monotonic() >= deadline:
+                raise BundleError(f"Results bundle is in use by another process: {e}") from e
+            time.sleep(0.1)
+
+@contextlib.contextmanager
+def _connect(existing=False):
+    """Cursor on the process-wide bundle connection. existing=True requires the bundle to exist."""
+    global _shared, _users
+    if existing and not os.path.exists(BUNDLE_PATH):
+        raise BundleError(f"Results bundle not found: {BUNDLE_PATH}. Run the pipeline first.")
+    if not existing:
+        config.ensure_dirs()
+    with _shared_lock:
+        if _shared is None:
+            _shared = _open_shared()
+        _users += 1
+        cursor = _shared.cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+        with _shared_lock:
+            _users -= 1
+            if _users == 0:
+                _shared.close()
+                _shared = None
+
+def _ensure_header(con):
+    con.execute("CREATE TABLE IF NOT EXISTS _bundle (key VARCHAR PRIMARY KEY, value VARCHAR)")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS _stages (
+        stage VARCHAR PRIMARY KEY,
+        run_id VARCHAR,
+        input_fingerprint VARCHAR,
+        tables VARCHAR,
+        finished_at TIMESTAMP,
+        duration_s DOUBLE
+    )
+    """)
+    version = con.execute("SELECT value FROM _bundle WHERE key = 'bundle_version'").fetchone()
+    if version is None:
+        con.execute("INSERT INTO _bundle VALUES ('bundle_version', ?), ('created_at', ?)",
+                    [str(BUNDLE_VERSION), datetime.now().isoformat()])
+    elif int(version[0]) != BUNDLE_VERSION:
+        # Schemas changed: drop every result table so stages are recomputed
+        logger.warning(f"Results bundle version {version[0]} != {BUNDLE_VERSION}. Resetting bundle.")
+        for table in SCHEMAS:
+            con.execute(f"DROP TABLE IF EXISTS {table}")
+        con.execute("DELETE FROM _stages")
+        con.execute("UPDATE _bundle SET value = ? WHERE key = 'bundle_version'", [str(BUNDLE_VERSION)])
+
+def write_table(name, df):
+    """Replaces table `name` with `df` (pandas or Arrow), cast to its declared schema."""
+    schema = SCHEMAS[name]
+    names = df.column_names if hasattr(df, 'column_names') else df.columns
+    missing = [c for c in schema if c not in names]
+    if missing:
+        raise BundleError(f"Cannot write {name}: missing columns {missing}")
+
+    select = ", ".join(f'CAST("{col}" AS {dtype}) AS "{col}"' for col, dtype in schema.items())
+    with _connect() as con:
+        _ensure_header(con)
+        con.register('_incoming', df)
+        con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT {select} FROM _incoming")
+        con.unregister('_incoming')
+
+def write_scalar(name, value):
+    with _connect() as con:
+        _ensure_header(con)
+        con.execute("CREATE TABLE IF NOT EXISTS scalars (name VARCHAR PRIMARY KEY, value DOUBLE)")
+        con.execute("INSERT OR REPLACE INTO scalars VALUES (?, ?)", [name, float(value)])
+
+def record_stage(stage, run_id, input_fingerprint, tables, duration_s):
+    """Stores per-stage run metadata used for staleness checks and timing reports."""
+    with _connect() as con:
+        _ensure_header(con)
+        con.execute("INSERT OR REPLACE INTO _stages VALUES (?, ?, ?, ?, ?, ?)",
+                    [stage, run_id, input_fingerprint, json.dumps(tables), datetime.now(), duration_s])
+        con.execute("INSERT OR REPLACE INTO _bundle VALUES ('last_run_id', ?)", [run_id])
+
+def read_stage_records():
+    """Returns {stage: record} or {} if no bundle exists yet."""
+    if not os.path.exists(BUNDLE_PATH):
+        return {}
+    with _connect(existing=True) as con:
+        exists = con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = '_stages'").fetchone()[0]
+        if not exists:
+            return {}
+        df = con.execute("SELECT * FROM _stages").df()
+    return {row['stage']: row for row in df.to_dict('records')}
+
+def read_metadata():
+    """Bundle header (version, created_at, last_run_id) plus per-stage run records."""
+    with _connect(existing=True) as con:
+        header = dict(con.execute("SELECT key, value FROM _bundle").fetchall())
+        stages = con.execute("SELECT * FROM _stages ORDER BY finished_at").df()
+    header['stages'] = stages
+    return header
+
+def _validate(con, name):
+    actual = dict(con.execute(
+        "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = ?", [name]
+    ).fetchall())
+    if not actual:
+        raise BundleError(f"Table '{name}' is not in the results bundle. Run the stage that produces it.")
+    expected = SCHEMAS[name]
+    mismatched = {c: (t, actual.get(c)) for c, t in expected.items() if actual.get(c) != t}
+    if mismatched:
+        raise BundleError(f"Table '{name}' does not match its schema (expected, actual): {mismatched}")
+
+def has_table(name):
+    # Answered from a current Arrow snapshot without opening (and locking) the bundle
+    if not os.path.exists(BUNDLE_PATH):
+        return False
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return name in snapshot
+    with _connect(existing=True) as con:
+        return con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [name]).fetchone()[0] > 0
+
+def count_rows(name):
+    """Row count of a bundle table; 0 if a stage skipped writing it."""
+    with _connect(existing=True) as con:
+        if not con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [name]).fetchone()[0]:
+            return 0
+        return con.execute(f"SELECT count(*) FROM {name}").fetchone()[0]
+
+def _snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, f"{name}.arrow")
+
+def export_snapshot():
+    """
+    Streams every valid bundle table to SNAPSHOT_DIR as Arrow IPC and records the
+    bundle fingerprint it was taken from. Returns the exported table names.
+    """
+    import db
+    if not os.path.exists(BUNDLE_PATH):
+        return []
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fingerprint = fingerprint_files([BUNDLE_PATH])
+    with _connect(existing=True) as con:
+        exported = []
+        for name in SCHEMAS:
+            try:
+                _validate(con, name)
+            except BundleError:
+                continue
+            db.stream_to_ipc(con, f"SELECT * FROM {name}", _snapshot_path(name))
+            exported.append(name)
+    tmp_path = SNAPSHOT_STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'bundle_version': BUNDLE_VERSION, 'bundle_fingerprint': fingerprint, 'tables': exported}, f, indent=1)
+    os.replace(tmp_path, SNAPSHOT_STATE_PATH)
+    logger.info(f"Exported {len(exported)} tables to {SNAPSHOT_DIR}")
+    return exported
+
+def _current_snapshot():
+    """Tables in the Arrow snapshot if it was taken from the current bundle, else None."""
+    if not os.path.exists(SNAPSHOT_STATE_PATH) or not os.path.exists(BUNDLE_PATH):
+        return None
+    with open(SNAPSHOT_STATE_PATH) as f:
+        state = json.load(f)
+    if state['bundle_version'] != BUNDLE_VERSION or state['bundle_fingerprint'] != fingerprint_files([BUNDLE_PATH]):
+        return None
+    return set(state['tables'])
+
+def read_tables(names, columns=None, as_arrow=False):
+    """
+    Loads the named tables in one read-only session, validating each against SCHEMAS.
+    `columns` optionally maps table name -> list of columns to load.
+    Returns {name: DataFrame} (or Arrow tables with as_arrow=True).
+    Tables come memory-mapped from the Arrow snapshot when it is current.
+    """
+    import db
+    columns = columns or {}
+    snapshot = _current_snapshot()
+    if snapshot is not None and set(names) <= snapshot:
+        result = {}
+        for name in names:
+            table = db.read_ipc(_snapshot_path(name), list(columns.get(name, SCHEMAS[name])))
+            result[name] = table if as_arrow else db.arrow_to_pandas(table)
+        return result
+
+    with _connect(existing=True) as con:
+        version = con.execute("SELECT value FROM _bundle WHERE key = 'bundle_version'").fetchone()
+        if version is None or int(version[0]) != BUNDLE_VERSION:
+            raise BundleError(f"Results bundle version {version and version[0]} != {BUNDLE_VERSION}. Re-run the pipeline.")
+        result = {}
+        for name in names:
+            _validate(con, name)
+            cols = ", ".join(f'"{c}"' for c in columns.get(name, SCHEMAS[name]))
+            rel = con.execute(f"SELECT {cols} FROM {name}")
+            result[name] = rel.to_arrow_table() if as_arrow else rel.df()
+    return result
+
+def read_scalars(names):
+    """Returns {name: value}; raises BundleError if any scalar is missing."""
+    scalars = read_tables(['scalars'])['scalars'].set_index('name')['value']
+    missing = [n for n in names if n not in scalars.index]
+    if missing:
+        raise BundleError(f"Scalars missing from results bundle: {missing}")
+    return {n: float(scalars[n]) for n in names}
+
+def load_dashboard_data():
+    """
+    Tables behind the dashboard's overview and tabs:
+    (border_df, velocity_df, economics_df, elasticity_df, elasticity_score, days_covered).
+    Weather results and days_covered are None until their stages have run.
+    """
+    tables = read_tables(['border_analysis', 'velocity_metrics', 'economics_metrics'])
+    if has_table('trips_vs_weather'):
+        elasticity_df = read_tables(['trips_vs_weather'])['trips_vs_weather']
+        elasticity_score = read_scalars(['elasticity_score'])['elasticity_score']
+    else:
+        elasticity_df = None
+        elasticity_score = None
+    try:
+        days_covered = int(read_scalars(['days_covered'])['days_covered'])
+    except BundleError:
+        days_covered = None
+    return (tables['border_analysis'], tables['velocity_metrics'], tables['economics_metrics'],
+            elasticity_df, elasticity_score, days_covered)
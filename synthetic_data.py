@@ -0,0 +1,217 @@
+import os
+import argparse
+import calendar
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Deterministic TLC-shaped trip data for benchmarks and local runs.
+# Columns, names and types follow the published yellow/green trip record schemas.
+
+# Zones south of 60th St (used when no shapefile is available, e.g. benchmarks)
+CONGESTION_ZONE_IDS = [
+    4, 12, 13, 45, 48, 50, 68, 79, 87, 88, 90, 100, 107, 113, 114, 125, 137, 144, 148,
+    158, 161, 162, 163, 164, 170, 186, 209, 211, 224, 229, 230, 231, 232, 233, 234, 246, 249, 261
+]
+
+# Share of rows per rule; roughly 2.5% of trips are flagged, in line with the real audit
+GHOST_RATES = {'impossible_speed': 0.004, 'teleporter': 0.001, 'stationary': 0.02}
+
+# Share of zone-entering trips missing the congestion surcharge
+LEAKAGE_RATE = 0.05
+
+TAXI_SHARE = {'yellow': 0.93, 'green': 0.07}
+VENDOR_WEIGHTS = {'yellow': ([1, 2, 6, 7], [0.25, 0.73, 0.01, 0.01]), 'green': ([1, 2], [0.15, 0.85])}
+
+# Relative pickup volume by hour of day
+HOUR_WEIGHTS = np.array([
+    3, 2, 1.5, 1, 1, 1.5, 3, 5, 6, 6, 6, 6.5, 7, 7, 7.5, 8, 8.5, 9, 9, 8, 7, 6.5, 6, 4.5
+])
+
+CHUNK_ROWS = 1_000_000
+
+YELLOW_SCHEMA = pa.schema([
+    ('VendorID', pa.int32()),
+    ('tpep_pickup_datetime', pa.timestamp('us')),
+    ('tpep_dropoff_datetime', pa.timestamp('us')),
+    ('passenger_count', pa.int64()),
+    ('trip_distance', pa.float64()),
+    ('RatecodeID', pa.int64()),
+    ('store_and_fwd_flag', pa.string()),
+    ('PULocationID', pa.int32()),
+    ('DOLocationID', pa.int32()),
+    ('payment_type', pa.int64()),
+    ('fare_amount', pa.float64()),
+    ('extra', pa.float64()),
+    ('mta_tax', pa.float64()),
+    ('tip_amount', pa.float64()),
+    ('tolls_amount', pa.float64()),
+    ('improvement_surcharge', pa.float64()),
+    ('total_amount', pa.float64()),
+    ('congestion_surcharge', pa.float64()),
+    ('Airport_fee', pa.float64()),
+    ('cbd_congestion_fee', pa.float64()),
+])
+
+GREEN_SCHEMA = pa.schema([
+    ('VendorID', pa.int32()),
+    ('lpep_pickup_datetime', pa.timestamp('us')),
+    ('lpep_dropoff_datetime', pa.timestamp('us')),
+    ('store_and_fwd_flag', pa.string()),
+    ('RatecodeID', pa.int64()),
+    ('PULocationID', pa.int32()),
+    ('DOLocationID', pa.int32()),
+    ('passenger_count', pa.int64()),
+    ('trip_distance', pa.float64()),
+    ('fare_amount', pa.float64()),
+    ('extra', pa.float64()),
+    ('mta_tax', pa.float64()),
+    ('tip_amount', pa.float64()),
+    ('tolls_amount', pa.float64()),
+    ('ehail_fee', pa.float64()),
+    ('improvement_surcharge', pa.float64()),
+    ('total_amount', pa.float64()),
+    ('payment_type', pa.int64()),
+    ('trip_type', pa.int64()),
+    ('congestion_surcharge', pa.float64()),
+    ('cbd_congestion_fee', pa.float64()),
+])
+
+def _zone_weights():
+    """Pickup/drop-off popularity: Manhattan core zones are ~10x busier than the rest."""
+    weights = np.ones(265)
+    weights[np.array(CONGESTION_ZONE_IDS) - 1] = 10
+    return weights / weights.sum()
+
+def generate_chunk(rng, taxi, year, month, n):
+    """Generates n trips for one taxi type and month as a pyarrow Table."""
+    prefix = 'tpep' if taxi == 'yellow' else 'lpep'
+    days = calendar.monthrange(year, month)[1]
+    month_start = np.datetime64(f"{year}-{month:02d}-01T00:00:00", 'us')
+
+    day = rng.integers(0, days, n)
+    hour = rng.choice(24, n, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    second = rng.integers(0, 3600, n)
+    pickup = month_start + ((day * 86400 + hour * 3600 + second) * 1_000_000).astype('timedelta64[us]')
+
+    distance = np.round(np.clip(rng.lognormal(0.6, 0.8, n), 0.1, 60), 2)
+    speed = np.clip(rng.normal(12, 4, n), 3, 40)
+    duration = np.maximum(distance / speed * 3600, 90).astype(np.int64)
+
+    zone_p = _zone_weights()
+    pu = rng.choice(265, n, p=zone_p).astype(np.int32) + 1
+    do = rng.choice(265, n, p=zone_p).astype(np.int32) + 1
+
+    fare = np.round(3 + 2.5 * distance + 0.7 * duration / 60, 2)
+
+    # Ghost trips, one rule per flagged row
+    rule = rng.random(n)
+    speed_cut = GHOST_RATES['impossible_speed']
+    tele_cut = speed_cut + GHOST_RATES['teleporter']
+    stat_cut = tele_cut + GHOST_RATES['stationary']
+    impossible = rule < speed_cut
+    teleporter = (rule >= speed_cut) & (rule < tele_cut)
+    stationary = (rule >= tele_cut) & (rule < stat_cut)
+    distance[impossible] = np.round(rng.uniform(8, 30, impossible.sum()), 2)
+    duration[impossible] = rng.integers(120, 300, impossible.sum())
+    duration[teleporter] = rng.integers(5, 59, teleporter.sum())
+    fare[teleporter] = np.round(rng.uniform(25, 80, teleporter.sum()), 2)
+    distance[stationary] = 0.0
+    dropoff = pickup + (duration * 1_000_000).astype('timedelta64[us]')
+
+    in_zone = np.isin(do, CONGESTION_ZONE_IDS)
+    surcharge_rate = 2.5 if taxi == 'yellow' else 2.75
+    congestion = np.where(rng.random(n) < LEAKAGE_RATE, 0.0, surcharge_rate)
+    cbd_start = np.datetime64('2025-01-05', 'us')
+    cbd_fee = np.where(in_zone & (pickup >= cbd_start), 0.75, 0.0)
+
+    payment = rng.choice([1, 2, 3, 4], n, p=[0.75, 0.22, 0.02, 0.01])
+    tip = np.where(payment == 1, np.round(fare * rng.uniform(0.1, 0.25, n), 2), 0.0)
+    extra = np.where((hour >= 16) & (hour < 20), 2.5, 1.0)
+    mta_tax = np.full(n, 0.5)
+    improvement = np.full(n, 1.0)
+    tolls = np.where(rng.random(n) < 0.05, 6.94, 0.0)
+    total = np.round(fare + extra + mta_tax + improvement + tip + tolls + congestion + cbd_fee, 2)
+
+    vendors, vendor_p = VENDOR_WEIGHTS[taxi]
+    columns = {
+        'VendorID': rng.choice(vendors, n, p=vendor_p).astype(np.int32),
+        f'{prefix}_pickup_datetime': pickup,
+        f'{prefix}_dropoff_datetime': dropoff,
+        'passenger_count': rng.choice([1, 2, 3, 4, 5, 6], n, p=[0.7, 0.15, 0.06, 0.04, 0.03, 0.02]),
+        'trip_distance': distance,
+        'RatecodeID': np.ones(n, dtype=np.int64),
+        'store_and_fwd_flag': pa.array(np.where(rng.random(n) < 0.005, 'Y', 'N')),
+        'PULocationID': pu,
+        'DOLocationID': do,
+        'payment_type': payment,
+        'fare_amount': fare,
+        'extra': extra,
+        'mta_tax': mta_tax,
+        'tip_amount': tip,
+        'tolls_amount': tolls,
+        'improvement_surcharge': improvement,
+        'total_amount': total,
+        'congestion_surcharge': congestion,
+        'cbd_congestion_fee': cbd_fee,
+    }
+    if taxi == 'yellow':
+        columns['Airport_fee'] = np.where(np.isin(pu, [132, 138]), 1.75, 0.0)
+        schema = YELLOW_SCHEMA
+    else:
+        columns['ehail_fee'] = pa.nulls(n, pa.float64())
+        columns['trip_type'] = rng.choice([1, 2], n, p=[0.97, 0.03])
+        schema = GREEN_SCHEMA
+    return pa.table({name: columns[name] for name in schema.names}, schema=schema)
+
+def write_month(path, taxi, year, month, rows, seed=42, chunk_rows=CHUNK_ROWS):
+    """Writes one monthly file in bounded-memory chunks; output depends only on the arguments."""
+    schema = YELLOW_SCHEMA if taxi == 'yellow' else GREEN_SCHEMA
+    with pq.ParquetWriter(path, schema) as writer:
+        for i, start in enumerate(range(0, rows, chunk_rows)):
+            # Per-chunk seed keeps files reproducible regardless of chunk scheduling
+            rng = np.random.default_rng([seed, year, month, 0 if taxi == 'yellow' else 1, i])
+            writer.write_table(generate_chunk(rng, taxi, year, month, min(chunk_rows, rows - start)))
+    return path
+
+def default_partitions():
+    """Mirrors the files the pipeline reads: 2025 Jan-Nov (Dec is imputed), Q1 2024 and the Dec sources."""
+    partitions = [(2025, m) for m in range(1, 12)] + [(2024, m) for m in (1, 2, 3, 12)] + [(2023, 12)]
+    return partitions
+
+def generate_dataset(total_rows, raw_dir=None, partitions=None, seed=42, chunk_rows=CHUNK_ROWS):
+    """
+    Writes yellow and green monthly parquet files totalling ~total_rows rows into raw_dir.
+    Returns the list of written paths.
+    """
+    raw_dir = raw_dir or config.RAW_DIR
+    partitions = partitions or default_partitions()
+    os.makedirs(raw_dir, exist_ok=True)
+
+    paths = []
+    per_partition = total_rows / len(partitions)
+    for year, month in partitions:
+        for taxi, share in TAXI_SHARE.items():
+            rows = int(per_partition * share)
+            path = os.path.join(raw_dir, f"{taxi}_tripdata_{year}-{month:02d}.parquet")
+            logger.info(f"Generating {path} ({rows:,} rows)")
+            paths.append(write_month(path, taxi, year, month, rows, seed=seed, chunk_rows=chunk_rows))
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic TLC-shaped trip data.")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Total rows across all files")
+    parser.add_argument('--raw-dir', default=None, help="Output directory (default: config.RAW_DIR)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generate_dataset(args.rows, raw_dir=args.raw_dir, seed=args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import config
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Tariff engine: for every trip, the congestion fees it should have paid under
+# the rate schedule (config.TARIFF_SCHEDULE) against what the TLC record shows.
+# Raw files are streamed in Arrow batches; expected fees, charged amounts and
+# shortfalls are computed as numpy arrays and summed into (pickup zone x hour)
+# grids per vendor with bincount in the same pass, so the output is dollars of
+# revenue at risk by zone, hour and vendor rather than trip counts.
+#
+# A fee is expected on trips that start or end in its own zone set (the 2019
+# surcharge south of 96th St, the 2025 toll south of 60th St), from the
+# schedule's start date, at its peak or off-peak rate for the taxi type. Trips
+# that only pass through a zone cannot be seen in the TLC data.
+
+# LocationIDs 1..265; index 0 collects missing or out-of-range IDs
+N_ZONES = 266
+HOURS = 24
+MEASURES = ['eligible_trips', 'expected_amount', 'charged_amount', 'shortfall_amount', 'short_trips']
+
+def load_schedule():
+    """config.TARIFF_SCHEDULE, or the JSON file named by AUDIT_TARIFF_SCHEDULE."""
+    if config.TARIFF_SCHEDULE_PATH:
+        with open(config.TARIFF_SCHEDULE_PATH) as f:
+            return json.load(f)
+    return config.TARIFF_SCHEDULE
+
+def scan_columns(schedule=None):
+    """Columns audit_file() reads (pickup without its tpep_/lpep_ prefix), for scan estimates."""
+    return ['VendorID', 'pickup_datetime', 'PULocationID', 'DOLocationID'] + list(schedule or load_schedule())
+
+def zone_ids(name):
+    """LocationIDs of a schedule zone set: 'cbd' or a key of config.TARIFF_ZONE_LATITUDES."""
+    import geospatial
+    if name == 'cbd':
+        return geospatial.get_congestion_zones()
+    if name not in config.TARIFF_ZONE_LATITUDES:
+        raise ValueError(f"Unknown tariff zone set '{name}'")
+    return geospatial.get_manhattan_zones_south_of(config.TARIFF_ZONE_LATITUDES[name])
+
+def zone_masks(schedule=None):
+    """{fee: boolean mask over LocationIDs} of the zones each fee applies in (default 'cbd')."""
+    schedule = schedule or load_schedule()
+    by_name = {}
+    masks = {}
+    for fee, rule in schedule.items():
+        name = rule.get('zones', 'cbd')
+        if name not in by_name:
+            mask = np.zeros(N_ZONES, dtype=bool)
+            mask[[z for z in zone_ids(name) if 0 < z < N_ZONES]] = True
+            by_name[name] = mask
+        masks[fee] = by_name[name]
+    return masks
+
+def time_of_day(pickup):
+    """(hour, is_peak) arrays for datetime64 pickups; peak bands from config.TARIFF_PEAK_HOURS."""
+    days = pickup.astype('datetime64[D]')
+    hour = ((pickup - days) // np.timedelta64(1, 'h')).astype(np.int64)
+    weekday = (days.astype(np.int64) + 3) % 7 < 5  # 1970-01-01 was a Thursday
+    wd_start, wd_end = config.TARIFF_PEAK_HOURS['weekday']
+    we_start, we_end = config.TARIFF_PEAK_HOURS['weekend']
+    peak = np.where(weekday, (hour >= wd_start) & (hour < wd_end), (hour >= we_start) & (hour < we_end))
+    return hour, peak
+
+def expected_fees(pickup, taxi_type, touches_zone, schedule=None):
+    """
+    Expected per-trip amount of every fee in the schedule: {fee: float64 array}.
+    touches_zone is {fee: bool array} of trips starting or ending in that fee's zones.
+    """
+    schedule = schedule or load_schedule()
+    _, peak = time_of_day(pickup)
+    expected = {}
+    for fee, rule in schedule.items():
+        active = touches_zone[fee] & (pickup >= np.datetime64(rule['start']))
+        if rule.get('end'):
+            active &= pickup < np.datetime64(rule['end'])
+        rate = np.where(peak, rule['peak'].get(taxi_type, 0.0), rule['off_peak'].get(taxi_type, 0.0))
+        expected[fee] = np.where(active, rate, 0.0)
+    return expected
+
+def _zone_ids(column):
+    ids = column.to_numpy(zero_copy_only=False)
+    ids = np.nan_to_num(ids.astype('float64'), nan=0).astype(np.int64)
+    ids[(ids < 0) | (ids >= N_ZONES)] = 0
+    return ids
+
+def _amounts(batch, name):
+    """A fee column as float64 with NULLs (or a missing column) as 0: not charged."""
+    if name not in batch.schema.names:
+        return np.zeros(batch.num_rows)
+    return np.nan_to_num(batch.column(name).to_numpy(zero_copy_only=False).astype('float64'))
+
+def audit_file(path, masks, schedule=None, batch_size=None):
+    """
+    Expected vs charged fees for one raw yellow/green file, aggregated in one
+    streaming pass. `masks` is zone_masks(schedule). Returns a DataFrame with fee, PULocationID, hour, VendorID
+    and MEASURES for every cell with eligible trips.
+    """
+    schedule = schedule or load_schedule()
+    name = os.path.basename(path)
+    taxi_type = 'yellow' if name.startswith('yellow') else 'green'
+    pickup_col = 'tpep_pickup_datetime' if taxi_type == 'yellow' else 'lpep_pickup_datetime'
+    pf = pq.ParquetFile(path)
+    missing = [fee for fee in schedule if fee not in pf.schema_arrow.names]
+    if missing:
+        logger.warning(f"{name} has no {missing} column(s); those fees count as not charged.")
+    columns = ['VendorID', pickup_col, 'PULocationID', 'DOLocationID'] + [f for f in schedule if f not in missing]
+
+    grids = {}
+    for batch in pf.iter_batches(batch_size=batch_size or config.TARIFF_BATCH_SIZE, columns=columns):
+        pickup = batch.column(pickup_col).to_numpy(zero_copy_only=False).astype('datetime64[us]')
+        valid = ~np.isnat(pickup)
+        pu = _zone_ids(batch.column('PULocationID'))
+        do = _zone_ids(batch.column('DOLocationID'))
+        vendor = np.nan_to_num(batch.column('VendorID').to_numpy(zero_copy_only=False).astype('float64'), nan=-1).astype(np.int64)
+        hour, _ = time_of_day(np.where(valid, pickup, np.datetime64(0, 'us')))
+        cell = pu * HOURS + hour
+
+        touches = {fee: mask[pu] | mask[do] for fee, mask in masks.items()}
+        expected = expected_fees(pickup, taxi_type, touches, schedule)
+        for fee, expected_amount in expected.items():
+            charged = _amounts(batch, fee)
+            shortfall = np.maximum(expected_amount - charged, 0.0)
+            eligible = valid & (expected_amount > 0)
+            for vendor_id in np.unique(vendor[eligible]):
+                rows = eligible & (vendor == vendor_id)
+                grid = grids.setdefault((fee, int(vendor_id)), np.zeros((len(MEASURES), N_ZONES * HOURS)))
+                c = cell[rows]
+                grid[0] += np.bincount(c, minlength=N_ZONES * HOURS)
+                grid[1] += np.bincount(c, weights=expected_amount[rows], minlength=N_ZONES * HOURS)
+                grid[2] += np.bincount(c, weights=charged[rows], minlength=N_ZONES * HOURS)
+                grid[3] += np.bincount(c, weights=shortfall[rows], minlength=N_ZONES * HOURS)
+                grid[4] += np.bincount(c, weights=(shortfall[rows] > 0), minlength=N_ZONES * HOURS)
+
+    frames = []
+    for (fee, vendor_id), grid in grids.items():
+        nonzero = np.flatnonzero(grid[0])
+        frame = pd.DataFrame({m: grid[i, nonzero] for i, m in enumerate(MEASURES)})
+        frame.insert(0, 'fee', fee)
+        frame.insert(1, 'PULocationID', nonzero // HOURS)
+        frame.insert(2, 'hour', nonzero % HOURS)
+        frame.insert(3, 'VendorID', vendor_id)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['fee', 'PULocationID', 'hour', 'VendorID'] + MEASURES)
+    return pd.concat(frames, ignore_index=True)
+
+def fee_leakage(paths, masks, schedule=None):
+    """audit_file() over many files, summed into one (fee, zone, hour, vendor) table."""
+    frames = [audit_file(p, masks, schedule) for p in paths]
+    keys = ['fee', 'PULocationID', 'hour', 'VendorID']
+    df = pd.concat(frames, ignore_index=True).groupby(keys, as_index=False)[MEASURES].sum()
+    return df.sort_values(keys).reset_index(drop=True)
+
+def run_tariff_audit(con):
+    """
+    Writes fee_leakage (expected vs charged congestion fees by fee, pickup zone,
+    hour and vendor) and the revenue_at_risk scalars to the results bundle.
+    Reads raw trips, so months imputed only into the daily cube are excluded.
+    """
+    import analytics
+    import imputation
+    logger.info("Running Tariff Audit...")
+    imputation.warn_cube_only('Tariff Audit', config.YEAR_2025)
+    schedule = load_schedule()
+    masks = zone_masks(schedule)
+    empty = [fee for fee, mask in masks.items() if not mask.any()]
+    if empty:
+        logger.warning(f"No zones found for {empty}. Skipping Tariff Audit.")
+        return
+    df = fee_leakage(analytics.stage_input_files('tariff'), masks, schedule)
+    results_bundle.write_table('fee_leakage', df)
+
+    by_fee = df.groupby('fee')['shortfall_amount'].sum()
+    results_bundle.write_scalar('revenue_at_risk', by_fee.sum())
+    for fee in schedule:
+        results_bundle.write_scalar(f'revenue_at_risk_{fee}', by_fee.get(fee, 0.0))
+        logger.info(f"{fee}: ${by_fee.get(fee, 0.0):,.2f} at risk")
+    logger.info("Tariff Audit Complete.")
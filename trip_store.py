@@ -0,0 +1,270 @@
+import os
+import glob
+import json
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import config
+import db
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+# Processed trip store. Each raw monthly file is rewritten with the unified
+# all_trips columns, sorted by (pickup date, DOLocationID), in small row groups.
+# A sidecar index holds per-row-group pickup min/max plus PU/DO zone bitmaps
+# (an exact membership filter, since zone IDs are small integers), so
+# date-windowed and zone-filtered reads only touch the row groups that can match:
+# pruned_dataset() hands DuckDB just those row groups (zone-filtered analytics,
+# replay windows), and read_trips() reads them straight into Arrow. DuckDB also
+# prunes the sorted files itself from the parquet min/max stats, but min/max
+# cannot rule out a row group whose zone range merely spans the wanted zones.
+
+STORE_DIR = os.path.join(config.PROCESSED_DIR, 'trips')
+INDEX_PATH = os.path.join(STORE_DIR, '_index.parquet')
+STATE_PATH = os.path.join(STORE_DIR, '_store.json')
+
+# Zone IDs 1..265 fit in a 272-bit bitmap; anything outside sets every bit (never pruned)
+ZONE_BITS = 272
+
+UNIFIED_COLUMNS = [
+    'VendorID', 'pickup_datetime', 'dropoff_datetime', 'trip_distance', 'fare_amount',
+    'total_amount', 'tip_amount', 'congestion_surcharge', 'PULocationID', 'DOLocationID', 'taxi_type'
+]
+
+def store_path(raw_path):
+    return os.path.join(STORE_DIR, os.path.basename(raw_path))
+
+def _load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH) as f:
+        return json.load(f)
+
+def _save_state(state):
+    tmp_path = STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, STATE_PATH)
+
+def raw_files(year=None, taxi_types=None):
+    taxi_types = taxi_types or config.TAXI_TYPES
+    year_glob = str(year) if year else '*'
+    return sorted(
+        p for taxi in taxi_types
+        for p in glob.glob(os.path.join(config.RAW_DIR, f"{taxi}_tripdata_{year_glob}-*.parquet"))
+    )
+
+def is_current(raw_path, state=None):
+    state = _load_state() if state is None else state
+    name = os.path.basename(raw_path)
+    return (
+        os.path.exists(store_path(raw_path))
+        and state.get(name) == results_bundle.fingerprint_files([raw_path])
+    )
+
+def store_files(year):
+    """Store files for a year if every raw file of that year is stored and current, else None."""
+    state = _load_state()
+    raws = raw_files(year)
+    if not raws or not all(is_current(p, state) for p in raws):
+        return None
+    return [store_path(p) for p in raws]
+
+def unified_select(raw_path):
+    """SELECT over one raw yellow/green file with the unified all_trips columns."""
+    name = os.path.basename(raw_path)
+    prefix = 'tpep' if name.startswith('yellow') else 'lpep'
+    label = 'Yellow' if name.startswith('yellow') else 'Green'
+    return f"""
+        SELECT
+            VendorID,
+            {prefix}_pickup_datetime AS pickup_datetime,
+            {prefix}_dropoff_datetime AS dropoff_datetime,
+            trip_distance,
+            fare_amount,
+            total_amount,
+            tip_amount,
+            congestion_surcharge,
+            PULocationID,
+            DOLocationID,
+            '{label}' AS taxi_type
+        FROM '{raw_path}'
+    """
+
+def trips_source(raw_path, state=None):
+    """FROM-able SQL for one raw file's trips: its store file when current, else the raw file."""
+    if is_current(raw_path, state):
+        return f"'{store_path(raw_path)}'"
+    return f"({unified_select(raw_path)})"
+
+def _write_sorted(con, raw_path, output_path):
+    tmp_path = output_path + '.tmp'
+    con.execute(f"""
+    COPY (
+        {unified_select(raw_path)}
+        ORDER BY CAST(pickup_datetime AS DATE), DOLocationID, pickup_datetime
+    ) TO '{tmp_path}' ({db.parquet_copy_options(config.TRIP_STORE_ROW_GROUP_SIZE)})
+    """)
+    os.replace(tmp_path, output_path)
+
+def _zone_bitmap(values):
+    values = np.asarray(values.drop_null() if hasattr(values, 'drop_null') else values)
+    bits = np.zeros(ZONE_BITS, dtype=bool)
+    if len(values) and (values.min() < 0 or values.max() >= ZONE_BITS):
+        bits[:] = True
+    else:
+        bits[np.unique(values)] = True
+    return np.packbits(bits).tobytes()
+
+def _index_file(path):
+    """One index row per row group: pickup range, zone ranges and zone bitmaps."""
+    pf = pq.ParquetFile(path)
+    names = pf.schema_arrow.names
+    rows = []
+    for i in range(pf.num_row_groups):
+        meta = pf.metadata.row_group(i)
+        stats = {name: meta.column(names.index(name)).statistics for name in ('pickup_datetime', 'PULocationID', 'DOLocationID')}
+        zones = pf.read_row_group(i, columns=['PULocationID', 'DOLocationID'])
+        rows.append({
+            'file': os.path.basename(path),
+            'row_group': i,
+            'num_rows': meta.num_rows,
+            'pickup_min': stats['pickup_datetime'].min if stats['pickup_datetime'] is not None else None,
+            'pickup_max': stats['pickup_datetime'].max if stats['pickup_datetime'] is not None else None,
+            'pu_bitmap': _zone_bitmap(zones.column('PULocationID')),
+            'do_bitmap': _zone_bitmap(zones.column('DOLocationID')),
+        })
+    return rows
+
+def build_trip_store(years=None, force=False, taxi_types=None):
+    """
+    (Re)writes the store for raw files that are new or changed since the last
+    build and refreshes the sidecar index. Returns the rebuilt store paths.
+    Months imputed only into the daily cube have no raw file and are not stored.
+    """
+    import imputation
+    for year in (years or [None]):
+        imputation.warn_cube_only('Trip store', year, taxi_types)
+    os.makedirs(STORE_DIR, exist_ok=True)
+    state = _load_state()
+    raws = [p for y in years for p in raw_files(y, taxi_types)] if years else raw_files(taxi_types=taxi_types)
+    todo = [p for p in raws if force or not is_current(p, state)]
+    if not todo:
+        logger.info("Trip store is up to date.")
+        return []
+
+    con = db.create_connection()
+    try:
+        for raw_path in todo:
+            _write_sorted(con, raw_path, store_path(raw_path))
+            state[os.path.basename(raw_path)] = results_bundle.fingerprint_files([raw_path])
+            logger.info(f"Stored {os.path.basename(raw_path)} sorted by (pickup date, DOLocationID)")
+    finally:
+        con.close()
+    _save_state(state)
+
+    rebuilt = {os.path.basename(p) for p in todo}
+    index = load_index()
+    if not index.empty:
+        index = index[~index['file'].isin(rebuilt)]
+    new_rows = pd.DataFrame([row for p in todo for row in _index_file(store_path(p))])
+    index = pd.concat([index, new_rows], ignore_index=True) if not index.empty else new_rows
+    index.sort_values(['file', 'row_group']).to_parquet(INDEX_PATH, index=False)
+    return [store_path(p) for p in todo]
+
+def load_index():
+    if not os.path.exists(INDEX_PATH):
+        return pd.DataFrame()
+    return pd.read_parquet(INDEX_PATH)
+
+def _bitmap_matches(bitmaps, zone_ids):
+    """Row groups whose bitmap contains any of zone_ids."""
+    wanted = np.zeros(ZONE_BITS, dtype=bool)
+    ids = np.asarray([z for z in zone_ids if 0 <= z < ZONE_BITS], dtype=int)
+    wanted[ids] = True
+    packed = np.frombuffer(b''.join(bitmaps), dtype=np.uint8).reshape(len(bitmaps), -1)
+    return (np.unpackbits(packed, axis=1)[:, :ZONE_BITS] & wanted).any(axis=1)
+
+def prune(start=None, end=None, do_zones=None, pu_zones=None, index=None):
+    """
+    Index rows (file, row_group, num_rows) that may hold trips with
+    start <= pickup < end, DOLocationID in do_zones and PULocationID in pu_zones.
+    """
+    index = load_index() if index is None else index
+    if index.empty:
+        return index
+    keep = np.ones(len(index), dtype=bool)
+    if start is not None:
+        keep &= (index['pickup_max'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (index['pickup_min'] < pd.Timestamp(end)).to_numpy()
+    if do_zones is not None:
+        keep &= _bitmap_matches(index['do_bitmap'].tolist(), do_zones)
+    if pu_zones is not None:
+        keep &= _bitmap_matches(index['pu_bitmap'].tolist(), pu_zones)
+    selected = index[keep]
+    logger.info(
+        f"Trip store pruning kept {len(selected)}/{len(index)} row groups "
+        f"({selected['num_rows'].sum():,}/{index['num_rows'].sum():,} rows)"
+    )
+    return selected
+
+def pruned_dataset(paths, start=None, end=None, do_zones=None, pu_zones=None):
+    """
+    pyarrow Dataset over only the row groups of the store files `paths` that
+    prune() keeps, for DuckDB to scan (con.register); exact filters still apply
+    in the query. None if the index does not cover every file.
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    if not paths:
+        return None
+    names = {os.path.basename(p) for p in paths}
+    index = load_index()
+    if index.empty or not names <= set(index['file']):
+        return None
+    selected = prune(start, end, do_zones, pu_zones, index=index[index['file'].isin(names)])
+    fmt = ds.ParquetFileFormat()
+    filesystem = pyarrow.fs.LocalFileSystem()
+    fragments = [
+        fmt.make_fragment(os.path.join(STORE_DIR, name), filesystem, row_groups=group['row_group'].tolist())
+        for name, group in selected.groupby('file', sort=True)
+    ]
+    return ds.FileSystemDataset(fragments, pq.read_schema(sorted(paths)[0]), fmt, filesystem)
+
+def read_trips(start=None, end=None, do_zones=None, pu_zones=None, columns=None):
+    """
+    Reads only the row groups the index keeps, then applies the exact filters.
+    Returns a pyarrow Table with the unified columns (or `columns`).
+    """
+    selected = prune(start, end, do_zones, pu_zones)
+    columns = columns or UNIFIED_COLUMNS
+    filter_columns = [c for c in ('pickup_datetime', 'DOLocationID', 'PULocationID') if c not in columns]
+    tables = []
+    for name, group in selected.groupby('file', sort=True):
+        pf = pq.ParquetFile(os.path.join(STORE_DIR, name))
+        tables.append(pf.read_row_groups(group['row_group'].tolist(), columns=columns + filter_columns))
+    if not tables:
+        return pa.table({c: [] for c in columns})
+    table = pa.concat_tables(tables)
+
+    mask = None
+    conditions = []
+    if start is not None:
+        conditions.append(pc.greater_equal(table['pickup_datetime'], pa.scalar(pd.Timestamp(start), table['pickup_datetime'].type)))
+    if end is not None:
+        conditions.append(pc.less(table['pickup_datetime'], pa.scalar(pd.Timestamp(end), table['pickup_datetime'].type)))
+    if do_zones is not None:
+        conditions.append(pc.is_in(table['DOLocationID'], pa.array(do_zones, table['DOLocationID'].type)))
+    if pu_zones is not None:
+        conditions.append(pc.is_in(table['PULocationID'], pa.array(pu_zones, table['PULocationID'].type)))
+    for condition in conditions:
+        mask = condition if mask is None else pc.and_(mask, condition)
+    if mask is not None:
+        table = table.filter(mask)
+    return table.select(columns)
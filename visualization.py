@@ -1,3 +1,5 @@
+import matplotlib
+matplotlib.use('Agg')  # Charts are rendered off-screen, possibly in worker processes
 import seaborn as sns
 import matplotlib.pyplot as plt
 import os
@@ -27,3 +29,43 @@ def plot_economics(df, output_path):
     plt.savefig(output_path)
     plt.close()
 
+# Indexed by DuckDB dayofweek(): Sunday = 0
+DAY_LABELS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+def plot_velocity_heatmap(df, output_path, period):
+    """
+    Plots avg speed by day of week x hour of day for one period ('2024 Q1' / '2025 Q1').
+    """
+    pivot = df[df['period'] == period].pivot(index='dow', columns='hod', values='avg_speed')
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.heatmap(pivot, cmap="YlOrRd_r", annot=False, ax=ax, cbar_kws={'label': 'Speed (mph)'})
+    ax.set_title(f"Average Speed in Congestion Zone - {period}")
+    ax.set_xlabel("Hour of Day")
+    ax.set_ylabel("Day of Week")
+    ax.set_yticklabels([DAY_LABELS[int(d) % 7] for d in pivot.index], rotation=0)
+    fig.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+
+def plot_border_map(df, output_path, shapefile_path, borough=None):
+    """
+    Static snapshot of the border effect map: % change in drop-offs per zone.
+    """
+    import geopandas as gpd
+
+    zones = gpd.read_file(shapefile_path)
+    if borough is not None:
+        zones = zones[zones['borough'] == borough]
+    zones = zones.merge(df, left_on='LocationID', right_on='DOLocationID', how='left')
+    zones['pct_change'] = zones['pct_change'].fillna(0)
+
+    fig, ax = plt.subplots(figsize=(8, 8))
+    limit = max(abs(zones['pct_change'].quantile(0.05)), abs(zones['pct_change'].quantile(0.95)), 1)
+    zones.plot(column='pct_change', cmap='RdBu_r', vmin=-limit, vmax=limit, linewidth=0.2,
+               edgecolor='grey', legend=True, ax=ax,
+               legend_kwds={'label': '% Change in Drop-offs (2025 vs 2024)', 'shrink': 0.6})
+    ax.set_axis_off()
+    plt.title(f"Border Effect - {borough or 'All Boroughs'}")
+    fig.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
@@ -0,0 +1,194 @@
+import os
+import logging
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import config
+import daily_cube
+import results_bundle
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+WEATHER_START = date(config.YEAR_2025, 1, 1)
+WEATHER_END = date(config.YEAR_2025, 12, 31)
+
+def _fetch_open_meteo(start, end, variables):
+    """Fetches daily NYC weather from the Open-Meteo archive (HTTP responses are cached on disk)."""
+    import openmeteo_requests
+    import requests_cache
+    from retry_requests import retry
+
+    cache_session = requests_cache.CachedSession(config.WEATHER_CACHE, expire_after=-1)
+    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+    client = openmeteo_requests.Client(session=retry_session)
+
+    params = {
+        "latitude": config.NYC_LATITUDE,
+        "longitude": config.NYC_LONGITUDE,
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "daily": variables,
+        "timezone": config.WEATHER_TIMEZONE,
+    }
+    response = client.weather_api(config.WEATHER_API_URL, params=params)[0]
+    daily = response.Daily()
+
+    dates = pd.date_range(
+        start=pd.to_datetime(daily.Time(), unit="s"),
+        end=pd.to_datetime(daily.TimeEnd(), unit="s"),
+        freq=pd.Timedelta(seconds=daily.Interval()),
+        inclusive="left"
+    )
+    df = pd.DataFrame({"date": dates.date})
+    for i, var in enumerate(variables):
+        df[var] = daily.Variables(i).ValuesAsNumpy()
+    return df
+
+def _load_local(path, variables):
+    """Loads a local CSV/parquet stand-in with a 'date' column and the daily variables."""
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    missing = [c for c in ['date'] + variables if c not in df.columns]
+    if missing:
+        raise ValueError(f"Weather file {path} is missing columns: {missing}")
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    return df[['date'] + variables]
+
+def _cached_weather_covers(start, end, variables):
+    """True if the weather parquet already holds every requested day and variable."""
+    if not os.path.exists(config.WEATHER_PARQUET):
+        return False
+    import pyarrow.parquet as pq
+    schema_names = pq.read_schema(config.WEATHER_PARQUET).names
+    if any(v not in schema_names for v in variables):
+        return False
+    dates = pd.read_parquet(config.WEATHER_PARQUET, columns=['date'])['date']
+    return bool(len(dates)) and dates.min() <= start and dates.max() >= end
+
+def fetch_weather_data(start=None, end=None, source=None, force=False):
+    """
+    Loads daily NYC weather into WEATHER_PARQUET.
+    Repeated runs reuse the parquet as long as it covers the requested range,
+    so the source is only hit once.
+    """
+    start = start or WEATHER_START
+    # The archive lags real time by a few days
+    end = min(end or WEATHER_END, date.today() - timedelta(days=5))
+    source = source or config.WEATHER_SOURCE
+    variables = list(config.WEATHER_DAILY_VARIABLES)
+
+    if not force and _cached_weather_covers(start, end, variables):
+        logger.info("Weather data already cached. Skipping fetch.")
+        return config.WEATHER_PARQUET
+
+    logger.info(f"Loading weather data {start} to {end} from {source}...")
+    if source == 'open-meteo':
+        df = _fetch_open_meteo(start, end, variables)
+    else:
+        df = _load_local(source, variables)
+
+    # Typed storage: date32 + float32 measurements
+    df = df[(df['date'] >= start) & (df['date'] <= end)].sort_values('date')
+    df = df.astype({v: 'float32' for v in variables})
+    df.to_parquet(config.WEATHER_PARQUET, index=False)
+    logger.info(f"Weather data saved to {config.WEATHER_PARQUET} ({len(df)} days)")
+    return config.WEATHER_PARQUET
+
+def correlate_rows(matrix, x):
+    """
+    Pearson correlation of every row of `matrix` (groups x days) against vector `x` (days),
+    computed in one vectorized pass. Rows with zero variance yield NaN.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    xc = x - x.mean()
+    mc = matrix - matrix.mean(axis=1, keepdims=True)
+    denom = np.sqrt((mc ** 2).sum(axis=1)) * np.sqrt((xc ** 2).sum())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (mc @ xc) / denom
+
+def _pivot_correlation(df, key, weather):
+    """Pivots (key, date, trip_count) into a key x day matrix and correlates it with precipitation."""
+    matrix = df.pivot(index=key, columns='date', values='trip_count')
+    matrix = matrix.reindex(columns=weather['date']).fillna(0)
+    corr = correlate_rows(matrix.to_numpy(), weather['precipitation_sum'].to_numpy())
+    return pd.DataFrame({
+        key: matrix.index,
+        'trip_count': matrix.sum(axis=1).to_numpy(),
+        'elasticity': corr
+    })
+
+def calculate_elasticity(con):
+    """
+    Rain elasticity: correlation between daily trip count and precipitation.
+    Daily, per-zone and per-hour counts come from the daily cube joined to the
+    weather parquet; the correlations are vectorized.
+    """
+    logger.info("Running Weather Elasticity...")
+
+    if not os.path.exists(config.WEATHER_PARQUET):
+        fetch_weather_data()
+
+    # Daily and per-zone counts come from the daily cube, per-hour counts from its
+    # hourly roll-up; both are tiny compared to the trips they summarise.
+    daily_cube.build_cube()
+    daily_cube.register_views(con)
+    cube_filter = f"""
+        source_year = {config.YEAR_2025}
+        AND date >= DATE '{WEATHER_START}' AND date < DATE '{WEATHER_END + timedelta(days=1)}'
+    """
+    daily_query = f"""
+    WITH w AS (
+        SELECT date, precipitation_sum FROM read_parquet('{config.WEATHER_PARQUET}')
+    ),
+    by_zone AS (
+        SELECT date, PULocationID, SUM(trip_count) AS trip_count
+        FROM daily_cube WHERE {cube_filter}
+        GROUP BY ALL
+    ),
+    by_hour AS (
+        SELECT date, hour, SUM(trip_count) AS trip_count
+        FROM hourly_cube WHERE {cube_filter}
+        GROUP BY ALL
+    )
+    SELECT date, NULL::BIGINT AS hour, NULL::BIGINT AS PULocationID,
+        CAST(SUM(trip_count) AS BIGINT) AS trip_count, precipitation_sum, 3 AS grouping_set
+    FROM by_zone JOIN w USING (date)
+    GROUP BY date, precipitation_sum
+    UNION ALL
+    SELECT date, NULL, PULocationID, CAST(trip_count AS BIGINT), precipitation_sum, 1
+    FROM by_zone JOIN w USING (date)
+    UNION ALL
+    SELECT date, hour, NULL, CAST(trip_count AS BIGINT), precipitation_sum, 2
+    FROM by_hour JOIN w USING (date)
+    """
+    agg = con.execute(daily_query).df()
+    agg['date'] = pd.to_datetime(agg['date'])
+
+    # grouping_set bits: 2 = PULocationID rolled up, 1 = hour rolled up
+    daily = agg[agg['grouping_set'] == 3]
+    daily = daily[['date', 'trip_count', 'precipitation_sum']].sort_values('date').reset_index(drop=True)
+    if len(daily) < 2:
+        logger.warning("Not enough overlapping trip/weather days. Skipping Elasticity.")
+        return None
+
+    results_bundle.write_table('trips_vs_weather', daily)
+
+    elasticity_score = float(correlate_rows(daily['trip_count'].to_numpy()[None, :], daily['precipitation_sum'])[0])
+    results_bundle.write_scalar('elasticity_score', elasticity_score)
+
+    weather = daily[['date', 'precipitation_sum']]
+    by_zone = agg[(agg['grouping_set'] == 1) & agg['PULocationID'].notna()].astype({'PULocationID': int})
+    by_hour = agg[(agg['grouping_set'] == 2) & agg['hour'].notna()].astype({'hour': int})
+    results_bundle.write_table('elasticity_by_zone', _pivot_correlation(by_zone, 'PULocationID', weather))
+    results_bundle.write_table('elasticity_by_hour', _pivot_correlation(by_hour, 'hour', weather))
+
+    logger.info(f"Weather Elasticity Complete. Score: {elasticity_score:.4f}")
+    return elasticity_score
+
+def run_weather_analysis(con):
+    fetch_weather_data()
+    calculate_elasticity(con)
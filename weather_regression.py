@@ -0,0 +1,147 @@
+import os
+import logging
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from pandas.tseries.holiday import USFederalHolidayCalendar
+import config
+import db
+import results_bundle
+import weather
+
+# Setup Logger
+logger = logging.getLogger(__name__)
+
+DAILY_ZONE_PATH = os.path.join(config.PROCESSED_DIR, 'daily_zone_band_trips.parquet')
+GROUP_KEYS = ['borough', 'hour_band', 'taxi_type']
+
+def _hour_band_case(column):
+    """SQL CASE expression mapping an hour column onto config.HOUR_BANDS."""
+    whens = []
+    for band, (start, end) in config.HOUR_BANDS.items():
+        if start < end:
+            whens.append(f"WHEN {column} >= {start} AND {column} < {end} THEN '{band}'")
+        else:
+            # Band wraps midnight
+            whens.append(f"WHEN {column} >= {start} OR {column} < {end} THEN '{band}'")
+    return "CASE " + " ".join(whens) + " END"
+
+def build_daily_zone_aggregate(con):
+    """
+    One scan over all_trips_2025 into a daily x zone x hour band x taxi type count table.
+    Every model in the grid is fitted from this small table instead of raw trips.
+    Months imputed only into the daily cube have no trips here and are excluded.
+    """
+    import imputation
+    imputation.warn_cube_only('Weather regression', config.YEAR_2025)
+    query = f"""
+    SELECT
+        CAST(pickup_datetime AS DATE) as date,
+        PULocationID,
+        taxi_type,
+        {_hour_band_case('hour(pickup_datetime)')} as hour_band,
+        count(*) as trip_count
+    FROM all_trips_2025
+    WHERE pickup_datetime >= '{weather.WEATHER_START}' AND pickup_datetime < '{weather.WEATHER_END + timedelta(days=1)}'
+    GROUP BY ALL
+    """
+    con.execute(f"COPY ({query}) TO '{DAILY_ZONE_PATH}' ({db.parquet_copy_options()})")
+    return DAILY_ZONE_PATH
+
+def build_design_matrix(weather_df):
+    """
+    Daily regressors shared by every group: intercept, rain/snow/temperature bins,
+    day-of-week dummies (Monday baseline) and a federal holiday flag.
+    Returns (X, term_names); terms that never occur in the window are dropped.
+    """
+    dates = pd.to_datetime(weather_df['date'])
+    precip = weather_df['precipitation_sum'].to_numpy()
+    columns = {'intercept': np.ones(len(dates))}
+
+    rain_bounds = sorted(config.RAIN_BINS.items(), key=lambda kv: kv[1])
+    for i, (name, lower) in enumerate(rain_bounds):
+        upper = rain_bounds[i + 1][1] if i + 1 < len(rain_bounds) else np.inf
+        columns[name] = ((precip >= lower) & (precip < upper)).astype(float)
+
+    columns['snow'] = (weather_df['snowfall_sum'].to_numpy() > 0).astype(float)
+
+    temp = weather_df['temperature_2m_mean'].to_numpy()
+    for name, (lower, upper) in config.TEMPERATURE_BINS.items():
+        columns[name] = ((temp >= lower) & (temp < upper)).astype(float)
+
+    dow = dates.dt.dayofweek.to_numpy()
+    for d, name in enumerate(['tue', 'wed', 'thu', 'fri', 'sat', 'sun'], start=1):
+        columns[f'dow_{name}'] = (dow == d).astype(float)
+
+    holidays = USFederalHolidayCalendar().holidays(start=dates.min(), end=dates.max())
+    columns['holiday'] = dates.isin(holidays).astype(float).to_numpy()
+
+    terms = [t for t, values in columns.items() if t == 'intercept' or values.any()]
+    X = np.column_stack([columns[t] for t in terms])
+    return X, terms
+
+def fit_batched(X, Y):
+    """
+    Fits log(1 + trips) = X @ beta for every column of Y (days x groups) in one
+    least-squares solve, since all groups share the same daily design.
+    Returns (beta, std_err), each terms x groups.
+    """
+    n, k = X.shape
+    beta, _, rank, _ = np.linalg.lstsq(X, Y, rcond=None)
+    resid = Y - X @ beta
+    dof = max(n - rank, 1)
+    sigma2 = (resid ** 2).sum(axis=0) / dof
+    xtx_inv_diag = np.diag(np.linalg.pinv(X.T @ X))
+    std_err = np.sqrt(np.outer(xtx_inv_diag, sigma2))
+    return beta, std_err
+
+def run_weather_regression(con):
+    """
+    Estimates demand elasticity to rain, snow and temperature bins per
+    borough x hour band x taxi type, controlling for day of week and holidays.
+    """
+    logger.info("Running Weather Regression...")
+    import geospatial
+
+    weather.fetch_weather_data()
+    build_daily_zone_aggregate(con)
+
+    weather_df = pd.read_parquet(config.WEATHER_PARQUET).dropna().sort_values('date').reset_index(drop=True)
+    weather_df['date'] = pd.to_datetime(weather_df['date'])
+
+    trips = pd.read_parquet(DAILY_ZONE_PATH)
+    trips['date'] = pd.to_datetime(trips['date'])
+    zones = geospatial.get_zone_lookup()[['LocationID', 'borough']]
+    trips = trips.merge(zones, left_on='PULocationID', right_on='LocationID', how='inner')
+
+    cube = trips.groupby(['date'] + GROUP_KEYS, observed=True)['trip_count'].sum()
+    # Only days with trip data: a month that is missing or not yet published is
+    # unobserved, not zero demand
+    weather_df = weather_df[weather_df['date'].isin(cube.index.get_level_values('date'))].reset_index(drop=True)
+    # days x groups; a group with no trips on an observed day counts as zero demand
+    Y_df = cube.unstack(GROUP_KEYS).reindex(weather_df['date']).fillna(0)
+    Y_df = Y_df.loc[:, Y_df.sum(axis=0) > 0]
+    if Y_df.empty or len(weather_df) < 2:
+        logger.warning("No trips overlap the weather window. Skipping Weather Regression.")
+        return None
+
+    X, terms = build_design_matrix(weather_df)
+    beta, std_err = fit_batched(X, np.log1p(Y_df.to_numpy()))
+
+    groups = Y_df.columns.to_frame(index=False)
+    results = []
+    for i, term in enumerate(terms):
+        if term == 'intercept':
+            continue
+        frame = groups.copy()
+        frame['term'] = term
+        frame['coef'] = beta[i]
+        frame['std_err'] = std_err[i]
+        frame['pct_effect'] = np.expm1(beta[i]) * 100
+        frame['n_days'] = len(weather_df)
+        results.append(frame)
+    results = pd.concat(results, ignore_index=True)
+
+    results_bundle.write_table('weather_regression', results)
+    logger.info(f"Weather Regression Complete. Fitted {Y_df.shape[1]} models x {len(terms)} terms.")
+    return results